@@ -1,46 +1,130 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify, send_from_directory
+from flask.helpers import get_debug_flag
 import mysql.connector
 from mysql.connector import Error
 from functools import wraps
 import logging
 import os
-from werkzeug.utils import secure_filename
 from datetime import datetime  # Import untuk penanganan tanggal
 
+from bookstore import auth, blobstore
+from bookstore.cache import Cache
+from bookstore.images import CoverProcessor, srcset, variant_source
+from bookstore.perf import PerfMonitor
+from bookstore.sessions import ServerSessionInterface, SQLiteSessionStore
+from bookstore.uploads import UploadError, UploadRequest, save_upload
+from db_pool import ConnectionPool
+
 # ============================
 #   KONFIGURASI APLIKASI
 # ============================
 app = Flask(__name__)
+app.request_class = UploadRequest  # file upload langsung di-stream ke disk
 app.secret_key = "rahasia_super"  # Ganti dengan secret key yang kuat untuk production
-app.debug = True
+app.debug = get_debug_flag()  # FLASK_DEBUG=1 untuk development; default mati
 
 # --- Upload File ---
 UPLOAD_FOLDER = 'static/image/cover'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+COVER_CACHE_MAX_AGE = 365 * 24 * 3600  # nama file = hash isi, tidak pernah berubah
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024   # batas seluruh request
+app.config['MAX_UPLOAD_FILE_SIZE'] = 8 * 1024 * 1024  # batas per file
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Varian cover (WebP/JPEG beberapa ukuran) dibuat di thread terpisah
+covers = CoverProcessor()
+
+# --- Cache hasil query ---
+# CACHE_DIR (mis. /dev/shm/tokobuku-cache) membuat cache dipakai bersama antar worker gunicorn
+cache = Cache(
+    max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 1024)),
+    ttl=int(os.environ.get('CACHE_TTL', 300)),
+    shared_dir=os.environ.get('CACHE_DIR'),
+)
+
+# --- Sesi ---
+# Cookie hanya berisi id sesi yang ditandatangani; isinya disimpan di SQLite
+# (SESSION_DB) dan dipakai bersama oleh semua worker
+os.makedirs(app.instance_path, exist_ok=True)
+session_store = SQLiteSessionStore(os.environ.get('SESSION_DB', os.path.join(app.instance_path, 'sessions.db')))
+app.session_interface = ServerSessionInterface(session_store)
+
+# --- Password ---
+# Password lama (teks biasa atau hash dengan cost lain) diganti hash baru saat login berhasil
+passwords = auth.PasswordHasher(
+    method=os.environ.get('PASSWORD_HASH_METHOD', auth.DEFAULT_METHOD),
+    allow_plaintext=True,
+)
+
+# --- Admin ---
+# Tabel users tidak punya kolom peran; admin ditentukan lewat ADMIN_USERNAMES
+# (dipisah koma), mis. ADMIN_USERNAMES=budi,sari
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+# --- Database ---
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'database': os.environ.get('DB_NAME', 'db_buku'),
+}
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # detik
+
 # --- Logging ---
-logging.basicConfig(level=logging.DEBUG)
+# DEBUG membanjiri stdout; atur lewat LOG_LEVEL bila perlu
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+# --- Instrumentasi query ---
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG')  # file JSON lines, opsional
+app.config['SERVER_TIMING_SKIP'] = {'cover_file'}  # cover di-cache publik, jangan baca sesi
+perf = PerfMonitor(app)
 
 # ============================
 #   HELPER FUNCTIONS
 # ============================
+def create_connection():
+    """Membuat koneksi baru ke database MySQL (setiap query dicatat waktunya)"""
+    return perf.instrument_connection(mysql.connector.connect(**DB_CONFIG))
+
+pool = ConnectionPool(
+    create_connection,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    recycle=DB_POOL_RECYCLE
+)
+
 def get_connection():
-    """Membuat koneksi ke database MySQL"""
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="",
-        database="db_buku"
-    )
+    """Ambil koneksi dari pool; close() mengembalikannya ke pool.
+
+    Koneksi dicatat per request sehingga yang lupa ditutup tetap
+    dikembalikan saat request selesai.
+    """
+    conn = pool.acquire()
+    g.setdefault('db_connections', []).append(conn)
+    return conn
+
+@app.teardown_appcontext
+def release_connections(exception=None):
+    for conn in g.pop('db_connections', []):
+        conn.close()
 
 def allowed_file(filename):
     """Cek ekstensi file yang diperbolehkan"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def cover_srcset(gambar):
+    """srcset WebP untuk cover buku (kosong jika varian belum tersedia)"""
+    manifest = covers.manifest(UPLOAD_FOLDER, gambar)
+    return srcset(manifest, lambda name: url_for('cover_file', filename=name), 'webp')
+
+app.add_template_global(cover_srcset)
+
 def login_required(f):
     """Decorator untuk memastikan pengguna sudah login"""
     @wraps(f)
@@ -51,29 +135,47 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    """Decorator untuk halaman yang hanya boleh dibuka admin"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'logged_in' not in session or not session['logged_in']:
+            flash('Anda harus login untuk mengakses halaman ini.', 'warning')
+            return redirect(url_for('login_page'))
+        if not session.get('is_admin'):
+            flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'danger')
+            return redirect(url_for('dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
+
 # ============================
 #   ROUTES
 # ============================
 
 # --- DASHBOARD ---
-@app.route('/', methods=['GET'])
-def dashboard():
+def ambil_buku_terbaru():
+    """12 buku terbaru untuk dashboard (hasilnya di-cache)"""
     db = cursor = None
-    buku_list = []
     try:
         db = get_connection()
         # Menggunakan dictionary=True agar hasil query berupa dict
         cursor = db.cursor(dictionary=True) 
         # Ambil kolom yang diperlukan (pastikan id_buku sesuai dengan nama kolom di DB)
         cursor.execute("SELECT id_buku, judul, penulis, harga, gambar FROM produk_buku ORDER BY id_buku DESC LIMIT 12")
-        buku_list = cursor.fetchall()
-    except Error as e:
-        app.logger.error("Database error saat ambil daftar buku: %s", e)
-        flash("Gagal memuat daftar buku. Coba lagi nanti.", "danger")
+        return cursor.fetchall()
     finally:
         if cursor: cursor.close()
         if db: db.close()
 
+@app.route('/', methods=['GET'])
+def dashboard():
+    buku_list = []
+    try:
+        buku_list = cache.get_or_set('buku_terbaru', ['produk_buku'], ambil_buku_terbaru)
+    except Error as e:
+        app.logger.error("Database error saat ambil daftar buku: %s", e)
+        flash("Gagal memuat daftar buku. Coba lagi nanti.", "danger")
+
     # Mengirim buku_list ke home.html
     return render_template('home.html', buku_list=buku_list)
 
@@ -98,10 +200,7 @@ def login():
     try:
         db = get_connection()
         cursor = db.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT id, username FROM users WHERE username=%s AND password=%s",
-            (username, password)
-        )
+        cursor.execute("SELECT id, username, password FROM users WHERE username=%s", (username,))
         user = cursor.fetchone()
     except Error as e:
         app.logger.error("Database error saat login: %s", e)
@@ -111,10 +210,32 @@ def login():
         if cursor: cursor.close()
         if db: db.close()
 
-    if user:
+    # Dicek setelah koneksi dikembalikan ke pool, hashing tidak menahan koneksi
+    try:
+        ok, hash_baru = passwords.verify(user['password'] if user else None, password)
+    except auth.HasherBusy:
+        flash("Server sedang sibuk, silakan coba lagi sebentar.", "danger")
+        return redirect(url_for('login_page'))
+
+    if ok and hash_baru:
+        db = cursor = None
+        try:
+            db = get_connection()
+            cursor = db.cursor()
+            cursor.execute("UPDATE users SET password=%s WHERE id=%s", (hash_baru, user['id']))
+            db.commit()
+        except Error as e:
+            # Login tetap jalan; hash diperbarui pada login berikutnya
+            app.logger.warning("Gagal memperbarui hash password user %s: %s", user['id'], e)
+        finally:
+            if cursor: cursor.close()
+            if db: db.close()
+
+    if ok:
         session['logged_in'] = True
         session['user_id'] = user['id']
         session['username'] = user['username']
+        session['is_admin'] = user['username'] in ADMIN_USERNAMES
         flash(f"Selamat datang, {username}!", "success")
         return redirect(url_for('dashboard'))
     else:
@@ -182,6 +303,12 @@ def register():
             flash("Password minimal 6 karakter.", "danger")
             return redirect(url_for('register'))
 
+        try:
+            hash_password = passwords.hash(password)
+        except auth.HasherBusy:
+            flash("Server sedang sibuk, silakan coba lagi sebentar.", "danger")
+            return redirect(url_for('register'))
+
         db = cursor = None
         try:
             db = get_connection()
@@ -193,7 +320,7 @@ def register():
 
             cursor.execute(
                 "INSERT INTO users (nama_lengkap, username, password, email, whatsapp) VALUES (%s, %s, %s, %s, %s)",
-                (nama or None, username, password, email or None, whatsapp or None)
+                (nama or None, username, hash_password, email or None, whatsapp or None)
             )
             db.commit()
             flash("Akun berhasil dibuat! Silakan login.", "success")
@@ -209,26 +336,48 @@ def register():
     return render_template('register.html')
 
 
+# --- FILE COVER ---
+@app.errorhandler(413)
+def upload_terlalu_besar(error):
+    flash("Ukuran file terlalu besar.", "danger")
+    return redirect(request.path)
+
+
+@app.route('/cover/<path:filename>', methods=['GET'])
+def cover_file(filename):
+    response = send_from_directory(os.path.abspath(app.config['UPLOAD_FOLDER']), filename)
+    if blobstore.is_blob(filename) or blobstore.is_blob(variant_source(filename)):
+        # Cache selamanya, browser tidak perlu revalidasi
+        response.cache_control.public = True
+        response.cache_control.max_age = COVER_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
 # --- DETAIL BUKU ---
-@app.route('/buku/<int:buku_id>', methods=['GET'])
-def detail_buku(buku_id):
+def ambil_buku(buku_id):
     db = cursor = None
-    buku = None
     try:
         db = get_connection()
         cursor = db.cursor(dictionary=True)
         cursor.execute("SELECT * FROM produk_buku WHERE id_buku=%s", (buku_id,))
-        buku = cursor.fetchone()
-        if not buku:
-            flash("Buku tidak ditemukan.", "danger")
-            return redirect(url_for('dashboard'))
+        return cursor.fetchone()
+    finally:
+        if cursor: cursor.close()
+        if db: db.close()
+
+@app.route('/buku/<int:buku_id>', methods=['GET'])
+def detail_buku(buku_id):
+    try:
+        buku = cache.get_or_set(f'buku:{buku_id}', [f'buku:{buku_id}'], lambda: ambil_buku(buku_id))
     except Error as e:
         app.logger.error("Database error saat ambil buku: %s", e)
         flash("Terjadi kesalahan, coba lagi nanti.", "danger")
         return redirect(url_for('dashboard'))
-    finally:
-        if cursor: cursor.close()
-        if db: db.close()
+    if not buku:
+        flash("Buku tidak ditemukan.", "danger")
+        return redirect(url_for('dashboard'))
 
     return render_template('isibuku.html', buku=buku)
 
@@ -265,10 +414,14 @@ def upload_buku():
 
         file = request.files['cover_file']
         filename = None
+        created = False
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
             try:
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                # Disimpan berdasarkan hash isi: file yang sama tidak disimpan dua kali
+                filename, created = save_upload(file, app.config['UPLOAD_FOLDER'], {'jpg', 'png'})
+            except UploadError:
+                flash("Isi file cover bukan gambar PNG/JPG yang valid.", "danger")
+                return redirect(url_for('upload_buku'))
             except Exception as e:
                 app.logger.error("Gagal menyimpan file cover: %s", e)
                 flash("Gagal menyimpan file cover.", "danger")
@@ -287,8 +440,8 @@ def upload_buku():
             tanggal_terbit = tanggal_terbit_str if tanggal_terbit_str else None
         except ValueError:
             flash("Harga, Stok, Halaman, Panjang, dan Lebar harus berupa angka yang valid.", "danger")
-            if filename and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            if created:
+                blobstore.remove(app.config['UPLOAD_FOLDER'], filename)
             return redirect(url_for('upload_buku'))
 
         # Simpan ke database
@@ -306,12 +459,16 @@ def upload_buku():
                 bahasa or None, harga, stok, halaman, lebar, panjang, deskripsi or None, filename
             ))
             db.commit()
+            cache.invalidate('produk_buku')
+            # Varian baru dibuat setelah commit, jadi tidak ada yang tertinggal bila gagal
+            if created:
+                covers.submit(app.config['UPLOAD_FOLDER'], filename)
             flash(f"Buku '{judul}' berhasil diunggah!", "success")
             return redirect(url_for('dashboard'))
         except Error as e:
             app.logger.error("Database error saat upload buku: %s", e)
-            if filename and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            if created:
+                blobstore.remove(app.config['UPLOAD_FOLDER'], filename)
             flash(f"Gagal menyimpan data buku ke database. Detail error: {e.msg}", "danger")
             return redirect(url_for('upload_buku'))
         finally:
@@ -321,8 +478,22 @@ def upload_buku():
     return render_template('uploadbuku.html')
 
 
+# --- STATISTIK POOL ---
+@app.route('/pool_stats', methods=['GET'])
+@admin_required
+def pool_stats():
+    return jsonify(pool.stats())
+
+
+# --- STATISTIK QUERY ---
+@app.route('/perf_stats', methods=['GET'])
+@admin_required
+def perf_stats():
+    return jsonify(endpoints=perf.report(), slow_queries=list(perf.recent_slow))
+
+
 # ============================
 #   MAIN
 # ============================
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run()
@@ -1,20 +1,133 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory, make_response, g, has_request_context, abort
+from flask import Response, before_render_template, stream_with_context, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+import click
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import io
 import os
-from datetime import datetime
+import threading
+import time
+import zipfile
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+from functools import wraps
+from itertools import chain
+
+import auth
+import blobstore
+import catalog_io
+import schema
+import search as catalog_search
+import sqlite_tuning
+from images import CoverProcessor, srcset, variant_source
+from jobs import JobQueue, WorkerPool
+from cache import Cache
+from events import EventHub
+from perf import PerfMonitor
+from replicas import ReplicaSet, RoutingSession, SQLiteReplicator, sqlite_path
+from sessions import MemorySessionStore, ServerSessionInterface, SQLiteSessionStore
+from pagination import InvalidCursor, get_per_page, paginate, paginate_ranked
+from uploads import UploadError, UploadRequest, save_stream, save_upload
 
 app = Flask(__name__)
+app.request_class = UploadRequest  # file uploads are streamed to disk
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///buku.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///buku.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite connection profile ('production' or 'default'); SQLITE_PRAGMAS
+# overrides single pragmas of the profile
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'production')
+app.config['SQLITE_PRAGMAS'] = {}
+app.config['SQLITE_POOL_SIZE'] = 10
 app.config['UPLOAD_FOLDER'] = 'bookstore/static/uploads'
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # whole request
+app.config['MAX_UPLOAD_FILE_SIZE'] = 8 * 1024 * 1024  # single uploaded file
+# Catalog imports upload a whole catalog and a zip of covers at once
+app.config['BULK_UPLOAD_ENDPOINTS'] = {'admin_import_books'}
+app.config['BULK_UPLOAD_MAX_SIZE'] = 512 * 1024 * 1024
+app.config['IMPORT_BATCH_SIZE'] = 500  # books per INSERT and per transaction
+app.config['COVER_CACHE_MAX_AGE'] = 365 * 24 * 3600  # content-addressed, never changes
+app.config['SLOW_QUERY_MS'] = 100
+app.config['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG')  # JSON lines file, optional
+app.config['SLOW_QUERY_REDACT'] = True
+app.config['SERVER_TIMING_SKIP'] = {'cover_file'}  # immutable and shared-cacheable
+app.config['LAZY_LOAD_GUARD'] = 'warn'  # 'warn', 'raise' or None; only active in debug/testing
+app.config['PAGE_CACHE_TTL'] = 300
+app.config['PAGE_CACHE_MAX_ENTRIES'] = 1024
+# Set to a directory (e.g. /dev/shm/tokobuku-cache) to share pages between workers
+app.config['PAGE_CACHE_DIR'] = os.environ.get('PAGE_CACHE_DIR')
+# Read-only pages are served from these when set (comma separated in the env)
+app.config['SQLALCHEMY_REPLICA_URIS'] = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+# How far replicas may trail the primary, in seconds. For this long after a
+# write the user's reads stay on the primary, and pages rendered from a
+# replica are cached no longer than this.
+app.config['REPLICA_MAX_LAG'] = 5
+# Server-side sessions: 'sqlite' (SESSION_DB, shared by all workers) or 'memory'
+app.config['SESSION_STORE'] = os.environ.get('SESSION_STORE', 'sqlite')
+app.config['SESSION_DB'] = os.environ.get('SESSION_DB', os.path.join(app.instance_path, 'sessions.db'))
+# Werkzeug hash method, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'.
+# Existing hashes are upgraded on the next successful login.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', auth.DEFAULT_METHOD)
+app.config['PASSWORD_HASH_WORKERS'] = None  # concurrent hashes; default min(4, cores)
+app.config['PASSWORD_HASH_WAITING'] = 32    # logins queued beyond that get a 503
+# /api/events streams: each open one holds a server thread (sync/gthread
+# workers) for up to EVENT_STREAM_MAX_AGE, so by default they may only take
+# a quarter of WEB_THREADS (gunicorn --threads); further tabs get a 503 and
+# fall back to reading the cart count once. Under an async worker (gevent,
+# eventlet) a stream costs no thread: raise EVENT_STREAMS_MAX there.
+app.config['WEB_THREADS'] = int(os.environ.get('WEB_THREADS', 8))
+app.config['EVENT_STREAMS_MAX'] = int(os.environ.get('EVENT_STREAMS_MAX', max(1, app.config['WEB_THREADS'] // 4)))
+app.config['EVENT_STREAM_MAX_AGE'] = 300  # seconds; browsers reconnect afterwards
+app.config['EVENT_KEEPALIVE'] = 15
+# Background jobs (cover variants, file deletion) are queued in JOB_DB.
+# Every web process runs JOB_WORKERS threads on the queue; set it to 0 to
+# leave the jobs to dedicated `flask run-jobs` processes.
+app.config['JOB_DB'] = os.environ.get('JOB_DB', os.path.join(app.instance_path, 'jobs.db'))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 1))
+app.config['JOB_MAX_ATTEMPTS'] = 5
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.instance_path, exist_ok=True)
+
+SQLITE_PRAGMAS = sqlite_tuning.pragmas_for(app.config['SQLITE_PROFILE'], app.config['SQLITE_PRAGMAS'])
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:///'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_tuning.engine_options(
+        SQLITE_PRAGMAS, pool_size=app.config['SQLITE_POOL_SIZE'])
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if sqlite_tuning.is_sqlite(dbapi_connection):
+        sqlite_tuning.apply_pragmas(dbapi_connection, SQLITE_PRAGMAS)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+if app.config['SESSION_STORE'] == 'memory':
+    session_store = MemorySessionStore()
+else:
+    session_store = SQLiteSessionStore(app.config['SESSION_DB'])
+app.session_interface = ServerSessionInterface(session_store)
+passwords = auth.PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_waiting=app.config['PASSWORD_HASH_WAITING'],
+)
+replicas = ReplicaSet(app.config['SQLALCHEMY_REPLICA_URIS'], app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
 
-db = SQLAlchemy(app)
+# Resized WebP/JPEG cover variants, built by the 'cover-variants' job
+covers = CoverProcessor()
+perf_monitor = PerfMonitor(app)
+perf_monitor.instrument_sqlalchemy(Engine)
+page_cache = Cache(
+    max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+    ttl=app.config['PAGE_CACHE_TTL'],
+    shared_dir=app.config['PAGE_CACHE_DIR'],
+)
+event_hub = EventHub(max_subscribers=app.config['EVENT_STREAMS_MAX'])
+jobs = JobQueue(app.config['JOB_DB'], max_attempts=app.config['JOB_MAX_ATTEMPTS'])
+job_workers = WorkerPool(jobs, app.config['JOB_WORKERS'], context=app.app_context)
 
 # ===== MODELS =====
 class User(db.Model):
@@ -58,6 +171,9 @@ class Cart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Maintained by the cart service (see CART SERVICE)
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    subtotal = db.Column(db.Float, nullable=False, default=0, server_default='0')
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -66,6 +182,11 @@ class CartItem(db.Model):
     quantity = db.Column(db.Integer, default=1)
     
     cart = db.relationship('Cart', backref='items')
+    
+    # One line per book; adding again raises the quantity
+    __table_args__ = (
+        db.UniqueConstraint('cart_id', 'book_id', name='uq_cart_item_cart_book'),
+    )
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -103,6 +224,7 @@ class Discussion(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_public = db.Column(db.Boolean, default=True)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     user = db.relationship('User', backref='discussions')
     comments = db.relationship('DiscussionComment', backref='discussion', lazy=True, cascade='all, delete-orphan')
@@ -115,11 +237,16 @@ class DiscussionComment(db.Model):
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     user = db.relationship('User', backref='discussion_comments')
     likes = db.relationship('CommentLike', backref='comment', lazy=True, cascade='all, delete-orphan')
 
 class DiscussionLike(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'discussion_id', name='uq_discussion_like_user_discussion'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     discussion_id = db.Column(db.Integer, db.ForeignKey('discussion.id'), nullable=False)
@@ -128,6 +255,10 @@ class DiscussionLike(db.Model):
     user = db.relationship('User', backref='discussion_likes')
 
 class CommentLike(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'comment_id', name='uq_comment_like_user_comment'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     comment_id = db.Column(db.Integer, db.ForeignKey('discussion_comment.id'), nullable=False)
@@ -135,11 +266,419 @@ class CommentLike(db.Model):
     
     user = db.relationship('User', backref='comment_likes')
 
+# Aggregated comment count for discussion lists. Deferred, so it only costs
+# a correlated subquery when a view asks for it with undefer(). Like counts
+# are kept in the like_count columns by toggle_like().
+Discussion.comment_count = db.column_property(
+    db.select(db.func.count(DiscussionComment.id))
+    .where(DiscussionComment.discussion_id == Discussion.id)
+    .correlate_except(DiscussionComment)
+    .scalar_subquery(),
+    deferred=True
+)
+
+# ===== STATISTICS MODELS =====
+class SiteStats(db.Model):
+    """Running totals for the admin dashboard (a single row)"""
+    id = db.Column(db.Integer, primary_key=True)
+    total_users = db.Column(db.Integer, nullable=False, default=0)
+    total_books = db.Column(db.Integer, nullable=False, default=0)
+    total_orders = db.Column(db.Integer, nullable=False, default=0)
+    total_discussions = db.Column(db.Integer, nullable=False, default=0)
+    total_revenue = db.Column(db.Float, nullable=False, default=0)
+
+class DailyStats(db.Model):
+    """Per-day rollup of orders, revenue and sign-ups"""
+    day = db.Column(db.Date, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    new_users = db.Column(db.Integer, nullable=False, default=0)
+
+STATS_ROW_ID = 1
+
+STATS_COUNTERS = {
+    User: 'total_users',
+    Book: 'total_books',
+    Order: 'total_orders',
+    Discussion: 'total_discussions',
+}
+
+def record_stats(connection, totals=None, daily=None):
+    """Apply counter deltas: ``totals`` maps SiteStats columns to deltas and
+    ``daily`` maps a date to a dict of DailyStats column deltas.
+
+    Exposed so bulk writes that bypass the ORM can keep the numbers right.
+    """
+    totals = {column: delta for column, delta in (totals or {}).items() if delta}
+    if totals:
+        table = SiteStats.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.id == STATS_ROW_ID)
+            .values({column: table.c[column] + delta for column, delta in totals.items()})
+        )
+    
+    for day, deltas in (daily or {}).items():
+        values = {'revenue': 0, 'order_count': 0, 'new_users': 0}
+        values.update(deltas)
+        statement = sqlite_insert(DailyStats.__table__).values(day=day, **values)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['day'],
+            set_={column: DailyStats.__table__.c[column] + statement.excluded[column] for column in values}
+        ))
+
+@event.listens_for(db.session, 'after_flush')
+def track_statistics(session, flush_context):
+    """Update running totals and daily rollups in the flushing transaction"""
+    totals = {}
+    daily = {}
+    
+    def bump(obj, sign):
+        column = STATS_COUNTERS.get(type(obj))
+        if column is None:
+            return
+        totals[column] = totals.get(column, 0) + sign
+        if isinstance(obj, Order):
+            totals['total_revenue'] = totals.get('total_revenue', 0) + sign * (obj.total_amount or 0)
+        if sign < 0:
+            return
+        day = daily.setdefault((obj.created_at or datetime.utcnow()).date(), {})
+        if isinstance(obj, Order):
+            day['order_count'] = day.get('order_count', 0) + 1
+            day['revenue'] = day.get('revenue', 0) + (obj.total_amount or 0)
+        elif isinstance(obj, User):
+            day['new_users'] = day.get('new_users', 0) + 1
+    
+    for obj in session.new:
+        bump(obj, 1)
+    for obj in session.deleted:
+        bump(obj, -1)
+    
+    if totals or daily:
+        record_stats(session.connection(), totals, daily)
+
+def rebuild_stats():
+    """Recompute all statistics from the base tables"""
+    stats = db.session.get(SiteStats, STATS_ROW_ID) or SiteStats(id=STATS_ROW_ID)
+    stats.total_users = User.query.count()
+    stats.total_books = Book.query.count()
+    stats.total_orders = Order.query.count()
+    stats.total_discussions = Discussion.query.count()
+    stats.total_revenue = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
+    db.session.add(stats)
+    
+    DailyStats.query.delete()
+    days = {}
+    order_rows = db.session.query(
+        db.func.date(Order.created_at), db.func.count(Order.id), db.func.sum(Order.total_amount)
+    ).group_by(db.func.date(Order.created_at))
+    for day, order_count, revenue in order_rows:
+        days.setdefault(day, DailyStats(day=date.fromisoformat(day))).order_count = order_count
+        days[day].revenue = revenue or 0
+    user_rows = db.session.query(
+        db.func.date(User.created_at), db.func.count(User.id)
+    ).group_by(db.func.date(User.created_at))
+    for day, new_users in user_rows:
+        days.setdefault(day, DailyStats(day=date.fromisoformat(day), order_count=0, revenue=0)).new_users = new_users
+    db.session.add_all(days.values())
+    db.session.commit()
+
+# ===== LOADING PROFILES =====
+# Eager loads per kind of view, so that every page renders from a fixed
+# number of queries. Only relationships the templates actually touch are
+# loaded; categories come from the category registry.
+LOAD_PROFILES = {
+    # Public lists (index, catalog, my books, forum, wishlist)
+    'card': {
+        Book: (db.defer(Book.description),),
+        Discussion: (db.joinedload(Discussion.user), db.undefer(Discussion.comment_count)),
+        Wishlist: (db.joinedload(Wishlist.book).defer(Book.description),),
+    },
+    # Admin tables
+    'admin_row': {
+        Book: (db.defer(Book.description), db.joinedload(Book.seller)),
+        Order: (db.joinedload(Order.user),),
+        Discussion: (db.joinedload(Discussion.user), db.undefer(Discussion.comment_count)),
+    },
+    # Single object pages
+    'detail': {
+        Discussion: (db.joinedload(Discussion.user),),
+        DiscussionComment: (db.joinedload(DiscussionComment.user),),
+    },
+}
+
+def with_profile(query, profile):
+    """Apply the eager loads of ``profile`` to a query on a profiled model"""
+    model = query.column_descriptions[0]['entity']
+    return query.options(*LOAD_PROFILES[profile].get(model, ()))
+
+def discussion_list_query(profile='card'):
+    """Discussions with author and comment/like counts loaded in one query"""
+    return with_profile(Discussion.query, profile)
+
+class LazyLoadError(RuntimeError):
+    """A relationship or deferred column was loaded while rendering a template"""
+
+@before_render_template.connect_via(app)
+def _enter_template(sender, template, context, **extra):
+    g.rendering = g.get('rendering', 0) + 1
+
+@template_rendered.connect_via(app)
+def _leave_template(sender, template, context, **extra):
+    g.rendering = g.get('rendering', 1) - 1
+
+@event.listens_for(db.session, 'do_orm_execute')
+def guard_lazy_loads(orm_execute_state):
+    """In debug/testing mode, report loads that a view's profile missed"""
+    mode = app.config['LAZY_LOAD_GUARD']
+    if not mode or not (app.debug or app.testing) or not has_request_context() or not g.get('rendering'):
+        return
+    if not (orm_execute_state.is_relationship_load or orm_execute_state.is_column_load):
+        return
+    message = f'Lazy load of {orm_execute_state.loader_strategy_path or "deferred column"} while rendering {request.endpoint}'
+    if mode == 'raise':
+        raise LazyLoadError(message)
+    app.logger.warning(message)
+
+def toggle_like(like_model, target_model, target_column, target_id, user_id):
+    """Like or unlike ``target_id`` for ``user_id`` and return (action, like_count).
+
+    The like row is removed with one DELETE or added with one
+    INSERT .. ON CONFLICT DO NOTHING (the unique constraint makes concurrent
+    clicks harmless), and the counter moves by exactly the number of rows
+    changed, all in one transaction.
+    """
+    removed = db.session.execute(
+        db.delete(like_model).where(like_model.user_id == user_id, target_column == target_id)
+    ).rowcount
+    
+    if removed:
+        action, delta = 'unlike', -removed
+    else:
+        added = db.session.execute(
+            sqlite_insert(like_model)
+            .values({like_model.user_id: user_id, target_column: target_id})
+            .on_conflict_do_nothing()
+        ).rowcount
+        action, delta = 'like', added
+    
+    like_count = db.session.execute(
+        db.update(target_model)
+        .where(target_model.id == target_id)
+        .values(like_count=target_model.like_count + delta)
+        .returning(target_model.like_count)
+    ).scalar()
+    db.session.commit()
+    
+    return action, like_count
+
+# ===== CART SERVICE =====
+# Cart.item_count (lines) and Cart.subtotal are moved by every change made
+# here, so pages and AJAX answers never add up the lines again. Changes that
+# go through the ORM instead (lines deleted with their book, price edits)
+# are recomputed in track_cart_totals.
+
+def cart_id_for(user_id, create=False):
+    cart_id = db.session.execute(db.select(Cart.id).where(Cart.user_id == user_id)).scalar()
+    if cart_id is None and create:
+        db.session.execute(sqlite_insert(Cart).values(user_id=user_id).on_conflict_do_nothing())
+        cart_id = db.session.execute(db.select(Cart.id).where(Cart.user_id == user_id)).scalar()
+    return cart_id
+
+def move_cart_totals(cart_id, lines, amount):
+    """Shift the maintained totals; returns (item_count, subtotal)"""
+    return tuple(db.session.execute(
+        db.update(Cart)
+        .where(Cart.id == cart_id)
+        .values(item_count=Cart.item_count + lines, subtotal=Cart.subtotal + amount)
+        .returning(Cart.item_count, Cart.subtotal)
+        .execution_options(synchronize_session=False)
+    ).one())
+
+def add_cart_line(user_id, book, quantity):
+    """Add ``quantity`` copies with one upsert on (cart_id, book_id).
+
+    Returns (item_count, subtotal) of the cart after the change.
+    """
+    cart_id = cart_id_for(user_id, create=True)
+    insert = sqlite_insert(CartItem).values(cart_id=cart_id, book_id=book.id, quantity=quantity)
+    line_quantity = db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.book_id],
+            set_={'quantity': CartItem.quantity + insert.excluded.quantity},
+        ).returning(CartItem.quantity)
+    ).scalar()
+    # Lines never drop below 1, so only a new line ends up with exactly `quantity`
+    new_line = 1 if line_quantity == quantity else 0
+    totals = move_cart_totals(cart_id, new_line, book.price * quantity)
+    db.session.commit()
+    return totals
+
+def change_cart_line(cart_id, item_id, quantity, price, action):
+    """Apply 'increase', 'decrease' or 'remove' to one line.
+
+    ``quantity`` and ``price`` are the line's current values. Returns
+    (new_quantity, item_count, subtotal).
+    """
+    if action == 'remove':
+        removed = db.session.execute(
+            db.delete(CartItem).where(CartItem.id == item_id)
+            .returning(CartItem.quantity)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        totals = move_cart_totals(cart_id, -1 if removed else 0, -price * (removed or 0))
+        db.session.commit()
+        return (0,) + totals
+    
+    delta = {'increase': 1, 'decrease': -1}.get(action, 0)
+    if delta:
+        updated = db.session.execute(
+            db.update(CartItem)
+            .where(CartItem.id == item_id, CartItem.quantity + delta >= 1)
+            .values(quantity=CartItem.quantity + delta)
+            .returning(CartItem.quantity)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if updated is None:
+            delta = 0  # decreasing the last copy keeps it
+        else:
+            quantity = updated
+    totals = move_cart_totals(cart_id, 0, price * delta)
+    db.session.commit()
+    return (quantity,) + totals
+
+def cart_lines(user_id):
+    """The user's (CartItem, Book) lines and the cart subtotal, in one query"""
+    lines = db.session.query(CartItem, Book, Cart.subtotal).join(
+        Cart, Cart.id == CartItem.cart_id).join(Book, Book.id == CartItem.book_id).filter(
+        Cart.user_id == user_id).order_by(CartItem.book_id).all()
+    return lines, (lines[0].subtotal if lines else 0)
+
+def recalculate_carts(connection, condition):
+    """Recompute the totals of matching carts; returns (user_id, item_count) rows"""
+    lines = db.select(db.func.count(CartItem.id)).where(CartItem.cart_id == Cart.id).scalar_subquery()
+    amount = db.select(db.func.coalesce(db.func.sum(CartItem.quantity * Book.price), 0)).join(
+        Book, Book.id == CartItem.book_id).where(CartItem.cart_id == Cart.id).scalar_subquery()
+    return connection.execute(
+        db.update(Cart).where(condition).values(item_count=lines, subtotal=amount)
+        .returning(Cart.user_id, Cart.item_count)
+    ).all()
+
+@event.listens_for(db.session, 'after_flush')
+def track_cart_totals(db_session, flush_context):
+    cart_ids = {obj.cart_id for obj in chain(db_session.new, db_session.dirty, db_session.deleted)
+                if isinstance(obj, CartItem)}
+    book_ids = {obj.id for obj in db_session.dirty
+                if isinstance(obj, Book) and db.inspect(obj).attrs.price.history.has_changes()}
+    if not cart_ids and not book_ids:
+        return
+    condition = Cart.id.in_(cart_ids) | Cart.id.in_(
+        db.select(CartItem.cart_id).where(CartItem.book_id.in_(book_ids)))
+    rows = recalculate_carts(db_session.connection(), condition)
+    db_session.info.setdefault('cart_counts', {}).update(rows)
+
+@event.listens_for(db.session, 'after_commit')
+def publish_cart_totals(db_session):
+    for user_id, count in db_session.info.pop('cart_counts', {}).items():
+        cart_changed(user_id, count)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_cart_totals(db_session):
+    db_session.info.pop('cart_counts', None)
+
+# ===== CHECKOUT =====
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into an order"""
+    def __init__(self, failed_items=None):
+        super().__init__(failed_items)
+        self.failed_items = failed_items or []
+
+class EmptyCartError(CheckoutError):
+    pass
+
+def place_order(cart_id, user_id, shipping_address, payment_method):
+    """Turn the cart into an order in a single transaction.
+
+    The cart lines are claimed with one DELETE .. RETURNING (so a double
+    submit cannot order the same cart twice), stock is reserved per line with
+    a conditional ``UPDATE .. WHERE stock >= quantity`` that also returns the
+    current price, and the order items are bulk inserted. If any line cannot
+    be reserved everything is rolled back and ``CheckoutError`` lists the
+    failing books with the stock still available.
+    """
+    lines = db.session.execute(
+        db.delete(CartItem)
+        .where(CartItem.cart_id == cart_id)
+        .returning(CartItem.book_id, CartItem.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not lines:
+        db.session.rollback()
+        raise EmptyCartError()
+    db.session.execute(
+        db.update(Cart).where(Cart.id == cart_id).values(item_count=0, subtotal=0)
+        .execution_options(synchronize_session=False)
+    )
+    
+    reserved = []
+    failed = []
+    for line in lines:
+        price = db.session.execute(
+            db.update(Book)
+            .where(Book.id == line.book_id, Book.stock >= line.quantity)
+            .values(stock=Book.stock - line.quantity)
+            .returning(Book.price)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if price is None:
+            failed.append(line)
+        else:
+            reserved.append((line, price))
+    
+    if failed:
+        books = {book.id: book for book in Book.query.filter(Book.id.in_([line.book_id for line in failed]))}
+        failed_items = [{
+            'book_id': line.book_id,
+            'title': books[line.book_id].title if line.book_id in books else None,
+            'requested': line.quantity,
+            'available': books[line.book_id].stock if line.book_id in books else 0,
+        } for line in failed]
+        db.session.rollback()
+        raise CheckoutError(failed_items)
+    
+    order = Order(
+        user_id=user_id,
+        total_amount=sum(price * line.quantity for line, price in reserved),
+        shipping_address=shipping_address,
+        payment_method=payment_method,
+        status='pending'
+    )
+    db.session.add(order)
+    db.session.flush()
+    
+    db.session.execute(db.insert(OrderItem), [{
+        'order_id': order.id,
+        'book_id': line.book_id,
+        'quantity': line.quantity,
+        'price': price,
+    } for line, price in reserved])
+    db.session.commit()
+    # Book pages show the stock
+    invalidate_books(*(line.book_id for line, _ in reserved), listings=False)
+    
+    return order
+
 # ===== INITIALIZATION =====
 def initialize_database():
     """Initialize database with default data"""
     with app.app_context():
         db.create_all()
+        for version, name in schema.migrate(db.session.connection()):
+            print(f"✅ Migration {version}: {name}")
+        db.session.commit()
+        
+        if db.session.get(SiteStats, STATS_ROW_ID) is None:
+            rebuild_stats()
         
         # Create default categories if none exist
         if Category.query.count() == 0:
@@ -156,11 +695,811 @@ def initialize_database():
             
             db.session.commit()
             print("✅ Database initialized with default categories!")
+        
+        # Full-text search index over book title/author/description
+        if catalog_search.ensure_search_index(db.session.connection()):
+            db.session.commit()
+        else:
+            db.session.rollback()
+            print("⚠️ SQLite FTS5 tidak tersedia, pencarian memakai LIKE.")
+
+# ===== PAGINATION HELPERS =====
+def wants_json():
+    return request.args.get('format') == 'json'
+
+def paginate_request(query, model):
+    return paginate(query, model,
+                    cursor=request.args.get('cursor'),
+                    per_page=get_per_page(request.args.get('per_page')))
+
+def render_page(template, page, serialize, **context):
+    """Render a paginated list as HTML, or as JSON for ``?format=json``"""
+    if wants_json():
+        return jsonify(page.to_dict(serialize))
+    return render_template(template, page=page, **context)
+
+@app.template_global()
+def cover_image(filename):
+    """URLs for a cover: the original plus srcset strings of its variants"""
+    def upload_url(name):
+        return url_for('cover_file', filename=name)
+    
+    manifest = covers.manifest(app.config['UPLOAD_FOLDER'], filename)
+    return {
+        'src': upload_url(filename),
+        'webp_srcset': srcset(manifest, upload_url, 'webp'),
+        'jpg_srcset': srcset(manifest, upload_url, 'jpg'),
+    }
+
+@app.template_global()
+def page_url(cursor):
+    args = request.args.to_dict()
+    args.pop('format', None)
+    args['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(error):
+    if wants_json():
+        return jsonify({'error': 'Cursor tidak valid'}), 400
+    flash('Halaman tidak valid!', 'error')
+    return redirect(url_for(request.endpoint, **(request.view_args or {})))
+
+def serialize_book(book):
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'price': book.price,
+        'stock': book.stock,
+        'image': book.image,
+        'category_id': book.category_id,
+        'created_at': book.created_at.isoformat() if book.created_at else None,
+    }
+
+def serialize_user(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'is_admin': user.is_admin,
+        'created_at': user.created_at.isoformat() if user.created_at else None,
+    }
+
+def serialize_order(order):
+    return {
+        'id': order.id,
+        'user_id': order.user_id,
+        'total_amount': order.total_amount,
+        'status': order.status,
+        'payment_method': order.payment_method,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+    }
+
+def serialize_discussion(discussion):
+    return {
+        'id': discussion.id,
+        'user_id': discussion.user_id,
+        'title': discussion.title,
+        'is_public': discussion.is_public,
+        'created_at': discussion.created_at.isoformat() if discussion.created_at else None,
+    }
+
+# ===== READ REPLICAS =====
+def recently_wrote():
+    written_at = session.get('last_write_at')
+    return written_at is not None and time.time() - written_at < app.config['REPLICA_MAX_LAG']
+
+def replica_read(view):
+    """Run a read-only view against a replica when any are configured.
+
+    Users who wrote something in the last ``REPLICA_MAX_LAG`` seconds stay on
+    the primary, so they see their own changes.
+    """
+    @wraps(view)
+    def wrapper(**kwargs):
+        if not replicas or request.method not in ('GET', 'HEAD') or recently_wrote():
+            return view(**kwargs)
+        db.session.info['replica_bind'] = replicas.choose()
+        try:
+            return view(**kwargs)
+        finally:
+            db.session.info.pop('replica_bind', None)
+    return wrapper
+
+@event.listens_for(db.session, 'after_flush')
+def track_writes(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+@event.listens_for(db.session, 'do_orm_execute')
+def track_statement_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def remember_write(db_session):
+    if db_session.info.pop('wrote', False) and has_request_context():
+        session['last_write_at'] = time.time()
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_write(db_session):
+    db_session.info.pop('wrote', None)
+
+# ===== PAGE CACHE =====
+def login_state():
+    """What the shared page chrome depends on: anonymous, user or admin"""
+    if 'user_id' not in session:
+        return 'anon'
+    return 'admin' if session.get('is_admin') else 'user'
+
+def cached_page(*tags):
+    """Cache the HTML of a GET view per URL and login state.
+
+    Tags are format strings filled from the view arguments (``'book:{book_id}'``);
+    ``invalidate_books`` drops the pages when the books change. Requests with
+    pending flash messages are always rendered.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(**kwargs)
+            key = f'page:{login_state()}:{request.full_path}'
+            full_key, html = page_cache.lookup(key, [tag.format(**kwargs) for tag in tags])
+            if html is not None:
+                return html
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and response.mimetype == 'text/html':
+                # A replica may not have the change that invalidated the page yet
+                ttl = app.config['REPLICA_MAX_LAG'] if db.session.info.get('replica_bind') else None
+                page_cache.store(full_key, response.get_data(as_text=True), ttl)
+            return response
+        return wrapper
+    return decorator
+
+def invalidate_books(*book_ids, listings=True):
+    """Drop cached pages of these books and, by default, the book listings"""
+    tags = [f'book:{book_id}' for book_id in book_ids]
+    if listings:
+        tags.append('books')
+    page_cache.invalidate(*tags)
+
+# ===== LIVE EVENTS =====
+def count_cart_items(user_id):
+    return db.session.execute(db.select(Cart.item_count).where(Cart.user_id == user_id)).scalar() or 0
+
+def cart_count(user_id):
+    """Lines in the user's cart, cached until the cart changes"""
+    return page_cache.get_or_set(f'cart-count:{user_id}', (), lambda: count_cart_items(user_id))
+
+def cart_changed(user_id, count=None):
+    """Store the new cart count and push it to the user's open pages"""
+    if count is None:
+        count = count_cart_items(user_id)
+    page_cache.set(f'cart-count:{user_id}', count)
+    event_hub.publish(f'user:{user_id}', 'cart', {'count': count})
+    return count
+
+def order_changed(order):
+    event_hub.publish(f'user:{order.user_id}', 'order', {'id': order.id, 'status': order.status})
+
+# ===== CATEGORY REGISTRY =====
+CategoryInfo = namedtuple('CategoryInfo', 'id name description')
+
+class CategoryRegistry:
+    """Process-wide, read-only copy of the category table.
+
+    Loaded on first use and reloaded only when the ``categories`` version in
+    the page cache changes, which happens after any commit that touches a
+    category (in every worker when the cache is shared).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = (None, (), {})
+
+    def _current(self):
+        version = page_cache.tag_version('categories')
+        state = self._state
+        if state[0] != version:
+            with self._lock:
+                state = self._state
+                if state[0] != version:
+                    # Always from the primary: a lagging replica would pin old names
+                    rows = db.session.execute(
+                        db.select(Category.id, Category.name, Category.description).order_by(Category.id),
+                        bind_arguments={'bind': db.engine},
+                    ).all()
+                    categories = tuple(CategoryInfo(*row) for row in rows)
+                    state = self._state = (version, categories, {c.id: c for c in categories})
+        return state
+
+    def all(self):
+        return self._current()[1]
+
+    def get(self, category_id):
+        return self._current()[2].get(category_id)
+
+    def name(self, category_id, default='-'):
+        category = self.get(category_id)
+        return category.name if category else default
+
+category_registry = CategoryRegistry()
+
+@app.template_global()
+def category_name(category_id):
+    return category_registry.name(category_id)
+
+@event.listens_for(db.session, 'after_flush')
+def track_category_changes(session, flush_context):
+    if any(isinstance(obj, Category) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['categories_changed'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def publish_category_changes(session):
+    if session.info.pop('categories_changed', False):
+        page_cache.invalidate('categories')
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_category_changes(session):
+    session.info.pop('categories_changed', None)
+
+# ===== BACKGROUND JOBS =====
+def defer(name, *args, key=None, delay=0, **kwargs):
+    """Queue a registered job to run after the current request.
+
+    Call after committing whatever the job depends on. Returns the job id;
+    with ``key`` a job that is already queued under that key is reused.
+    """
+    job_id = jobs.enqueue(name, *args, key=key, delay=delay, **kwargs)
+    job_workers.start()
+    return job_id
+
+@app.before_request
+def start_job_workers():
+    # Also picks up jobs left by other processes or before a restart
+    job_workers.start()
+
+# ===== COVER STORAGE =====
+# Identical uploads share one file, so a cover file may only be deleted
+# while no book uses it and no request is about to. Both sides hold the
+# database write lock: the release job checks for references and unlinks
+# in one locked transaction, and uploads store (or reuse) the file in the
+# same transaction that commits the book pointing at it. Catalog imports
+# store a batch's files first and check them again under the lock.
+def lock_cover_files():
+    """Take the database write lock until the session's transaction ends"""
+    db.session.execute(db.text('UPDATE book SET id = id WHERE 0'))
+
+def save_cover(file):
+    """Store an uploaded cover under its content hash.
+
+    Commit the book that uses it in the current transaction: a new file
+    gets its variants queued on commit and is released on rollback. Raises
+    UploadError if the file is not a JPG/PNG/WEBP/GIF image.
+    """
+    lock_cover_files()
+    name, created = save_upload(file, app.config['UPLOAD_FOLDER'])
+    if created:
+        db.session.info.setdefault('new_covers', set()).add(name)
+    return name
+
+def store_cover(stream, lock=True):
+    """``save_cover()`` for a binary stream, e.g. a file in a covers zip.
+
+    With ``lock=False`` the file is written without the write lock; the
+    caller must take it and check the file still exists before committing.
+    """
+    if lock:
+        lock_cover_files()
+    name, created = save_stream(stream, app.config['UPLOAD_FOLDER'])
+    if created:
+        db.session.info.setdefault('new_covers', set()).add(name)
+    return name
+
+@event.listens_for(db.session, 'after_commit')
+def queue_cover_variants(db_session):
+    for name in db_session.info.pop('new_covers', ()):
+        if covers.enabled:
+            defer('cover-variants', name)
+
+@event.listens_for(db.session, 'after_rollback')
+def release_uncommitted_covers(db_session):
+    # No book points at them, unless another upload reused them meanwhile
+    for name in db_session.info.pop('new_covers', ()):
+        release_cover(name)
+
+def release_cover(name):
+    """Delete a cover (and its variants) once no book references it.
+
+    Call after committing the change that dropped the reference. The files
+    are deleted by a background job.
+    """
+    if name:
+        defer('release-cover', name)
+
+@jobs.task('cover-variants')
+def build_cover_variants(name):
+    folder = app.config['UPLOAD_FOLDER']
+    if os.path.exists(os.path.join(folder, name)):  # not released in the meantime
+        covers.process(folder, name, strict=True)
+
+@jobs.task('release-cover')
+def delete_unused_cover(name):
+    lock_cover_files()
+    try:
+        if db.session.query(Book.id).filter_by(image=name).first() is None:
+            blobstore.remove(app.config['UPLOAD_FOLDER'], name)
+            covers.remove(app.config['UPLOAD_FOLDER'], name)
+    finally:
+        db.session.rollback()
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    flash('Ukuran file terlalu besar!', 'error')
+    return redirect(request.path)
+
+@app.route('/covers/<path:filename>')
+def cover_file(filename):
+    response = send_from_directory(os.path.abspath(app.config['UPLOAD_FOLDER']), filename)
+    if blobstore.is_blob(filename) or blobstore.is_blob(variant_source(filename)):
+        # The name is the content hash, so browsers never need to revalidate
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['COVER_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+# ===== CATALOG IMPORT/EXPORT =====
+def import_cover(archive, name, attached, sources, report):
+    """Cover name for an imported book; ``attached`` remembers names already stored.
+
+    The file is stored without the write lock, so reading and hashing a
+    batch of covers does not hold up other writers; ``lock_batch_covers()``
+    checks it again once the lock is taken. ``sources`` maps stored covers
+    back to their name in the catalog.
+    """
+    if not name:
+        return None
+    if name in attached:
+        return attached[name]
+    cover = None
+    stream = archive.open(name) if archive is not None else None
+    if stream is not None:
+        with stream:
+            try:
+                cover = store_cover(stream, lock=False)
+            except UploadError:
+                pass
+    elif blobstore.is_blob(name):
+        # Already in the store, e.g. a catalog exported from this shop
+        if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], name)):
+            cover = name
+    if cover is None:
+        report.missing_covers += 1
+    else:
+        report.covers += 1
+        sources[cover] = name
+    attached[name] = cover
+    return cover
+
+def lock_batch_covers(rows, archive, attached, sources, report):
+    """Take the cover lock for a batch of books about to be inserted.
+
+    A release job may have deleted a reused cover after it was stored and
+    before the lock. Such a cover is stored again from the archive, or
+    dropped from its rows when that is not possible.
+    """
+    lock_cover_files()
+    folder = app.config['UPLOAD_FOLDER']
+    gone = set()
+    for name in {row['image'] for row in rows if row['image']}:
+        if os.path.exists(os.path.join(folder, name)):
+            continue
+        stream = archive.open(sources[name]) if archive is not None else None
+        if stream is not None:
+            with stream:
+                try:
+                    if store_cover(stream, lock=False) == name:
+                        continue
+                except UploadError:
+                    pass
+        gone.add(name)
+        attached[sources[name]] = None
+        report.covers -= 1
+        report.missing_covers += 1
+    for row in rows:
+        if row['image'] in gone:
+            row['image'] = None
+
+def import_catalog(stream, fmt, user_id, archive=None, batch_size=None, progress=None):
+    """Add the books of a CSV/JSONL catalog to ``user_id``'s shop.
+
+    Valid rows are inserted with one executemany INSERT and committed per
+    batch of ``batch_size``, so a failure only loses its own batch. Invalid
+    rows are skipped and listed in the returned ``ImportReport``.
+    ``progress(report)`` is called after every batch.
+    """
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    categories = {category.name.strip().lower(): category.id for category in category_registry.all()}
+    report = catalog_io.ImportReport()
+    attached, sources = {}, {}
+    
+    def books():
+        try:
+            for line, record in catalog_io.read_rows(stream, fmt):
+                report.read += 1
+                try:
+                    if isinstance(record, catalog_io.RowError):
+                        raise record
+                    book = catalog_io.clean_row(record, categories)
+                except catalog_io.RowError as error:
+                    report.add_error(line, str(error))
+                    continue
+                book['image'] = import_cover(archive, book['image'], attached, sources, report)
+                book['user_id'] = user_id
+                yield line, book
+        except catalog_io.CatalogError as error:
+            # The rest of the file is unreadable; keep what was read so far
+            report.aborted = str(error)
+    
+    for batch in catalog_io.chunks(books(), batch_size):
+        rows = [book for _, book in batch]
+        try:
+            # The write lock is only held from here to the commit
+            lock_batch_covers(rows, archive, attached, sources, report)
+            db.session.execute(db.insert(Book), rows)
+            # Bulk inserts bypass track_statistics
+            record_stats(db.session.connection(), {'total_books': len(rows)})
+            db.session.commit()
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            app.logger.warning('Catalog import batch failed: %s', error)
+            for line, _ in batch:
+                report.add_error(line, 'gagal disimpan ke database')
+            dropped = {row['image'] for row in rows if row['image']}
+            attached = {key: value for key, value in attached.items() if value not in dropped}
+            for name in dropped:
+                release_cover(name)
+            continue
+        report.imported += len(rows)
+        report.batches += 1
+        if progress is not None:
+            progress(report)
+    
+    if report.imported:
+        invalidate_books()
+    return report
+
+def export_catalog(fmt, user_id=None, batch_size=1000):
+    """Yield the catalog (or one seller's books) as CSV/JSONL text chunks.
+
+    Books are read in keyset batches, each in its own short read
+    transaction, so an export holds neither the whole catalog in memory nor
+    a snapshot open for its whole run.
+    """
+    def rows():
+        last_id = 0
+        while True:
+            query = db.select(
+                Book.id, Book.title, Book.author, Book.description, Book.price, Book.stock,
+                Book.category_id, Book.image, User.username
+            ).join(User, Book.user_id == User.id).where(Book.id > last_id).order_by(Book.id).limit(batch_size)
+            if user_id is not None:
+                query = query.where(Book.user_id == user_id)
+            batch = db.session.execute(query).all()
+            db.session.commit()
+            for row in batch:
+                yield {
+                    'id': row.id, 'title': row.title, 'author': row.author,
+                    'description': row.description, 'price': row.price, 'stock': row.stock,
+                    'category': category_registry.name(row.category_id, None),
+                    'image': row.image, 'seller': row.username,
+                }
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1].id
+    
+    return catalog_io.write_rows(rows(), fmt)
+
+# ===== ORDER EXPORT =====
+# One row per order line; the order columns repeat on each of its lines
+ORDER_EXPORT_FIELDS = (
+    'order_id', 'created_at', 'status', 'customer', 'email', 'payment_method', 'shipping_address',
+    'order_total', 'item_id', 'book_id', 'title', 'author', 'quantity', 'price', 'line_total',
+)
+ORDER_EXPORT_FORMATS = {'csv': 'csv', 'ndjson': 'jsonl', 'jsonl': 'jsonl'}
+
+def order_export_filters(date_from=None, date_to=None, statuses=None):
+    """Parse the export filters; raises ValueError for a malformed date.
+
+    Dates are ``YYYY-MM-DD`` and both ends are inclusive. ``statuses`` is a
+    comma separated string or a list of them.
+    """
+    start = datetime.fromisoformat(date_from) if date_from else None
+    end = datetime.fromisoformat(date_to) + timedelta(days=1) if date_to else None
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    statuses = [status.strip() for value in statuses or () for status in value.split(',') if status.strip()]
+    return start, end, statuses
+
+def export_orders(fmt, start=None, end=None, statuses=(), batch_size=1000):
+    """Yield order lines placed in ``[start, end)`` as CSV/NDJSON text chunks.
+
+    The rows come from one query read through its cursor ``batch_size``
+    rows at a time, so memory stays flat however many orders match and
+    the export is one consistent snapshot.
+    """
+    query = db.select(
+        Order.id.label('order_id'), Order.created_at, Order.status, User.username, User.email,
+        Order.payment_method, Order.shipping_address, Order.total_amount,
+        OrderItem.id.label('item_id'), OrderItem.book_id, Book.title, Book.author,
+        OrderItem.quantity, OrderItem.price,
+    ).join(User, Order.user_id == User.id).join(OrderItem, OrderItem.order_id == Order.id).outerjoin(
+        Book, OrderItem.book_id == Book.id
+    ).order_by(Order.created_at, Order.id, OrderItem.id)
+    if start is not None:
+        query = query.where(Order.created_at >= start)
+    if end is not None:
+        query = query.where(Order.created_at < end)
+    if statuses:
+        query = query.where(Order.status.in_(statuses))
+    
+    def rows():
+        result = db.session.execute(query.execution_options(yield_per=batch_size))
+        try:
+            for row in result:
+                yield {
+                    'order_id': row.order_id, 'created_at': row.created_at.isoformat(sep=' ', timespec='seconds'),
+                    'status': row.status, 'customer': row.username, 'email': row.email,
+                    'payment_method': row.payment_method, 'shipping_address': row.shipping_address,
+                    'order_total': row.total_amount, 'item_id': row.item_id, 'book_id': row.book_id,
+                    'title': row.title, 'author': row.author, 'quantity': row.quantity,
+                    'price': row.price, 'line_total': row.price * row.quantity,
+                }
+        finally:
+            result.close()
+    
+    return catalog_io.write_rows(rows(), ORDER_EXPORT_FORMATS[fmt], ORDER_EXPORT_FIELDS)
+
+@app.cli.command('migrate-covers')
+def migrate_covers_command():
+    """Move covers stored under their upload name into the content store"""
+    folder = app.config['UPLOAD_FOLDER']
+    moved = 0
+    for (image,) in db.session.query(Book.image).filter(Book.image.isnot(None)).distinct().all():
+        path = os.path.join(folder, image)
+        if blobstore.is_blob(image) or not os.path.exists(path):
+            continue
+        lock_cover_files()
+        with open(path, 'rb') as f:
+            name, created = blobstore.store(folder, f, image.rsplit('.', 1)[-1])
+        book_ids = [book_id for (book_id,) in db.session.query(Book.id).filter_by(image=image)]
+        Book.query.filter_by(image=image).update({'image': name})
+        db.session.commit()
+        invalidate_books(*book_ids)
+        os.remove(path)
+        covers.remove(folder, image)
+        if created:
+            covers.process(folder, name)
+        moved += 1
+    print(f"✅ {moved} cover dipindahkan ke penyimpanan berbasis hash.")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations"""
+    applied = schema.migrate(db.session.connection())
+    db.session.commit()
+    for version, name in applied:
+        print(f"✅ Migration {version}: {name}")
+    if not applied:
+        print("✅ Skema sudah terbaru.")
+
+@app.cli.command('replicate')
+@click.option('--lag', default=2.0, show_default=True, help='Seconds each copy trails the primary.')
+@click.option('--once', is_flag=True, help='Copy once, without waiting, and exit.')
+def replicate_command(lag, once):
+    """Copy the SQLite primary onto the replica files (local testing)"""
+    primary = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    targets = [sqlite_path(uri) for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+    if primary is None or not targets or None in targets:
+        raise click.UsageError('Butuh database SQLite dan DATABASE_REPLICA_URLS berisi file SQLite.')
+    replicator = SQLiteReplicator(primary, targets, lag)
+    if once:
+        replicator.sync(lag=0)
+        print(f"✅ {len(targets)} replica disalin dari {primary}.")
+        return
+    print(f"✅ Replikasi {primary} -> {', '.join(targets)} dengan jeda {lag}s (Ctrl+C untuk berhenti)")
+    try:
+        replicator.run()
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Delete expired server-side sessions"""
+    print(f"✅ {session_store.sweep()} sesi kedaluwarsa dihapus.")
+
+@app.cli.command('revoke-sessions')
+@click.argument('username')
+def revoke_sessions_command(username):
+    """Log a user out everywhere"""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.UsageError(f'User {username} tidak ditemukan.')
+    print(f"✅ {session_store.revoke_user(user.id)} sesi milik {username} dicabut.")
+
+@app.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--seller', required=True, help='Username that will own the books.')
+@click.option('--covers', 'covers_path', type=click.Path(exists=True, dir_okay=False),
+              help='Zip with the cover files named in the image column.')
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), help='Default: from the file extension.')
+@click.option('--batch-size', type=click.IntRange(1), default=app.config['IMPORT_BATCH_SIZE'], show_default=True)
+def import_books_command(path, seller, covers_path, fmt, batch_size):
+    """Import books from a CSV or JSONL catalog"""
+    user = User.query.filter_by(username=seller).first()
+    if user is None:
+        raise click.UsageError(f'User {seller} tidak ditemukan.')
+    archive = catalog_io.CoverArchive(covers_path, app.config['MAX_UPLOAD_FILE_SIZE']) if covers_path else None
+    def progress(report):
+        print(f"… {report.imported} buku diimpor, {report.failed} gagal", flush=True)
+    
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = import_catalog(stream, fmt or catalog_io.detect_format(path), user.id,
+                                    archive, batch_size, progress)
+    finally:
+        if archive is not None:
+            archive.close()
+    for line, message in report.errors:
+        print(f"❌ Baris {line}: {message}")
+    if report.failed > len(report.errors):
+        print(f"❌ ... dan {report.failed - len(report.errors)} baris lainnya")
+    if report.missing_covers:
+        print(f"⚠️ {report.missing_covers} cover tidak ditemukan atau bukan gambar.")
+    if report.aborted:
+        print(f"⚠️ Impor berhenti: {report.aborted}")
+    print(f"✅ {report.summary()}")
+
+@app.cli.command('export-books')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--seller', help='Only the books of this username.')
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), help='Default: from the file extension.')
+def export_books_command(path, seller, fmt):
+    """Write the catalog as CSV or JSONL (to stdout by default)"""
+    user_id = None
+    if seller:
+        user = User.query.filter_by(username=seller).first()
+        if user is None:
+            raise click.UsageError(f'User {seller} tidak ditemukan.')
+        user_id = user.id
+    with click.open_file(path, 'w', encoding='utf-8') as out:
+        for chunk in export_catalog(fmt or catalog_io.detect_format(path), user_id):
+            out.write(chunk)
+
+@app.cli.command('export-orders')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--from', 'date_from', help='First day, YYYY-MM-DD.')
+@click.option('--to', 'date_to', help='Last day (inclusive), YYYY-MM-DD.')
+@click.option('--status', 'statuses', multiple=True, help='Only these statuses; repeat or separate with commas.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Default: from the file extension.')
+def export_orders_command(path, date_from, date_to, statuses, fmt):
+    """Write order lines as CSV or NDJSON (to stdout by default)"""
+    try:
+        start, end, statuses = order_export_filters(date_from, date_to, statuses)
+    except ValueError:
+        raise click.UsageError('Tanggal harus berformat YYYY-MM-DD.')
+    fmt = fmt or ('ndjson' if catalog_io.detect_format(path) == 'jsonl' else 'csv')
+    with click.open_file(path, 'w', encoding='utf-8') as out:
+        for chunk in export_orders(fmt, start, end, statuses):
+            out.write(chunk)
+
+@app.cli.command('run-jobs')
+@click.option('--workers', type=click.IntRange(1), default=2, show_default=True)
+@click.option('--once', is_flag=True, help='Run the jobs that are due, then exit.')
+def run_jobs_command(workers, once):
+    """Work the background job queue until interrupted"""
+    if once:
+        print(f"✅ {job_workers.drain()} job dijalankan.")
+        return
+    pool = WorkerPool(jobs, workers, context=app.app_context)
+    pool.start()
+    print(f"✅ {workers} worker menjalankan job dari {jobs.path} (Ctrl+C untuk berhenti)")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop(timeout=jobs.lease)
+
+@app.cli.command('job-status')
+@click.option('--retry-failed', is_flag=True, help='Queue the failed jobs again.')
+def job_status_command(retry_failed):
+    """Show queued, running, done and failed job counts"""
+    if retry_failed:
+        print(f"✅ {jobs.retry_failed()} job gagal diantrekan ulang.")
+    counts = jobs.counts()
+    print(' '.join(f"{status}={count}" for status, count in counts.items()))
+    for job_id, name, attempts, error in jobs.failures():
+        last_line = error.strip().splitlines()[-1] if error else ''
+        print(f"❌ #{job_id} {name} ({attempts}x): {last_line}")
+
+# Pages whose queries are checked by check-query-plans; {name} fields are
+# filled with ids that exist in the database
+PLAN_CHECK_URLS = [
+    '/', '/books', '/books?category_id={category_id}', '/books?search=buku', '/book/{book_id}',
+    '/my_books', '/cart', '/checkout', '/orders', '/order_detail/{order_id}', '/wishlist',
+    '/discussion', '/discussion/{discussion_id}', '/my_discussions', '/profile',
+    '/admin', '/admin/users', '/admin/books', '/admin/orders', '/admin/discussions',
+    '/admin/books/export', '/admin/orders/export?from=2000-01-01&status=paid', '/api/cart/count',
+]
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Run EXPLAIN QUERY PLAN on every query of the main pages"""
+    admin = User.query.filter_by(is_admin=True).first() or User.query.first()
+    if admin is None:
+        print("⚠️ Database kosong, tidak ada yang diperiksa.")
+        return
+    ids = {
+        'category_id': db.session.query(db.func.min(Category.id)).scalar(),
+        'book_id': db.session.query(db.func.min(Book.id)).scalar(),
+        'order_id': db.session.query(db.func.min(Order.id)).filter(Order.user_id == admin.id).scalar()
+                    or db.session.query(db.func.min(Order.id)).scalar(),
+        'discussion_id': db.session.query(db.func.min(Discussion.id)).scalar(),
+    }
+    
+    captured = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')) and not executemany:
+            captured.append((statement, parameters))
+    event.listen(Engine, 'before_cursor_execute', capture)
+    
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = admin.id
+        sess['is_admin'] = admin.is_admin
+    urls = []
+    for template in PLAN_CHECK_URLS:
+        if any(value is None for key, value in ids.items() if '{' + key + '}' in template):
+            continue
+        url = template.format(**ids)
+        urls.append(url)
+        # Also check the keyset query of the second page
+        if url.split('?')[0] in ('/books', '/my_books', '/orders', '/admin/users', '/admin/books',
+                                 '/admin/orders', '/admin/discussions', '/discussion'):
+            response = client.get(url + ('&' if '?' in url else '?') + 'format=json')
+            if response.is_json and response.get_json().get('next'):
+                urls.append(url + ('&' if '?' in url else '?') + 'cursor=' + response.get_json()['next'])
+    
+    problems = 0
+    try:
+        for url in urls:
+            captured.clear()
+            client.get(url)
+            for statement, parameters in captured:
+                plan = schema.explain(db.session.connection(), statement, parameters)
+                issues = schema.plan_problems(plan)
+                if issues:
+                    problems += 1
+                    print(f"❌ {url}\n   {' '.join(statement.split())[:200]}")
+                    for line in issues:
+                        print(f"   -> {line}")
+    finally:
+        event.remove(Engine, 'before_cursor_execute', capture)
+    
+    if problems:
+        print(f"⚠️ {problems} query tanpa index yang cocok di {len(urls)} halaman.")
+        raise SystemExit(1)
+    print(f"✅ {len(urls)} halaman diperiksa, semua query memakai index.")
 
 # ===== AUTH ROUTES =====
 @app.route('/')
+@replica_read
+@cached_page('books')
 def index():
-    books = Book.query.limit(8).all()
+    # "Buku Terbaru": newest first, read straight off ix_book_created
+    books = with_profile(Book.query, 'card').order_by(Book.created_at.desc(), Book.id.desc()).limit(8).all()
     return render_template('index.html', books=books)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -171,7 +1510,16 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password, password):
+        try:
+            ok, new_hash = passwords.verify(user.password if user else None, password)
+        except auth.HasherBusy:
+            flash('Server sedang sibuk, silakan coba lagi sebentar.', 'error')
+            return render_template('auth/login.html'), 503
+        
+        if ok:
+            if new_hash:
+                user.password = new_hash
+                db.session.commit()
             session['user_id'] = user.id
             session['username'] = user.username
             session['is_admin'] = user.is_admin
@@ -202,7 +1550,11 @@ def register():
             flash('Email sudah digunakan!', 'error')
             return render_template('auth/register.html')
         
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = passwords.hash(password)
+        except auth.HasherBusy:
+            flash('Server sedang sibuk, silakan coba lagi sebentar.', 'error')
+            return render_template('auth/register.html'), 503
         new_user = User(username=username, email=email, password=hashed_password)
         
         db.session.add(new_user)
@@ -226,22 +1578,41 @@ def logout():
 
 # ===== BOOK ROUTES =====
 @app.route('/books')
+@replica_read
 def book_list():
     category_id = request.args.get('category_id')
     search = request.args.get('search')
     
-    query = Book.query
+    query = with_profile(Book.query, 'card')
     
     if category_id:
         query = query.filter_by(category_id=category_id)
-    if search:
-        query = query.filter(Book.title.contains(search) | Book.author.contains(search))
     
-    books = query.all()
-    categories = Category.query.all()
-    return render_template('books/book_list.html', books=books, categories=categories)
+    if search and catalog_search.has_search_index(db.session.connection()):
+        # Search results are ranked, so they are paged by (score, id)
+        # instead of by (created_at, id)
+        def fetch(after, backwards, limit):
+            return catalog_search.search_book_ids(db.session.connection(), search, category_id,
+                                                  after=after, backwards=backwards, limit=limit)
+        
+        page_ids, page = paginate_ranked(fetch,
+                                         cursor=request.args.get('cursor'),
+                                         per_page=get_per_page(request.args.get('per_page')))
+        rank = {book_id: position for position, book_id in enumerate(page_ids)}
+        page.items = query.filter(Book.id.in_(page_ids)).all() if page_ids else []
+        page.items.sort(key=lambda book: rank[book.id])
+    else:
+        if search:
+            query = query.filter(Book.title.contains(search) | Book.author.contains(search))
+        page = paginate_request(query, Book)
+    
+    categories = category_registry.all()
+    return render_page('books/book_list.html', page, serialize_book,
+                       books=page.items, categories=categories)
 
 @app.route('/book/<int:book_id>')
+@replica_read
+@cached_page('book:{book_id}', 'categories')
 def book_detail(book_id):
     book = Book.query.get_or_404(book_id)
     return render_template('books/book_detail.html', book=book)
@@ -265,9 +1636,11 @@ def add_book():
         if 'image' in request.files:
             file = request.files['image']
             if file.filename != '':
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image = filename
+                try:
+                    image = save_cover(file)
+                except UploadError:
+                    flash('Format gambar tidak didukung (JPG, PNG, WEBP, GIF)!', 'error')
+                    return redirect(url_for('add_book'))
         
         new_book = Book(
             title=title,
@@ -282,11 +1655,12 @@ def add_book():
         
         db.session.add(new_book)
         db.session.commit()
+        invalidate_books(new_book.id)
         
         flash('Buku berhasil ditambahkan!', 'success')
         return redirect(url_for('book_list'))
     
-    categories = Category.query.all()
+    categories = category_registry.all()
     return render_template('books/add_book.html', categories=categories)
 
 @app.route('/edit_book/<int:book_id>', methods=['GET', 'POST'])
@@ -311,23 +1685,29 @@ def edit_book(book_id):
         book.category_id = int(request.form['category_id'])
         
         # Handle image update
+        old_image = None
         if 'image' in request.files:
             file = request.files['image']
             if file.filename != '':
-                # Delete old image if exists
-                if book.image and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], book.image)):
-                    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], book.image))
-                
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                book.image = filename
+                try:
+                    new_image = save_cover(file)
+                except UploadError:
+                    db.session.rollback()
+                    flash('Format gambar tidak didukung (JPG, PNG, WEBP, GIF)!', 'error')
+                    return redirect(url_for('edit_book', book_id=book_id))
+                old_image, book.image = book.image, new_image
         
         db.session.commit()
+        invalidate_books(book.id)
+        
+        # Delete old image once nothing else uses it
+        if old_image != book.image:
+            release_cover(old_image)
         
         flash('Informasi buku berhasil diperbarui!', 'success')
         return redirect(url_for('book_detail', book_id=book.id))
     
-    categories = Category.query.all()
+    categories = category_registry.all()
     return render_template('books/edit_book.html', book=book, categories=categories)
 
 @app.route('/delete_book/<int:book_id>', methods=['POST'])
@@ -343,12 +1723,13 @@ def delete_book(book_id):
         flash('Anda tidak memiliki akses untuk menghapus buku ini!', 'error')
         return redirect(url_for('book_detail', book_id=book_id))
     
-    # Delete book image if exists
-    if book.image and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], book.image)):
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], book.image))
-    
+    image = book.image
     db.session.delete(book)
     db.session.commit()
+    invalidate_books(book_id)
+    
+    # Delete book image if no other book shares it
+    release_cover(image)
     
     flash('Buku berhasil dihapus!', 'success')
     return redirect(url_for('book_list'))
@@ -359,8 +1740,20 @@ def my_books():
         flash('Silakan login terlebih dahulu!', 'error')
         return redirect(url_for('login'))
     
-    user_books = Book.query.filter_by(user_id=session['user_id']).order_by(Book.created_at.desc()).all()
-    return render_template('books/my_books.html', books=user_books)
+    page = paginate_request(with_profile(Book.query, 'card').filter_by(user_id=session['user_id']), Book)
+    
+    # Totals cover all of the user's books, not just the current page
+    total_books, total_value, total_stock = db.session.query(
+        db.func.count(Book.id),
+        db.func.coalesce(db.func.sum(Book.price), 0),
+        db.func.coalesce(db.func.sum(Book.stock), 0)
+    ).filter(Book.user_id == session['user_id']).one()
+    
+    return render_page('books/my_books.html', page, serialize_book,
+                       books=page.items,
+                       total_books=total_books,
+                       total_value=total_value,
+                       total_stock=total_stock)
 
 # ===== CART ROUTES =====
 @app.route('/cart')
@@ -369,14 +1762,7 @@ def cart():
         flash('Silakan login terlebih dahulu!', 'error')
         return redirect(url_for('login'))
     
-    cart = Cart.query.filter_by(user_id=session['user_id']).first()
-    cart_items = []
-    total = 0
-    
-    if cart:
-        cart_items = db.session.query(CartItem, Book).join(Book).filter(CartItem.cart_id == cart.id).all()
-        total = sum(item.Book.price * item.CartItem.quantity for item in cart_items)
-    
+    cart_items, total = cart_lines(session['user_id'])
     return render_template('cart/cart.html', cart_items=cart_items, total=total)
 
 @app.route('/add_to_cart', methods=['POST'])
@@ -386,29 +1772,22 @@ def add_to_cart():
     
     data = request.get_json()
     book_id = data['book_id']
-    quantity = data.get('quantity', 1)
+    try:
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        quantity = 0
+    if quantity < 1:
+        return jsonify({'success': False, 'message': 'Jumlah tidak valid!'})
     
     book = Book.query.get(book_id)
     if not book:
         return jsonify({'success': False, 'message': 'Buku tidak ditemukan!'})
     
-    cart = Cart.query.filter_by(user_id=session['user_id']).first()
-    if not cart:
-        cart = Cart(user_id=session['user_id'])
-        db.session.add(cart)
-        db.session.commit()
-    
-    existing_item = CartItem.query.filter_by(cart_id=cart.id, book_id=book_id).first()
-    
-    if existing_item:
-        existing_item.quantity += quantity
-    else:
-        new_item = CartItem(cart_id=cart.id, book_id=book_id, quantity=quantity)
-        db.session.add(new_item)
-    
-    db.session.commit()
+    count, subtotal = add_cart_line(session['user_id'], book, quantity)
+    cart_changed(session['user_id'], count)
     
-    return jsonify({'success': True, 'message': 'Buku berhasil ditambahkan ke keranjang!'})
+    return jsonify({'success': True, 'message': 'Buku berhasil ditambahkan ke keranjang!',
+                    'cart_count': count, 'total': subtotal})
 
 @app.route('/update_cart_item/<int:item_id>', methods=['POST'])
 def update_cart_item(item_id):
@@ -418,29 +1797,24 @@ def update_cart_item(item_id):
     data = request.get_json()
     action = data.get('action')
     
-    cart_item = CartItem.query.get_or_404(item_id)
-    cart = Cart.query.filter_by(user_id=session['user_id']).first()
+    line = db.session.query(CartItem.cart_id, CartItem.quantity, Cart.user_id, Book.price).join(
+        Cart, Cart.id == CartItem.cart_id).join(Book, Book.id == CartItem.book_id).filter(
+        CartItem.id == item_id).first()
+    if line is None:
+        abort(404)
     
-    if not cart or cart_item.cart_id != cart.id:
+    if line.user_id != session['user_id']:
         return jsonify({'success': False, 'message': 'Akses ditolak!'})
     
-    if action == 'increase':
-        cart_item.quantity += 1
-    elif action == 'decrease' and cart_item.quantity > 1:
-        cart_item.quantity -= 1
-    elif action == 'remove':
-        db.session.delete(cart_item)
-    
-    db.session.commit()
-    
-    cart_items = db.session.query(CartItem, Book).join(Book).filter(CartItem.cart_id == cart.id).all()
-    total = sum(item.Book.price * item.CartItem.quantity for item in cart_items)
+    quantity, count, total = change_cart_line(line.cart_id, item_id, line.quantity, line.price, action)
+    cart_changed(session['user_id'], count)
     
     return jsonify({
         'success': True, 
-        'new_quantity': cart_item.quantity if action != 'remove' else 0,
-        'item_total': cart_item.book.price * cart_item.quantity if action != 'remove' else 0,
-        'total': total
+        'new_quantity': quantity,
+        'item_total': line.price * quantity,
+        'total': total,
+        'cart_count': count
     })
 
 # ===== CHECKOUT & ORDER ROUTES =====
@@ -450,13 +1824,7 @@ def checkout():
         flash('Silakan login terlebih dahulu!', 'error')
         return redirect(url_for('login'))
     
-    cart = Cart.query.filter_by(user_id=session['user_id']).first()
-    cart_items = []
-    total = 0
-    
-    if cart:
-        cart_items = db.session.query(CartItem, Book).join(Book).filter(CartItem.cart_id == cart.id).all()
-        total = sum(item.Book.price * item.CartItem.quantity for item in cart_items)
+    cart_items, total = cart_lines(session['user_id'])
     
     if not cart_items:
         flash('Keranjang belanja kosong!', 'error')
@@ -475,42 +1843,23 @@ def process_checkout():
     payment_method = request.form['payment_method']
     notes = request.form.get('notes', '')
     
-    cart = Cart.query.filter_by(user_id=session['user_id']).first()
-    if not cart:
+    cart_id = cart_id_for(session['user_id'])
+    if cart_id is None:
         flash('Keranjang belanja kosong!', 'error')
         return redirect(url_for('cart'))
     
-    cart_items = db.session.query(CartItem, Book).join(Book).filter(CartItem.cart_id == cart.id).all()
-    if not cart_items:
+    try:
+        new_order = place_order(cart_id, session['user_id'], shipping_address, payment_method)
+    except EmptyCartError:
         flash('Keranjang belanja kosong!', 'error')
         return redirect(url_for('cart'))
+    except CheckoutError as e:
+        details = ', '.join(f"{item['title']} (tersedia {item['available']})" for item in e.failed_items)
+        flash(f'Stok tidak mencukupi untuk: {details}', 'error')
+        return redirect(url_for('cart'))
     
-    total = sum(item.Book.price * item.CartItem.quantity for item in cart_items)
-    
-    new_order = Order(
-        user_id=session['user_id'],
-        total_amount=total,
-        shipping_address=shipping_address,
-        payment_method=payment_method,
-        status='pending'
-    )
-    
-    db.session.add(new_order)
-    db.session.commit()
-    
-    for item in cart_items:
-        order_item = OrderItem(
-            order_id=new_order.id,
-            book_id=item.Book.id,
-            quantity=item.CartItem.quantity,
-            price=item.Book.price
-        )
-        db.session.add(order_item)
-        item.Book.stock -= item.CartItem.quantity
-    
-    CartItem.query.filter_by(cart_id=cart.id).delete()
-    db.session.commit()
-    
+    cart_changed(session['user_id'], 0)
+    order_changed(new_order)
     flash(f'Pesanan berhasil dibuat! Order ID: #{new_order.id}', 'success')
     return redirect(url_for('order_confirmation', order_id=new_order.id))
 
@@ -536,8 +1885,8 @@ def orders():
         flash('Silakan login terlebih dahulu!', 'error')
         return redirect(url_for('login'))
     
-    user_orders = Order.query.filter_by(user_id=session['user_id']).order_by(Order.created_at.desc()).all()
-    return render_template('user/orders.html', orders=user_orders)
+    page = paginate_request(Order.query.filter_by(user_id=session['user_id']), Order)
+    return render_page('user/orders.html', page, serialize_order, orders=page.items)
 
 @app.route('/order_detail/<int:order_id>')
 def order_detail(order_id):
@@ -557,9 +1906,10 @@ def order_detail(order_id):
 
 # ===== DISCUSSION FORUM ROUTES =====
 @app.route('/discussion')
+@replica_read
 def discussion_forum():
-    discussions = Discussion.query.filter_by(is_public=True).order_by(Discussion.created_at.desc()).all()
-    return render_template('discussion/forum.html', discussions=discussions)
+    page = paginate_request(discussion_list_query().filter_by(is_public=True), Discussion)
+    return render_page('discussion/forum.html', page, serialize_discussion, discussions=page.items)
 
 @app.route('/discussion/create', methods=['GET', 'POST'])
 def create_discussion():
@@ -588,14 +1938,15 @@ def create_discussion():
     return render_template('discussion/create.html')
 
 @app.route('/discussion/<int:discussion_id>')
+@replica_read
 def discussion_detail(discussion_id):
-    discussion = Discussion.query.get_or_404(discussion_id)
+    discussion = with_profile(Discussion.query, 'detail').get_or_404(discussion_id)
     
     if not discussion.is_public and discussion.user_id != session.get('user_id'):
         flash('Diskusi ini bersifat private!', 'error')
         return redirect(url_for('discussion_forum'))
     
-    comments = DiscussionComment.query.filter_by(discussion_id=discussion_id).order_by(DiscussionComment.created_at.asc()).all()
+    comments = with_profile(DiscussionComment.query, 'detail').filter_by(discussion_id=discussion_id).order_by(DiscussionComment.created_at.asc()).all()
     
     user_liked = False
     if 'user_id' in session:
@@ -638,27 +1989,10 @@ def like_discussion(discussion_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Silakan login terlebih dahulu!'})
     
-    discussion = Discussion.query.get_or_404(discussion_id)
-    
-    existing_like = DiscussionLike.query.filter_by(
-        user_id=session['user_id'],
-        discussion_id=discussion_id
-    ).first()
-    
-    if existing_like:
-        db.session.delete(existing_like)
-        action = 'unlike'
-    else:
-        new_like = DiscussionLike(
-            user_id=session['user_id'],
-            discussion_id=discussion_id
-        )
-        db.session.add(new_like)
-        action = 'like'
-    
-    db.session.commit()
+    Discussion.query.get_or_404(discussion_id)
     
-    like_count = DiscussionLike.query.filter_by(discussion_id=discussion_id).count()
+    action, like_count = toggle_like(DiscussionLike, Discussion, DiscussionLike.discussion_id,
+                                     discussion_id, session['user_id'])
     
     return jsonify({
         'success': True,
@@ -671,27 +2005,10 @@ def like_comment(comment_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Silakan login terlebih dahulu!'})
     
-    comment = DiscussionComment.query.get_or_404(comment_id)
+    DiscussionComment.query.get_or_404(comment_id)
     
-    existing_like = CommentLike.query.filter_by(
-        user_id=session['user_id'],
-        comment_id=comment_id
-    ).first()
-    
-    if existing_like:
-        db.session.delete(existing_like)
-        action = 'unlike'
-    else:
-        new_like = CommentLike(
-            user_id=session['user_id'],
-            comment_id=comment_id
-        )
-        db.session.add(new_like)
-        action = 'like'
-    
-    db.session.commit()
-    
-    like_count = CommentLike.query.filter_by(comment_id=comment_id).count()
+    action, like_count = toggle_like(CommentLike, DiscussionComment, CommentLike.comment_id,
+                                     comment_id, session['user_id'])
     
     return jsonify({
         'success': True,
@@ -705,7 +2022,7 @@ def my_discussions():
         flash('Silakan login terlebih dahulu!', 'error')
         return redirect(url_for('login'))
     
-    discussions = Discussion.query.filter_by(user_id=session['user_id']).order_by(Discussion.created_at.desc()).all()
+    discussions = discussion_list_query().filter_by(user_id=session['user_id']).order_by(Discussion.created_at.desc()).all()
     return render_template('discussion/my_discussions.html', discussions=discussions)
 
 @app.route('/discussion/<int:discussion_id>/delete', methods=['POST'])
@@ -755,7 +2072,7 @@ def wishlist():
         flash('Silakan login terlebih dahulu!', 'error')
         return redirect(url_for('login'))
     
-    wishlist_items = Wishlist.query.filter_by(user_id=session['user_id']).all()
+    wishlist_items = with_profile(Wishlist.query, 'card').filter_by(user_id=session['user_id']).all()
     return render_template('user/wishlist.html', wishlist_items=wishlist_items)
 
 @app.route('/add_to_wishlist/<int:book_id>')
@@ -782,11 +2099,12 @@ def admin_dashboard():
         flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
         return redirect(url_for('index'))
     
-    # Get statistics
-    total_users = User.query.count()
-    total_books = Book.query.count()
-    total_orders = Order.query.count()
-    total_discussions = Discussion.query.count()
+    # Precomputed statistics, maintained by track_statistics()
+    stats = db.session.get(SiteStats, STATS_ROW_ID) or SiteStats(
+        total_users=0, total_books=0, total_orders=0, total_discussions=0, total_revenue=0)
+    daily_stats = DailyStats.query.filter(
+        DailyStats.day >= date.today() - timedelta(days=29)
+    ).order_by(DailyStats.day.desc()).all()
     
     # Recent orders
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
@@ -794,15 +2112,13 @@ def admin_dashboard():
     # Recent users
     recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
     
-    # Revenue calculation (simple version)
-    total_revenue = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    
     return render_template('admin/dashboard.html',
-                         total_users=total_users,
-                         total_books=total_books,
-                         total_orders=total_orders,
-                         total_discussions=total_discussions,
-                         total_revenue=total_revenue,
+                         total_users=stats.total_users,
+                         total_books=stats.total_books,
+                         total_orders=stats.total_orders,
+                         total_discussions=stats.total_discussions,
+                         total_revenue=stats.total_revenue,
+                         daily_stats=daily_stats,
                          recent_orders=recent_orders,
                          recent_users=recent_users)
 
@@ -812,8 +2128,8 @@ def admin_users():
         flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
         return redirect(url_for('index'))
     
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users.html', users=users)
+    page = paginate_request(User.query, User)
+    return render_page('admin/users.html', page, serialize_user, users=page.items)
 
 @app.route('/admin/books')
 def admin_books():
@@ -821,8 +2137,74 @@ def admin_books():
         flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
         return redirect(url_for('index'))
     
-    books = Book.query.order_by(Book.created_at.desc()).all()
-    return render_template('admin/books.html', books=books)
+    page = paginate_request(with_profile(Book.query, 'admin_row'), Book)
+    return render_page('admin/books.html', page, serialize_book, books=page.items)
+
+@app.route('/admin/books/import', methods=['GET', 'POST'])
+def admin_import_books():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
+        return redirect(url_for('index'))
+    
+    report = None
+    if request.method == 'POST':
+        file = request.files.get('catalog')
+        if file is None or file.filename == '':
+            flash('Pilih file katalog (CSV atau JSONL)!', 'error')
+            return redirect(url_for('admin_import_books'))
+        seller = request.form.get('seller', '').strip()
+        user = User.query.filter_by(username=seller).first() if seller else db.session.get(User, session['user_id'])
+        if user is None:
+            flash(f'User {seller} tidak ditemukan!', 'error')
+            return redirect(url_for('admin_import_books'))
+        
+        archive = None
+        covers_file = request.files.get('covers')
+        if covers_file is not None and covers_file.filename != '':
+            try:
+                archive = catalog_io.CoverArchive(covers_file.stream, app.config['MAX_UPLOAD_FILE_SIZE'])
+            except zipfile.BadZipFile:
+                flash('File cover harus berupa ZIP!', 'error')
+                return redirect(url_for('admin_import_books'))
+        
+        fmt = request.form.get('format') or catalog_io.detect_format(file.filename)
+        if fmt not in catalog_io.FORMATS:
+            flash('Format katalog tidak didukung!', 'error')
+            return redirect(url_for('admin_import_books'))
+        def progress(report):
+            app.logger.info('Catalog import for %s: %s', user.username, report.summary())
+        
+        stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_catalog(stream, fmt, user.id, archive, progress=progress)
+        finally:
+            if archive is not None:
+                archive.close()
+        flash(report.summary(), 'success' if not report.failed and not report.aborted else 'info')
+    
+    return render_template('admin/import_books.html', report=report)
+
+@app.route('/admin/books/export')
+def admin_export_books():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
+        return redirect(url_for('index'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in catalog_io.FORMATS:
+        abort(400)
+    user_id = None
+    seller = request.args.get('seller', '').strip()
+    if seller:
+        user = User.query.filter_by(username=seller).first_or_404()
+        user_id = user.id
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"katalog-{seller or 'semua'}-{date.today().isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(export_catalog(fmt, user_id)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
 
 @app.route('/admin/orders')
 def admin_orders():
@@ -830,8 +2212,31 @@ def admin_orders():
         flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
         return redirect(url_for('index'))
     
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    page = paginate_request(with_profile(Order.query, 'admin_row'), Order)
+    return render_page('admin/orders.html', page, serialize_order, orders=page.items)
+
+@app.route('/admin/orders/export')
+def admin_export_orders():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
+        return redirect(url_for('index'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ORDER_EXPORT_FORMATS:
+        abort(400)
+    date_from, date_to = request.args.get('from'), request.args.get('to')
+    try:
+        start, end, statuses = order_export_filters(date_from, date_to, request.args.getlist('status'))
+    except ValueError:
+        flash('Tanggal harus berformat YYYY-MM-DD!', 'error')
+        return redirect(url_for('admin_orders'))
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"pesanan-{date_from or 'awal'}-{date_to or date.today().isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(export_orders(fmt, start, end, statuses)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
 
 @app.route('/admin/discussions')
 def admin_discussions():
@@ -839,8 +2244,23 @@ def admin_discussions():
         flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
         return redirect(url_for('index'))
     
-    discussions = Discussion.query.order_by(Discussion.created_at.desc()).all()
-    return render_template('admin/discussions.html', discussions=discussions)
+    page = paginate_request(discussion_list_query('admin_row'), Discussion)
+    return render_page('admin/discussions.html', page, serialize_discussion, discussions=page.items)
+
+@app.route('/admin/perf')
+def admin_perf():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Akses ditolak! Hanya admin yang bisa mengakses.', 'error')
+        return redirect(url_for('index'))
+    
+    endpoints = perf_monitor.report()
+    slow_queries = list(reversed(perf_monitor.recent_slow))
+    if wants_json():
+        return jsonify(endpoints=endpoints, slow_queries=slow_queries)
+    return render_template('admin/perf.html',
+                         endpoints=endpoints,
+                         slow_queries=slow_queries,
+                         threshold_ms=app.config['SLOW_QUERY_MS'])
 
 @app.route('/admin/user/<int:user_id>/toggle_admin', methods=['POST'])
 def toggle_admin(user_id):
@@ -851,6 +2271,8 @@ def toggle_admin(user_id):
     user = User.query.get_or_404(user_id)
     user.is_admin = not user.is_admin
     db.session.commit()
+    # Takes effect on the user's next request, wherever they are logged in
+    session_store.update_user(user.id, {'is_admin': user.is_admin})
     
     action = "dijadikan admin" if user.is_admin else "dihapus dari admin"
     flash(f'User {user.username} berhasil {action}!', 'success')
@@ -866,6 +2288,7 @@ def update_order_status(order_id):
     new_status = request.form['status']
     order.status = new_status
     db.session.commit()
+    order_changed(order)
     
     flash(f'Status order #{order.id} berhasil diupdate menjadi {new_status}!', 'success')
     return redirect(url_for('admin_orders'))
@@ -877,8 +2300,11 @@ def admin_delete_book(book_id):
         return redirect(url_for('index'))
     
     book = Book.query.get_or_404(book_id)
+    image = book.image
     db.session.delete(book)
     db.session.commit()
+    invalidate_books(book_id)
+    release_cover(image)
     
     flash('Buku berhasil dihapus!', 'success')
     return redirect(url_for('admin_books'))
@@ -902,12 +2328,32 @@ def api_cart_count():
     if 'user_id' not in session:
         return jsonify({'count': 0})
     
-    cart = Cart.query.filter_by(user_id=session['user_id']).first()
-    if not cart:
-        return jsonify({'count': 0})
-    
-    count = CartItem.query.filter_by(cart_id=cart.id).count()
-    return jsonify({'count': count})
+    return jsonify({'count': cart_count(session['user_id'])})
+
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events with the cart count and order status changes"""
+    if 'user_id' not in session:
+        return '', 204  # tells EventSource not to reconnect
+    
+    user_id = session['user_id']
+    # Subscribe before reading the count, so no change falls in between
+    subscription = event_hub.subscribe(f'user:{user_id}')
+    if subscription is None:
+        return jsonify({'error': 'Terlalu banyak koneksi'}), 503
+    
+    first = [('cart', {'count': cart_count(user_id)})]
+    response = Response(
+        event_hub.stream(subscription, first,
+                         keepalive=app.config['EVENT_KEEPALIVE'],
+                         max_age=app.config['EVENT_STREAM_MAX_AGE']),
+        mimetype='text/event-stream',
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # no proxy buffering (nginx)
+    # Also unsubscribes when the stream is closed before it started
+    response.call_on_close(subscription.close)
+    return response
 
 if __name__ == '__main__':
     initialize_database()
@@ -0,0 +1,127 @@
+"""Password hashing with a configurable cost and a bounded worker pool.
+
+Hashes use Werkzeug's format (``method$salt$hash``), so hashes written by
+``generate_password_hash`` keep working. ``method`` is any method Werkzeug
+accepts, e.g. ``pbkdf2:sha256:600000`` or ``scrypt:32768:8:1``.
+
+Hashing runs on a small thread pool. At most ``max_workers`` hashes are
+computed at once, so a burst of logins uses a bounded number of cores.
+At most ``max_waiting`` further logins wait for a worker; beyond that
+``PasswordHasher`` raises ``HasherBusy`` immediately instead of tying up
+another request thread.
+
+``verify()`` also returns a fresh hash when the stored one was made with
+a different method or cost (Werkzeug's defaults filled in on both sides,
+so ``scrypt`` matches ``scrypt:32768:8:1``), or was stored in plain text,
+so callers can upgrade it on a successful login.
+"""
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HasherBusy(RuntimeError):
+    """Too many password hashes are queued; try again shortly"""
+
+
+def hash_method(stored):
+    """The ``method`` part of a stored hash, or None for plain text"""
+    if not stored or stored.count('$') != 2:
+        return None
+    method = stored.split('$', 1)[0]
+    return method if method.startswith(('pbkdf2:', 'scrypt')) else None
+
+
+def normalize_method(method):
+    """``method`` with the parameters Werkzeug fills in when they are left out.
+
+    ``scrypt`` becomes ``scrypt:32768:8:1`` and ``pbkdf2:sha256`` becomes
+    ``pbkdf2:sha256:600000``, the form stored in the hashes themselves.
+    Methods Werkzeug would reject are returned unchanged.
+    """
+    name, *args = method.split(':')
+    try:
+        if name == 'scrypt':
+            n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+            return f'scrypt:{n}:{r}:{p}'
+        if name == 'pbkdf2' and len(args) <= 2:
+            hash_name = args[0] if args else 'sha256'
+            iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+            return f'pbkdf2:{hash_name}:{iterations}'
+    except ValueError:
+        pass
+    return method
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, max_workers=None, max_waiting=32, timeout=10.0,
+                 allow_plaintext=False):
+        self.method = method
+        self._normalized = normalize_method(method)
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.allow_plaintext = allow_plaintext
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_waiting)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='password')
+        self._dummy = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('password hashing queue is full')
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy('password hashing timed out') from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, stored):
+        method = hash_method(stored)
+        return method is None or normalize_method(method) != self._normalized
+
+    def _check(self, stored, password):
+        if hash_method(stored) is None:
+            if not self.allow_plaintext:
+                return False, None
+            ok = hmac.compare_digest(stored.encode(), password.encode())
+        else:
+            ok = check_password_hash(stored, password)
+        if ok and self.needs_rehash(stored):
+            return True, generate_password_hash(password, self.method)
+        return ok, None
+
+    def _check_dummy(self, password):
+        # Runs on the pool: the first call also computes the dummy hash
+        if self._dummy is None:
+            self._dummy = generate_password_hash(os.urandom(16).hex(), self.method)
+        check_password_hash(self._dummy, password)
+
+    def verify(self, stored, password):
+        """Check ``password``; returns ``(ok, new_hash)``.
+
+        ``new_hash`` is set when the password matched and the stored value
+        should be replaced. Pass ``stored=None`` for unknown users: a dummy
+        hash is still checked, so the response takes as long as for a
+        real user.
+        """
+        if stored is None:
+            self._run(self._check_dummy, password)
+            return False, None
+        return self._run(self._check, stored, password)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,99 @@
+"""Measure login throughput per core for each password hashing cost.
+
+    python bookstore/benchmarks/password_hashing.py
+    python bookstore/benchmarks/password_hashing.py --methods scrypt:32768:8:1 --storm 200
+
+For every method the script times verifications on one thread (logins per
+second per core), then fires ``--storm`` concurrent logins at a
+``PasswordHasher`` with ``--workers`` threads and reports throughput, p50
+and p95 latency and how many logins were turned away because the queue
+was full.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+
+import auth  # noqa: E402
+from run import percentile  # noqa: E402
+
+METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:300000',
+    'pbkdf2:sha256:600000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+]
+PASSWORD = 'rahasia-123'
+
+
+def per_core(method, seconds):
+    stored = generate_password_hash(PASSWORD, method)
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        check_password_hash(stored, PASSWORD)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def storm(method, logins, workers, waiting):
+    hasher = auth.PasswordHasher(method=method, max_workers=workers, max_waiting=waiting, timeout=60)
+    stored = generate_password_hash(PASSWORD, method)
+    latencies, busy = [], 0
+    lock = threading.Lock()
+    gate = threading.Event()
+
+    def login():
+        nonlocal busy
+        gate.wait()
+        began = time.perf_counter()
+        try:
+            hasher.verify(stored, PASSWORD)
+        except auth.HasherBusy:
+            with lock:
+                busy += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=login) for _ in range(logins)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    gate.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    latencies.sort()
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 95), busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--methods', default=','.join(METHODS), help='comma separated Werkzeug methods')
+    parser.add_argument('--seconds', type=float, default=2.0, help='per method, single thread')
+    parser.add_argument('--storm', type=int, default=64, help='concurrent logins')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--waiting', type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, storm of {args.storm} logins on {args.workers} workers "
+          f"(+{args.waiting} waiting)")
+    print(f"{'method':<24}{'login/s/core':>13}{'ms/login':>10}{'storm/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'busy':>6}")
+    for method in (m.strip() for m in args.methods.split(',') if m.strip()):
+        rate = per_core(method, args.seconds)
+        throughput, p50, p95, busy = storm(method, args.storm, args.workers, args.waiting)
+        print(f"{method:<24}{rate:>13.1f}{1000 / rate:>10.1f}{throughput:>9.1f}"
+              f"{p50 * 1000:>9.0f}{p95 * 1000:>9.0f}{busy:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""Run load scenarios against the storefront and report latency percentiles.
+
+    python bookstore/benchmarks/seed.py --scale 10k --db /tmp/bench.db
+    python bookstore/benchmarks/run.py --db /tmp/bench.db --duration 20 --concurrency 4
+    python bookstore/benchmarks/run.py --db /tmp/bench.db --save-baseline
+
+Each virtual user logs in as a seeded user and runs the selected scenarios
+in turn, either through the Flask test client (default) or over HTTP
+against a local threaded WSGI server (``--wsgi``). Queries per request are
+read from the ``Server-Timing`` header added by ``perf.PerfMonitor``, which
+is switched on for every visitor of the benchmarked app; a response without
+it fails the run.
+
+The report lists p50/p95/p99 latency, queries per request and throughput
+per scenario, and compares them with ``baseline.json``. The exit status is
+1 when a scenario's p95 got worse than the tolerance allows or it runs more
+queries than before, or when responses came back without query counts.
+"""
+import argparse
+import html
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from seed import PASSWORD, WORDS, default_db_path, load_app  # noqa: E402
+
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+_QUERIES_RE = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+_NEXT_RE = re.compile(r'href="([^"]*cursor=[^"]*)"')
+
+
+class Result:
+    __slots__ = ('status', 'queries', 'body')
+
+    def __init__(self, status, server_timing, body):
+        self.status = status
+        match = _QUERIES_RE.search(server_timing or '')
+        self.queries = int(match.group(1)) if match else None
+        self.body = body
+
+
+class TestClient:
+    """Drives the app in-process through Flask's test client"""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        response = self._client.open(path, method=method, data=form, json=json_body)
+        return Result(response.status_code, ', '.join(response.headers.getlist('Server-Timing')),
+                      response.get_data(as_text=True))
+
+
+class HttpClient:
+    """Drives a running server over HTTP, keeping cookies per virtual user"""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect)
+
+    def request(self, method, path, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self._opener.open(req) as response:
+                return Result(response.status, response.headers.get('Server-Timing'),
+                              response.read().decode())
+        except urllib.error.HTTPError as e:
+            return Result(e.code, e.headers.get('Server-Timing'), e.read().decode(errors='replace'))
+
+
+# ===== SCENARIOS =====
+# Each scenario is a list of steps; a step returns (method, path, form, json)
+# from the previous response and the shared dataset facts.
+
+def browse(rng, data, previous):
+    if previous is None:
+        return 'GET', f"/books?category_id={rng.choice(data['categories'])}", None, None
+    links = _NEXT_RE.findall(previous.body)
+    if not links:
+        return None
+    return 'GET', html.unescape(links[-1]), None, None
+
+
+def search(rng, data, previous):
+    return 'GET', f'/books?search={rng.choice(WORDS)}', None, None
+
+
+def book_detail(rng, data, previous):
+    return 'GET', f"/book/{rng.randint(1, data['books'])}", None, None
+
+
+def add_to_cart(rng, data, previous):
+    return 'POST', '/add_to_cart', None, {'book_id': rng.randint(1, data['books']), 'quantity': 1}
+
+
+def view_cart(rng, data, previous):
+    return 'GET', '/cart', None, None
+
+
+def checkout(rng, data, previous):
+    return 'POST', '/process_checkout', {'shipping_address': 'Jl. Benchmark No. 1',
+                                         'payment_method': 'transfer'}, None
+
+
+def forum(rng, data, previous):
+    return 'GET', '/discussion', None, None
+
+
+def discussion_detail(rng, data, previous):
+    return 'GET', f"/discussion/{rng.randint(1, data['discussions'])}", None, None
+
+
+SCENARIOS = {
+    'browse': [browse, browse],
+    'search': [search],
+    'book_detail': [book_detail],
+    'cart_checkout': [add_to_cart, view_cart, checkout],
+    'forum': [forum, discussion_detail],
+}
+
+
+# ===== RUNNER =====
+def dataset_facts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        count = lambda table: conn.execute(f'SELECT MAX(id) FROM "{table}"').fetchone()[0] or 0
+        return {
+            'users': count('user'),
+            'books': count('book'),
+            'discussions': count('discussion'),
+            'categories': [row[0] for row in conn.execute('SELECT id FROM category')],
+        }
+    finally:
+        conn.close()
+
+
+def virtual_user(make_client, data, scenarios, deadline, seed, samples, lock):
+    rng = random.Random(seed)
+    client = make_client()
+    login = client.request('POST', '/login', form={
+        'username': f"user{rng.randint(1, data['users'])}", 'password': PASSWORD})
+    if login.status != 302:
+        raise RuntimeError(f'login gagal (status {login.status})')
+
+    local = {name: [] for name in scenarios}
+    while time.perf_counter() < deadline:
+        for name in scenarios:
+            previous = None
+            for step in SCENARIOS[name]:
+                request = step(rng, data, previous)
+                if request is None:
+                    break
+                method, path, form, json_body = request
+                started = time.perf_counter()
+                previous = client.request(method, path, form=form, json_body=json_body)
+                local[name].append((time.perf_counter() - started, previous.queries, previous.status))
+    with lock:
+        for name, rows in local.items():
+            samples[name].extend(rows)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, wall_time):
+    results = {}
+    for name, rows in samples.items():
+        latencies = sorted(duration * 1000 for duration, _, _ in rows)
+        queries = [q for _, q, _ in rows if q is not None]
+        results[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for _, _, status in rows if status >= 400),
+            'untimed': len(rows) - len(queries),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            'rps': round(len(rows) / wall_time, 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the report; returns the names of regressed scenarios"""
+    regressions = []
+    print(f"{'scenario':<14}{'req':>7}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>7}{'req/s':>8}  vs baseline")
+    for name, row in results.items():
+        base = baseline.get(name)
+        note = ''
+        if base:
+            change = (row['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0.0
+            note = f"p95 {change:+.0f}%"
+            worse = row['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+            more_queries = (row['queries_per_request'] or 0) > (base['queries_per_request'] or 0) + 0.5
+            if more_queries:
+                note += f", queries {base['queries_per_request']} -> {row['queries_per_request']}"
+            if worse or more_queries:
+                note += '  REGRESSION'
+                regressions.append(name)
+        print(f"{name:<14}{row['requests']:>7}{row['errors']:>5}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}"
+              f"{row['p99_ms']:>9.1f}{row['queries_per_request'] or 0:>7.1f}{row['rps']:>8.1f}  {note}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=default_db_path())
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated, from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--wsgi', action='store_true', help='go through a local HTTP server')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 increase (0.25 = 25%%)')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenario: ' + ', '.join(sorted(unknown)))
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} tidak ada; jalankan seed.py dulu')
+
+    m = load_app(args.db)
+    m.perf_monitor.threshold = float('inf')
+    # Virtual users are not admins; they still need Server-Timing for q/req
+    m.perf_monitor.public_timing = True
+    data = dataset_facts(args.db)
+
+    server = None
+    if args.wsgi:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, m.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        make_client = lambda: HttpClient(base_url)
+    else:
+        make_client = lambda: TestClient(m.app)
+
+    samples = {name: [] for name in scenarios}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(target=virtual_user,
+                         args=(make_client, data, scenarios, deadline, args.seed + i, samples, lock))
+        for i in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+
+    results = summarize(samples, wall_time)
+    total = sum(row['requests'] for row in results.values())
+    print(f"{data['books']:,} books, {args.concurrency} users, {wall_time:.1f}s, "
+          f"{total / wall_time:.1f} req/s ({'wsgi' if args.wsgi else 'test client'})")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+
+    untimed = [name for name, row in results.items() if row['untimed']]
+    if untimed:
+        print(f"❌ Tanpa header Server-Timing: {', '.join(untimed)}; jumlah query tidak bisa dibandingkan")
+        sys.exit(1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'meta': {
+                    'books': data['books'],
+                    'concurrency': args.concurrency,
+                    'duration': args.duration,
+                    'mode': 'wsgi' if args.wsgi else 'test_client',
+                    'python': platform.python_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                    'created': time.strftime('%Y-%m-%d'),
+                },
+                'results': results,
+            }, f, indent=2)
+            f.write('\n')
+        print(f"✅ Baseline disimpan ke {args.baseline}")
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Seed a benchmark database with synthetic data.
+
+    python bookstore/benchmarks/seed.py --scale 10k --db /tmp/bench.db
+
+``--scale`` (10k, 100k or 1m) is the number of books; the other tables are
+sized relative to it (see ``RATIOS``). The data is generated from a fixed
+random seed, so the same scale always produces the same database. Every
+seeded user can log in with the password ``password``.
+
+Run from the repository root (the app resolves its upload folder from
+there). The target database must be new or empty.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Rows per table relative to the number of books
+RATIOS = {
+    'users': 0.1,
+    'orders': 0.5,            # 1-3 items each
+    'discussions': 0.05,
+    'comments': 0.5,
+    'discussion_likes': 0.25,
+    'comment_likes': 0.5,
+}
+
+BATCH_SIZE = 5000
+PASSWORD = 'password'
+
+WORDS = (
+    'rahasia laut senja hujan kota malam bintang jalan rumah cahaya hutan '
+    'sungai waktu mimpi perang cinta bumi angin gunung pulau kisah negeri '
+    'matahari bulan pelangi sejarah ilmu bisnis data kopi pasar keluarga'
+).split()
+NAMES = (
+    'Andi Budi Citra Dewi Eka Fajar Gita Hadi Indah Joko Kartika Laila '
+    'Made Nanda Oki Putri Rina Sari Tono Wulan Yogi Zahra'
+).split()
+STATUSES = ('pending', 'paid', 'shipped', 'delivered')
+PAYMENTS = ('transfer', 'cod', 'e_wallet')
+
+
+def default_db_path():
+    return os.path.join(tempfile.gettempdir(), 'tokobuku-bench.db')
+
+
+def load_app(db_path):
+    """Import the app against ``db_path`` (must happen before the import)"""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(db_path)
+    import app as bookstore_app
+    bookstore_app.initialize_database()
+    return bookstore_app
+
+
+def random_date(rng, start, days=730):
+    return start + timedelta(seconds=rng.randrange(days * 24 * 3600))
+
+
+def title(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+
+
+def person(rng):
+    return f'{rng.choice(NAMES)} {rng.choice(NAMES)}'
+
+
+def unique_pairs(rng, count, left, right):
+    """``count`` distinct (1..left, 1..right) pairs"""
+    count = min(count, left * right)
+    pairs = set()
+    while len(pairs) < count:
+        pairs.add((rng.randint(1, left), rng.randint(1, right)))
+    return sorted(pairs)
+
+
+def insert_batches(m, model, rows):
+    """Bulk insert an iterable of dicts in batches; returns the row count"""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            m.db.session.execute(m.db.insert(model), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        m.db.session.execute(m.db.insert(model), batch)
+        total += len(batch)
+    m.db.session.commit()
+    return total
+
+
+def seed(m, books, rng_seed=42):
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(rng_seed)
+    start = datetime.utcnow() - timedelta(days=730)
+    counts = {name: max(1, int(books * ratio)) for name, ratio in RATIOS.items()}
+    counts['books'] = books
+    categories = [category.id for category in m.category_registry.all()]
+    # One hash for everyone: hashing per user would dominate the seeding time
+    password = generate_password_hash(PASSWORD)
+
+    def timed(label, model, rows):
+        started = time.perf_counter()
+        total = insert_batches(m, model, rows)
+        print(f"  {label:<18} {total:>9,} rows  {time.perf_counter() - started:6.1f}s")
+
+    users = counts['users']
+    timed('users', m.User, ({
+        'username': f'user{i}',
+        'email': f'user{i}@bench.local',
+        'password': password,
+        'created_at': random_date(rng, start),
+        'is_admin': i == 1,
+    } for i in range(1, users + 1)))
+
+    prices = {}
+
+    def book_rows():
+        for i in range(1, books + 1):
+            prices[i] = rng.randrange(20, 300) * 1000
+            yield {
+                'title': title(rng),
+                'author': person(rng),
+                'description': ' '.join(rng.choice(WORDS) for _ in range(30)),
+                'price': prices[i],
+                'stock': rng.randint(5, 100),
+                'created_at': random_date(rng, start),
+                'user_id': rng.randint(1, users),
+                'category_id': rng.choice(categories),
+            }
+    timed('books', m.Book, book_rows())
+
+    orders = counts['orders']
+    items = []
+
+    def order_rows():
+        for order_id in range(1, orders + 1):
+            total = 0
+            for _ in range(rng.randint(1, 3)):
+                book_id = rng.randint(1, books)
+                quantity = rng.randint(1, 3)
+                total += prices[book_id] * quantity
+                items.append({'order_id': order_id, 'book_id': book_id,
+                              'quantity': quantity, 'price': prices[book_id]})
+            yield {
+                'user_id': rng.randint(1, users),
+                'total_amount': total,
+                'status': rng.choice(STATUSES),
+                'shipping_address': f'Jl. {title(rng)} No. {rng.randint(1, 200)}',
+                'payment_method': rng.choice(PAYMENTS),
+                'created_at': random_date(rng, start),
+            }
+    timed('orders', m.Order, order_rows())
+    timed('order items', m.OrderItem, iter(items))
+
+    discussions = counts['discussions']
+    timed('discussions', m.Discussion, ({
+        'user_id': rng.randint(1, users),
+        'title': title(rng),
+        'content': ' '.join(rng.choice(WORDS) for _ in range(40)),
+        'created_at': random_date(rng, start),
+        'is_public': rng.random() < 0.9,
+    } for _ in range(discussions)))
+
+    comments = counts['comments']
+    timed('comments', m.DiscussionComment, ({
+        'user_id': rng.randint(1, users),
+        'discussion_id': rng.randint(1, discussions),
+        'content': ' '.join(rng.choice(WORDS) for _ in range(12)),
+        'created_at': random_date(rng, start),
+    } for _ in range(comments)))
+
+    timed('discussion likes', m.DiscussionLike, (
+        {'user_id': user_id, 'discussion_id': discussion_id}
+        for user_id, discussion_id in unique_pairs(rng, counts['discussion_likes'], users, discussions)
+    ))
+    timed('comment likes', m.CommentLike, (
+        {'user_id': user_id, 'comment_id': comment_id}
+        for user_id, comment_id in unique_pairs(rng, counts['comment_likes'], users, comments)
+    ))
+
+    # Maintained counters the app normally updates itself
+    m.db.session.execute(m.db.text(
+        "UPDATE discussion SET like_count = likes.n FROM "
+        "(SELECT discussion_id, COUNT(*) AS n FROM discussion_like GROUP BY discussion_id) AS likes "
+        "WHERE likes.discussion_id = discussion.id"))
+    m.db.session.execute(m.db.text(
+        "UPDATE discussion_comment SET like_count = likes.n FROM "
+        "(SELECT comment_id, COUNT(*) AS n FROM comment_like GROUP BY comment_id) AS likes "
+        "WHERE likes.comment_id = discussion_comment.id"))
+    m.db.session.commit()
+    m.rebuild_stats()
+    m.db.session.execute(m.db.text("ANALYZE"))
+    m.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--db', default=default_db_path())
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    m = load_app(args.db)
+    m.perf_monitor.threshold = float('inf')  # bulk inserts are slow by design
+    with m.app.app_context():
+        if m.db.session.query(m.Book.id).first() is not None:
+            sys.exit(f"{args.db} sudah berisi data; pakai database baru.")
+        print(f"Seeding {args.db} ({args.scale})")
+        started = time.perf_counter()
+        seed(m, SCALES[args.scale], args.seed)
+    print(f"✅ Selesai dalam {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Show readers making progress while a long write transaction runs.
+
+    python bookstore/benchmarks/wal_readers.py --readers 8 --write-seconds 3
+
+A writer thread holds one write transaction open for ``--write-seconds``,
+inserting rows the whole time, then commits. Meanwhile reader threads run
+short queries in a loop. For each SQLite profile the script reports how
+many reads finished during the write, their worst latency and how many
+failed with ``database is locked``.
+
+With the ``default`` profile (rollback journal) the readers stall once the
+writer spills or commits. With ``production`` (WAL) they keep reading the
+last committed snapshot.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import sqlite_tuning  # noqa: E402
+
+ROWS = 50_000
+
+
+def connect(path, pragmas):
+    conn = sqlite3.connect(path, timeout=pragmas.get('busy_timeout', 5000) / 1000,
+                           isolation_level=None, check_same_thread=False)
+    sqlite_tuning.apply_pragmas(conn, pragmas)
+    return conn
+
+
+def prepare(path, pragmas):
+    conn = connect(path, pragmas)
+    conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, price INTEGER)')
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO item (name, price) VALUES (?, ?)',
+                     ((f'buku {i}', i % 1000) for i in range(ROWS)))
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def writer(path, pragmas, seconds, started, done):
+    conn = connect(path, pragmas)
+    conn.execute('BEGIN IMMEDIATE')
+    started.set()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        # Large enough to overflow the page cache, like a bulk import would
+        conn.executemany('INSERT INTO item (name, price) VALUES (?, ?)',
+                         (('x' * 200, i) for i in range(2000)))
+    conn.execute('COMMIT')
+    conn.close()
+    done.set()
+
+
+def reader(path, pragmas, started, done, stats, lock):
+    conn = connect(path, pragmas)
+    reads = errors = 0
+    worst = 0.0
+    started.wait()
+    while not done.is_set():
+        began = time.perf_counter()
+        try:
+            conn.execute('SELECT COUNT(*), MAX(price) FROM item WHERE id BETWEEN ? AND ?',
+                         (reads % ROWS, reads % ROWS + 500)).fetchone()
+            reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+        worst = max(worst, time.perf_counter() - began)
+    conn.close()
+    with lock:
+        stats['reads'] += reads
+        stats['errors'] += errors
+        stats['worst'] = max(stats['worst'], worst)
+
+
+def run(profile, readers, seconds, busy_timeout):
+    pragmas = sqlite_tuning.pragmas_for(profile, {'busy_timeout': busy_timeout})
+    # Small cache for both, so the writer has to spill dirty pages
+    pragmas['cache_size'] = -2000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        prepare(path, pragmas)
+        started, done = threading.Event(), threading.Event()
+        stats = {'reads': 0, 'errors': 0, 'worst': 0.0}
+        lock = threading.Lock()
+        threads = [threading.Thread(target=reader, args=(path, pragmas, started, done, stats, lock))
+                   for _ in range(readers)]
+        threads.append(threading.Thread(target=writer, args=(path, pragmas, seconds, started, done)))
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+    return stats, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--write-seconds', type=float, default=3.0)
+    parser.add_argument('--busy-timeout', type=int, default=1000, help='ms')
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'reads':>8}{'reads/s':>10}{'worst ms':>10}{'locked':>8}")
+    for profile in ('default', 'production'):
+        stats, elapsed = run(profile, args.readers, args.write_seconds, args.busy_timeout)
+        print(f"{profile:<12}{stats['reads']:>8}{stats['reads'] / elapsed:>10.0f}"
+              f"{stats['worst'] * 1000:>10.1f}{stats['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
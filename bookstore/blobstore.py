@@ -0,0 +1,69 @@
+"""Content-addressed file storage for uploaded covers.
+
+Files are stored as ``<folder>/<aa>/<sha256>.<ext>``, so identical uploads
+share one file and a stored name never points at different bytes. That
+makes the URLs safe to cache forever. Callers decide when a blob is no
+longer referenced and call ``remove()``.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+_BLOB_RE = re.compile(r'[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+')
+
+
+def blob_name(digest, ext):
+    return f'{digest[:2]}/{digest}.{ext}'
+
+
+def is_blob(name):
+    """True for names produced by ``store()``, and nothing else"""
+    return bool(name and _BLOB_RE.fullmatch(name))
+
+
+def store(folder, stream, ext):
+    """Copy ``stream`` into the store and return ``(name, created)``.
+
+    ``created`` is False when identical content was already stored, in
+    which case nothing new is written.
+    """
+    ext = re.sub(r'[^a-z0-9]', '', (ext or '').lower()) or 'bin'
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
+        return commit(folder, tmp_path, digest.hexdigest(), ext)
+    except BaseException:
+        _unlink(tmp_path)
+        raise
+
+
+def commit(folder, tmp_path, digest, ext):
+    """Move an already hashed temp file (in ``folder``) to its blob name"""
+    name = blob_name(digest, ext)
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        _unlink(tmp_path)
+        return name, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+    return name, True
+
+
+def remove(folder, name):
+    _unlink(os.path.join(folder, name))
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
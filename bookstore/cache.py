@@ -0,0 +1,212 @@
+"""Small cache for rendered pages and query results.
+
+Entries live in a bounded in-process LRU with a TTL. An optional shared
+backend (a directory, e.g. on ``/dev/shm``) lets several gunicorn workers
+reuse each other's entries.
+
+Invalidation works with tags. Every entry is stored under the current
+version of its tags; ``invalidate(tag)`` bumps the version, so all entries
+written under the old one stop matching in every worker. Stale entries
+simply age out of the LRU or expire on disk.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """Thread-safe LRU with a per-entry expiry time"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache:
+    """Cache shared between processes through files in one directory.
+
+    Values are pickled, so the directory must only be writable by the app.
+    """
+
+    SWEEP_EVERY = 256
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._writes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self._write(self._path(key), (time.time() + ttl, value))
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self):
+        """Delete expired entries"""
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.') or entry.name.startswith('tag-'):
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    expires_at, _ = pickle.load(f)
+                if expires_at < now:
+                    os.remove(entry.path)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+    def tag_version(self, tag):
+        try:
+            with open(self._tag_path(tag)) as f:
+                return f.read()
+        except OSError:
+            return '0'
+
+    def bump_tag(self, tag):
+        self._write(self._tag_path(tag), os.urandom(8).hex(), binary=False)
+
+    def _tag_path(self, tag):
+        return os.path.join(self.directory, 'tag-' + hashlib.sha1(tag.encode()).hexdigest())
+
+    def _write(self, path, data, binary=True):
+        # Write then rename, so readers never see a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb' if binary else 'w') as f:
+                if binary:
+                    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                else:
+                    f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class Cache:
+    """Two-level cache: local LRU in front of an optional shared backend"""
+
+    def __init__(self, max_entries=1024, ttl=300, shared_dir=None):
+        self.ttl = ttl
+        self.local = MemoryCache(max_entries)
+        self.shared = FileCache(shared_dir) if shared_dir else None
+        self._tags = {}
+        self._tags_lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def tag_version(self, tag):
+        if self.shared is not None:
+            return self.shared.tag_version(tag)
+        with self._tags_lock:
+            return str(self._tags.get(tag, 0))
+
+    def invalidate(self, *tags):
+        """Drop every entry stored under any of ``tags``"""
+        for tag in tags:
+            if self.shared is not None:
+                self.shared.bump_tag(tag)
+            else:
+                with self._tags_lock:
+                    self._tags[tag] = self._tags.get(tag, 0) + 1
+
+    def _key(self, key, tags):
+        versions = ','.join(f'{tag}={self.tag_version(tag)}' for tag in tags)
+        return f'{key}|{versions}'
+
+    def lookup(self, key, tags=()):
+        """Return ``(versioned_key, value)``; value is None on a miss.
+
+        Pass the versioned key to ``store()`` after computing the value, so
+        an invalidation that happens meanwhile is not overwritten by data
+        read before it.
+        """
+        full_key = self._key(key, tags)
+        value = self.local.get(full_key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(full_key)
+            if value is not None:
+                self.local.set(full_key, value, self.ttl)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return full_key, value
+
+    def store(self, full_key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(full_key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(full_key, value, ttl)
+
+    def get(self, key, tags=()):
+        return self.lookup(key, tags)[1]
+
+    def set(self, key, value, tags=(), ttl=None):
+        self.store(self._key(key, tags), value, ttl)
+
+    def get_or_set(self, key, tags, compute, ttl=None):
+        """Return the cached value for ``key`` or compute and store it"""
+        full_key, value = self.lookup(key, tags)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.store(full_key, value, ttl)
+        return value
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            for entry in os.scandir(self.shared.directory):
+                if not entry.name.startswith('tag-'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
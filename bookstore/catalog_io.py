@@ -0,0 +1,272 @@
+"""Bulk catalog import and export in CSV or JSON Lines.
+
+Both directions stream. ``read_rows()`` parses one record at a time, so a
+catalog of any size is never held in memory. ``clean_row()`` turns a
+record into the columns of a ``book`` row, and ``chunks()`` groups the
+clean rows for batched inserts. ``write_rows()`` encodes rows back into
+text chunks for a streaming response or file.
+
+A record has the columns in ``FIELDS``. ``category`` is a category name
+(matched case-insensitively); a numeric ``category_id`` works as well.
+``image`` names a file in the covers archive given with the import.
+Other columns (like the ``id`` and ``seller`` written by the export) are
+ignored, so an exported catalog can be imported again as is.
+
+CSV output is opened in spreadsheets, which run a cell starting with ``=``,
+``+``, ``-``, ``@``, tab or CR as a formula. Such text cells are written
+with a leading ``'`` and read back without it.
+"""
+import csv
+import io
+import json
+import math
+import os
+import time
+import zipfile
+from itertools import islice
+
+FIELDS = ('title', 'author', 'description', 'price', 'stock', 'category', 'image')
+EXPORT_FIELDS = ('id',) + FIELDS + ('seller',)
+FORMATS = ('csv', 'jsonl')
+
+# Column sizes of the book table
+MAX_TITLE = 200
+MAX_AUTHOR = 100
+
+# Errors kept in a report; the count beyond that is still exact
+MAX_REPORTED_ERRORS = 100
+
+# Export output is yielded in pieces of about this many characters
+WRITE_CHUNK = 64 * 1024
+
+# Cell prefixes spreadsheets evaluate as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class RowError(ValueError):
+    """A record that cannot be imported; the message says why"""
+
+
+class CatalogError(ValueError):
+    """The rest of the file cannot be read (bad encoding or CSV framing)"""
+
+
+def escape_cell(value):
+    """Text that a spreadsheet shows as is instead of evaluating it"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def unescape_cell(value):
+    """Undo ``escape_cell()``"""
+    if isinstance(value, str) and value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+def detect_format(filename, default='csv'):
+    """``csv`` or ``jsonl`` from a file name's extension"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if ext in ('.csv', '.txt'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line, record)`` from a text stream.
+
+    ``record`` is a dict, or a ``RowError`` for a line that cannot be
+    parsed, so one broken line does not end the import. Raises
+    ``CatalogError`` when the file itself stops making sense.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown catalog format {fmt!r}')
+    line = 0
+    try:
+        for line, record in _read(stream, fmt):
+            yield line, record
+    except UnicodeDecodeError:
+        raise CatalogError(f'setelah baris {line}: file bukan teks UTF-8') from None
+    except csv.Error as error:
+        raise CatalogError(f'setelah baris {line}: {error}') from None
+
+
+def _read(stream, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if reader.fieldnames:
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for record in reader:
+            yield reader.line_num, {key: unescape_cell(value) for key, value in record.items()}
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as error:
+                yield line, RowError(f'JSON tidak valid: {error}')
+                continue
+            if not isinstance(record, dict):
+                yield line, RowError('baris harus berupa objek JSON')
+                continue
+            yield line, record
+
+
+def _text(record, key, required=False, max_length=None):
+    value = record.get(key)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'{key} wajib diisi')
+    if max_length and len(value) > max_length:
+        raise RowError(f'{key} lebih dari {max_length} karakter')
+    return value
+
+
+def _number(record, key, kind, default=None):
+    value = record.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if default is None:
+            raise RowError(f'{key} wajib diisi')
+        return default
+    try:
+        number = kind(value.strip() if isinstance(value, str) else value)
+    except (TypeError, ValueError):
+        raise RowError(f'{key} bukan angka: {value!r}') from None
+    if isinstance(value, float) and kind is int and number != value:
+        raise RowError(f'{key} harus bilangan bulat: {value!r}')
+    if not math.isfinite(number) or number < 0:
+        raise RowError(f'{key} tidak valid: {value!r}')
+    return number
+
+
+def clean_row(record, categories):
+    """Validate a record; returns the ``book`` columns or raises RowError.
+
+    ``categories`` maps lower-cased category names to ids. The returned
+    ``image`` is the archive name from the record (or None), not a stored
+    cover yet.
+    """
+    category = _text(record, 'category')
+    if category:
+        category_id = categories.get(category.lower())
+        if category_id is None:
+            raise RowError(f'kategori tidak dikenal: {category}')
+    elif str(record.get('category_id') or '').strip():
+        category_id = _number(record, 'category_id', int)
+        if category_id not in categories.values():
+            raise RowError(f'kategori tidak dikenal: {category_id}')
+    else:
+        raise RowError('category wajib diisi')
+    return {
+        'title': _text(record, 'title', required=True, max_length=MAX_TITLE),
+        'author': _text(record, 'author', required=True, max_length=MAX_AUTHOR),
+        'description': _text(record, 'description'),
+        'price': _number(record, 'price', float),
+        'stock': _number(record, 'stock', int, default=0),
+        'category_id': category_id,
+        'image': _text(record, 'image') or None,
+    }
+
+
+def chunks(iterable, size):
+    """Lists of up to ``size`` items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class CoverArchive:
+    """Cover images in a zip file, looked up by file name.
+
+    Names match with or without the folders inside the archive. Members
+    larger than ``max_size`` bytes are skipped.
+    """
+
+    def __init__(self, file, max_size=None):
+        self.zip = zipfile.ZipFile(file)
+        self.max_size = max_size
+        self._members = {}
+        for info in self.zip.infolist():
+            if info.is_dir():
+                continue
+            self._members.setdefault(info.filename.lower(), info)
+            self._members.setdefault(os.path.basename(info.filename).lower(), info)
+
+    def open(self, name):
+        """A binary stream of the member, or None if there is no usable one"""
+        info = self._members.get(name.replace('\\', '/').lower())
+        if info is None or (self.max_size is not None and info.file_size > self.max_size):
+            return None
+        return self.zip.open(info)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ImportReport:
+    """Running totals of an import, passed to the progress callback"""
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.failed = 0
+        self.batches = 0
+        self.covers = 0
+        self.missing_covers = 0
+        self.errors = []
+        self.aborted = None
+        self.started = time.monotonic()
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def summary(self):
+        return (f'{self.imported} buku diimpor dari {self.read} baris '
+                f'({self.failed} gagal, {self.covers} cover) dalam {self.elapsed:.1f}s')
+
+
+def write_rows(rows, fmt, fields=EXPORT_FIELDS):
+    """Yield the encoded catalog in chunks of about ``WRITE_CHUNK`` characters.
+
+    ``rows`` is an iterable of dicts keyed by ``fields``; a CSV starts with
+    a header line and has its formula-like text cells escaped.
+    """
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        def write(row):
+            writer.writerow({key: escape_cell(value) for key, value in row.items()})
+    elif fmt == 'jsonl':
+        def write(row):
+            buffer.write(json.dumps({key: row.get(key) for key in fields}, ensure_ascii=False))
+            buffer.write('\n')
+    else:
+        raise ValueError(f'unknown catalog format {fmt!r}')
+    for row in rows:
+        write(row)
+        if buffer.tell() >= WRITE_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,118 @@
+"""In-process publish/subscribe hub for Server-Sent Events.
+
+Views publish small JSON events to a channel (e.g. ``user:42``); every open
+``/api/events`` stream subscribed to that channel receives them. Each
+subscriber has a bounded queue: events for a client too slow to keep up
+are dropped rather than held in memory, and the client is told to reload
+its state.
+
+The hub lives in one process, so a stream only sees events published by
+the worker that serves it. Cached values (like the cart count) are shared
+through the page cache, which is why streams send the current value first.
+"""
+import json
+import queue
+import threading
+import time
+
+
+def format_sse(event, data):
+    """One SSE message; ``data`` is sent as JSON"""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class Subscription:
+    def __init__(self, hub, channel, max_queue):
+        self.hub = hub
+        self.channel = channel
+        self.queue = queue.Queue(max_queue)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next message, or None after ``timeout`` seconds without one"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EventHub:
+    def __init__(self, max_subscribers=200, max_queue=100):
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self._channels = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, channel):
+        """A new subscription, or None when the hub is full"""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = Subscription(self, channel, self.max_queue)
+            self._channels.setdefault(channel, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers and subscription in subscribers:
+                subscribers.remove(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, event, data):
+        """Send an event to the channel's subscribers; returns how many got it"""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+            self.published += 1
+        message = format_sse(event, data)
+        for subscription in subscribers:
+            subscription.put(message)
+        return len(subscribers)
+
+    def stream(self, subscription, first=(), keepalive=15.0, max_age=300.0, retry=3.0):
+        """Yield SSE text for a subscription until ``max_age`` seconds pass.
+
+        Browsers reconnect on their own ``retry`` seconds after the stream
+        ends, which keeps a worker thread from being held by one client
+        forever.
+        """
+        deadline = time.monotonic() + max_age
+        try:
+            yield f'retry: {int(retry * 1000)}\n\n'
+            for event, data in first:
+                yield format_sse(event, data)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                message = subscription.get(min(keepalive, remaining))
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield format_sse('resync', {})
+                yield message if message is not None else ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': self._count, 'channels': len(self._channels), 'published': self.published}
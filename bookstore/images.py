@@ -0,0 +1,178 @@
+"""Resized cover variants for responsive images.
+
+Each uploaded cover gets WebP and JPEG copies at a few widths, re-encoded
+without EXIF/ICC metadata, plus a small JSON manifest with the dimensions
+of every variant. Templates build ``srcset`` from the manifest and fall back
+to the original file until the variants exist.
+
+Pillow is optional: without it uploads are stored as-is and no variants
+are produced.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+VARIANT_DIR = 'variants'
+VARIANT_WIDTHS = (200, 400, 800)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+logger = logging.getLogger(__name__)
+
+_VARIANT_RE = re.compile(rf'{VARIANT_DIR}/(.+)\.(?:\d+w\.[a-z]+|json)')
+
+
+def variant_filename(filename, width, ext):
+    return f'{VARIANT_DIR}/{filename}.{width}w.{ext}'
+
+
+def manifest_filename(filename):
+    return f'{VARIANT_DIR}/{filename}.json'
+
+
+def variant_source(name):
+    """The cover a variant or manifest file was made from, or None"""
+    match = _VARIANT_RE.fullmatch(name or '')
+    return match.group(1) if match else None
+
+
+def build_variants(folder, filename, widths=VARIANT_WIDTHS):
+    """Encode the variants of ``folder/filename`` and write their manifest.
+
+    Returns the manifest dict.
+    """
+    # Names may contain sub-directories (content-addressed blobs)
+    os.makedirs(os.path.dirname(os.path.join(folder, manifest_filename(filename))), exist_ok=True)
+    with Image.open(os.path.join(folder, filename)) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGB')
+
+    manifest = {'width': image.width, 'height': image.height, 'variants': []}
+    # Never upscale; a small original still gets one variant at its own width
+    targets = sorted({min(width, image.width) for width in widths})
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for ext, (fmt, options) in VARIANT_FORMATS.items():
+            name = variant_filename(filename, width, ext)
+            tmp_path = os.path.join(folder, f'{name}.{threading.get_ident()}.tmp')
+            # A fresh image carries no EXIF/XMP/ICC data unless passed explicitly
+            resized.save(tmp_path, fmt, **options)
+            os.replace(tmp_path, os.path.join(folder, name))
+            manifest['variants'].append({'file': name, 'format': ext, 'width': width, 'height': height})
+
+    manifest_path = os.path.join(folder, manifest_filename(filename))
+    tmp_path = f'{manifest_path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+class CoverProcessor:
+    """Builds cover variants and serves their manifests.
+
+    ``submit()`` encodes on a small thread pool that is only created on
+    first use; callers with a job queue use ``process()`` instead.
+    """
+
+    def __init__(self, max_workers=2, cache_size=4096):
+        self.enabled = Image is not None
+        self._max_workers = max_workers
+        self._executor = None
+        self._manifests = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def submit(self, folder, filename):
+        """Queue variant generation; returns a Future, or None without Pillow"""
+        if not self.enabled or not filename:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='covers')
+        return self._executor.submit(self._process, folder, filename)
+
+    def process(self, folder, filename, strict=False):
+        """Generate variants synchronously (CLI/backfill and job use).
+
+        With ``strict`` errors are raised instead of logged, so a job queue
+        can retry.
+        """
+        if not (self.enabled and filename):
+            return None
+        if strict:
+            manifest = build_variants(folder, filename)
+            self._remember((folder, filename), manifest)
+            return manifest
+        return self._process(folder, filename)
+
+    def manifest(self, folder, filename):
+        """Manifest for a cover, or None if variants are not (yet) available"""
+        if not filename:
+            return None
+        key = (folder, filename)
+        with self._lock:
+            cached = self._manifests.get(key)
+            if cached is not None:
+                self._manifests.move_to_end(key)
+                return cached
+        try:
+            with open(os.path.join(folder, manifest_filename(filename))) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, manifest)
+        return manifest
+
+    def remove(self, folder, filename):
+        """Delete all variants of a cover (the original is left alone)"""
+        if not filename:
+            return
+        manifest = self.manifest(folder, filename)
+        with self._lock:
+            self._manifests.pop((folder, filename), None)
+        names = [variant['file'] for variant in manifest['variants']] if manifest else []
+        names.append(manifest_filename(filename))
+        for name in names:
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+
+    def _process(self, folder, filename):
+        try:
+            manifest = build_variants(folder, filename)
+        except Exception:
+            logger.exception('Gagal membuat varian cover %s', filename)
+            return None
+        self._remember((folder, filename), manifest)
+        return manifest
+
+    def _remember(self, key, manifest):
+        with self._lock:
+            self._manifests[key] = manifest
+            self._manifests.move_to_end(key)
+            while len(self._manifests) > self._cache_size:
+                self._manifests.popitem(last=False)
+
+
+def srcset(manifest, url_for_file, ext):
+    """``srcset`` value for the variants of one format"""
+    if not manifest:
+        return ''
+    return ', '.join(
+        f"{url_for_file(variant['file'])} {variant['width']}w"
+        for variant in manifest['variants'] if variant['format'] == ext
+    )
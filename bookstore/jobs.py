@@ -0,0 +1,278 @@
+"""Durable background jobs in a SQLite file, run by in-process worker threads.
+
+Views call ``JobQueue.enqueue()`` for work that can happen after the
+response, such as building cover variants or deleting unused files. The
+job is one row in the queue file. Any process that runs a ``WorkerPool``
+on the same file picks it up: the web workers themselves, or a dedicated
+``flask run-jobs`` process.
+
+A worker claims a job by leasing it for ``lease`` seconds. A job whose
+worker died is claimed again once the lease runs out, so handlers must be
+safe to run twice. A failing job is retried with exponential backoff
+until ``max_attempts``, then kept as ``failed`` for inspection.
+
+``key`` makes an enqueue idempotent: while a job with that key is still
+in the queue (finished ones are kept for ``retention`` seconds), enqueuing
+the same key again returns the existing job instead of adding one.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+
+try:
+    from . import sqlite_tuning
+except ImportError:
+    import sqlite_tuning
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS job (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        key TEXT UNIQUE,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_at REAL NOT NULL,
+        worker TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        finished_at REAL
+    )
+    """,
+    # Queued jobs are due at run_at; running ones are leased until run_at
+    'CREATE INDEX IF NOT EXISTS ix_job_status_run_at ON job (status, run_at)',
+    'CREATE INDEX IF NOT EXISTS ix_job_finished ON job (finished_at) WHERE finished_at IS NOT NULL',
+]
+
+
+class Job:
+    __slots__ = ('id', 'name', 'args', 'kwargs', 'attempts', 'max_attempts', 'worker')
+
+    def __init__(self, id, name, payload, attempts, max_attempts, worker):
+        self.id = id
+        self.name = name
+        data = json.loads(payload)
+        self.args = data.get('args', [])
+        self.kwargs = data.get('kwargs', {})
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.worker = worker
+
+
+class JobQueue:
+    """Job handlers by name plus the queue file they are stored in"""
+
+    def __init__(self, path, max_attempts=5, backoff=2.0, max_backoff=3600.0, lease=300.0,
+                 retention=7 * 24 * 3600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.retention = retention
+        self.handlers = {}
+        self.enqueued = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        sqlite_tuning.apply_pragmas(self._conn, sqlite_tuning.pragmas_for('production'))
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+    def task(self, name, max_attempts=None):
+        """Register the decorated function as the handler of ``name`` jobs"""
+        def decorator(fn):
+            self.handlers[name] = (fn, max_attempts or self.max_attempts)
+            return fn
+        return decorator
+
+    def enqueue(self, name, *args, key=None, delay=0, **kwargs):
+        """Store a job and return its id.
+
+        Arguments must be JSON serializable. With ``key``, an existing job
+        with the same key is returned instead of queuing a duplicate.
+        """
+        if name not in self.handlers:
+            raise KeyError(f'no handler for job {name!r}')
+        now = time.time()
+        payload = json.dumps({'args': args, 'kwargs': kwargs}, separators=(',', ':'))
+        with self._lock:
+            row = self._conn.execute(
+                'INSERT INTO job (name, payload, key, status, max_attempts, run_at, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO NOTHING RETURNING id',
+                (name, payload, key, QUEUED, self.handlers[name][1], now + delay, now)
+            ).fetchone()
+            if row is None:
+                row = self._conn.execute('SELECT id FROM job WHERE key = ?', (key,)).fetchone()
+        self.enqueued.set()
+        return row[0]
+
+    def claim(self, worker):
+        """Lease the next due job to ``worker``; None when nothing is due"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'UPDATE job SET status = ?, attempts = attempts + 1, run_at = ?, worker = ? '
+                'WHERE id = (SELECT id FROM job WHERE status IN (?, ?) AND run_at <= ? '
+                'ORDER BY run_at LIMIT 1) '
+                'RETURNING id, name, payload, attempts, max_attempts, worker',
+                (RUNNING, now + self.lease, worker, QUEUED, RUNNING, now)
+            ).fetchone()
+        return Job(*row) if row else None
+
+    def _finish(self, job, status, error=None, run_at=None):
+        # Only the current lease holder may settle a job
+        with self._lock:
+            self._conn.execute(
+                'UPDATE job SET status = ?, error = ?, run_at = coalesce(?, run_at), '
+                'finished_at = CASE WHEN ? IN (?, ?) THEN ? END '
+                'WHERE id = ? AND worker = ? AND attempts = ?',
+                (status, error, run_at, status, DONE, FAILED, time.time(), job.id, job.worker, job.attempts)
+            )
+
+    def complete(self, job):
+        self._finish(job, DONE)
+
+    def fail(self, job, error):
+        """Schedule a retry with backoff, or mark the job failed for good"""
+        if job.attempts >= job.max_attempts:
+            self._finish(job, FAILED, error)
+            return False
+        delay = min(self.backoff * 2 ** (job.attempts - 1), self.max_backoff)
+        self._finish(job, QUEUED, error, time.time() + delay * random.uniform(0.5, 1.5))
+        return True
+
+    def run_one(self, worker, context=None):
+        """Claim and run one job; returns False when nothing was due"""
+        job = self.claim(worker)
+        if job is None:
+            return False
+        handler = self.handlers.get(job.name)
+        if handler is None:
+            self._finish(job, FAILED, f'no handler for job {job.name!r}')
+            return True
+        if job.attempts > job.max_attempts:
+            # Its lease ran out on the last attempt, most likely in a dead worker
+            self._finish(job, FAILED, 'lease expired')
+            return True
+        try:
+            if context is None:
+                handler[0](*job.args, **job.kwargs)
+            else:
+                with context():
+                    handler[0](*job.args, **job.kwargs)
+        except Exception:
+            error = traceback.format_exc(limit=5)[-2000:]
+            retried = self.fail(job, error)
+            logger.warning('Job %s #%d failed (attempt %d/%d)%s', job.name, job.id, job.attempts,
+                           job.max_attempts, ', will retry' if retried else '', exc_info=True)
+        else:
+            self.complete(job)
+        return True
+
+    def sweep(self):
+        """Delete finished jobs older than ``retention``; returns how many"""
+        with self._lock:
+            return self._conn.execute(
+                'DELETE FROM job WHERE finished_at < ?', (time.time() - self.retention,)).rowcount
+
+    def retry_failed(self):
+        """Queue every failed job again from its first attempt"""
+        with self._lock:
+            return self._conn.execute(
+                'UPDATE job SET status = ?, attempts = 0, run_at = ?, finished_at = NULL WHERE status = ?',
+                (QUEUED, time.time(), FAILED)
+            ).rowcount
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM job GROUP BY status').fetchall()
+        return {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def failures(self, limit=20):
+        """Latest failed jobs as ``(id, name, attempts, error)``"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT id, name, attempts, error FROM job WHERE status = ? ORDER BY finished_at DESC LIMIT ?',
+                (FAILED, limit)
+            ).fetchall()
+
+
+class WorkerPool:
+    """Threads that run jobs from a ``JobQueue`` until stopped.
+
+    ``context`` is called around every job (e.g. ``app.app_context``).
+    Idle workers poll every ``poll`` seconds and wake up at once when this
+    process enqueues a job.
+    """
+
+    SWEEP_INTERVAL = 3600
+
+    def __init__(self, queue, workers=1, context=None, poll=1.0):
+        self.queue = queue
+        self.workers = workers
+        self.context = context
+        self.poll = poll
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def start(self):
+        """Start the threads once; later calls do nothing"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads or self.workers < 1:
+                return
+            self._stop.clear()
+            for number in range(self.workers):
+                name = f'{os.getpid()}-{number}'
+                thread = threading.Thread(target=self._loop, args=(name,), name=f'jobs-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _loop(self, worker):
+        while not self._stop.is_set():
+            try:
+                ran = self.queue.run_one(worker, self.context)
+            except sqlite3.Error:
+                logger.exception('Job queue unavailable')
+                ran = False
+            if ran:
+                continue
+            self._maybe_sweep()
+            if self.queue.enqueued.wait(self.poll):
+                self.queue.enqueued.clear()
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep >= self.SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.queue.sweep()
+
+    def drain(self):
+        """Run due jobs on the calling thread until none is left; returns how many"""
+        worker = f'{os.getpid()}-drain'
+        count = 0
+        while self.queue.run_one(worker, self.context):
+            count += 1
+        return count
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.queue.enqueued.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
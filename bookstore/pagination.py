@@ -0,0 +1,148 @@
+"""Keyset (seek) pagination for list pages.
+
+Pages are ordered newest first on ``(created_at, id)`` and addressed by an
+opaque cursor holding the sort key of the row to continue from, so fetching
+page 500 costs the same index seek as fetching page 1. Search results are
+paged the same way on their ``(score, id)`` rank instead.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self, serialize):
+        return {
+            'items': [serialize(item) for item in self.items],
+            'per_page': self.per_page,
+            'next': self.next_cursor,
+            'prev': self.prev_cursor,
+        }
+
+
+def encode_cursor(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(payload, dict):
+        raise InvalidCursor(token)
+    return payload
+
+
+def get_per_page(value, default=DEFAULT_PER_PAGE):
+    try:
+        per_page = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def paginate(query, model, cursor=None, per_page=DEFAULT_PER_PAGE):
+    """Return one page of ``query`` ordered by ``(created_at, id)`` descending.
+
+    ``cursor`` is a token previously returned as ``Page.next_cursor`` or
+    ``Page.prev_cursor``; an invalid token raises ``InvalidCursor``.
+    """
+    created_at, pk = model.created_at, model.id
+    key, backwards = None, False
+    if cursor:
+        payload = decode_cursor(cursor)
+        try:
+            key = (datetime.fromisoformat(payload['k'][0]), int(payload['k'][1]))
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        backwards = payload.get('d') == 'p'
+
+    if key is None:
+        query = query.order_by(created_at.desc(), pk.desc())
+    elif backwards:
+        query = query.filter(or_(created_at > key[0], and_(created_at == key[0], pk > key[1])))
+        query = query.order_by(created_at.asc(), pk.asc())
+    else:
+        query = query.filter(or_(created_at < key[0], and_(created_at == key[0], pk < key[1])))
+        query = query.order_by(created_at.desc(), pk.desc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def _key_of(item):
+        return [getattr(item, created_at.key).isoformat(), getattr(item, pk.key)]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        # Coming back from a later page there is always a next page
+        if has_more or backwards:
+            next_cursor = encode_cursor({'k': _key_of(rows[-1]), 'd': 'n'})
+        if (has_more if backwards else key is not None):
+            prev_cursor = encode_cursor({'k': _key_of(rows[0]), 'd': 'p'})
+    return Page(rows, per_page, next_cursor, prev_cursor)
+
+
+def paginate_ranked(fetch, cursor=None, per_page=DEFAULT_PER_PAGE):
+    """Page through ranked rows (search results) by their ``(score, id)`` key.
+
+    ``fetch(after, backwards, limit)`` returns up to ``limit`` rows of
+    ``(id, score)`` in rank order following the key ``after`` (None for the
+    first page), or preceding it, nearest first, when ``backwards``.
+
+    Returns the ids for the requested page and a ``Page`` whose items the
+    caller fills in once the rows are loaded.
+    """
+    key, backwards = None, False
+    if cursor:
+        payload = decode_cursor(cursor)
+        try:
+            key = (float(payload['k'][0]), int(payload['k'][1]))
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        backwards = payload.get('d') == 'p'
+
+    rows = fetch(key, backwards, per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def _key_of(row):
+        return [row[1], row[0]]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor({'k': _key_of(rows[-1]), 'd': 'n'})
+        if (has_more if backwards else key is not None):
+            prev_cursor = encode_cursor({'k': _key_of(rows[0]), 'd': 'p'})
+    return [row[0] for row in rows], Page([], per_page, next_cursor, prev_cursor)
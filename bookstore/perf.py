@@ -0,0 +1,250 @@
+"""Per-request SQL instrumentation and slow-query log.
+
+``PerfMonitor`` times every statement run through SQLAlchemy engines or
+mysql-connector cursors it has instrumented. For each request it keeps the
+query count, total DB time and slowest statements. In debug mode, with
+``SERVER_TIMING_PUBLIC``, or when the signed-in user is an admin
+(``session['is_admin']``), they are added to the response as a
+``Server-Timing`` header; other visitors do not get to see how the database
+is doing. Per-endpoint totals and the most recent slow queries stay in
+memory for an admin page.
+
+Endpoints in ``SERVER_TIMING_SKIP`` (static files, long-cached covers) never
+get the header, and their session is not read: reading it makes Flask add
+``Vary: Cookie``, which would split shared caches per visitor.
+
+Statements slower than ``SLOW_QUERY_MS`` are logged as one JSON object per
+line to the ``perf.slow_queries`` logger, and also to ``SLOW_QUERY_LOG``
+when that file is configured. String parameters are redacted unless
+``SLOW_QUERY_REDACT`` is False.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, request, session
+
+MAX_LOGGED_ROWS = 10
+
+
+def normalize_statement(statement):
+    return ' '.join(str(statement).split())
+
+
+def redact_value(value):
+    # Ids, prices and flags are useful when reading the log; text may be
+    # passwords, e-mail or addresses
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return f'<{type(value).__name__}>'
+
+
+def redact(params):
+    """Copy of ``params`` with every non-numeric value replaced by its type"""
+    if isinstance(params, dict):
+        return {key: redact(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact(value) for value in params[:MAX_LOGGED_ROWS]]
+    return redact_value(params)
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'db_time', 'slowest')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = []
+
+    def add(self, statement, duration, keep):
+        self.queries += 1
+        self.db_time += duration
+        if len(self.slowest) < keep or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[keep:]
+
+
+class PerfMonitor:
+    def __init__(self, app=None, keep_slowest=5, recent_slow=50):
+        self.keep_slowest = keep_slowest
+        self.threshold = 0.1
+        self.redact = True
+        self.public_timing = False
+        self.skip_timing = {'static'}
+        self.recent_slow = deque(maxlen=recent_slow)
+        self.slow_log = logging.getLogger('perf.slow_queries')
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.threshold = app.config.get('SLOW_QUERY_MS', 100) / 1000
+        self.redact = app.config.get('SLOW_QUERY_REDACT', True)
+        self.public_timing = app.config.get('SERVER_TIMING_PUBLIC', False)
+        self.skip_timing = {'static', *app.config.get('SERVER_TIMING_SKIP', ())}
+        path = app.config.get('SLOW_QUERY_LOG')
+        if path:
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.slow_log.addHandler(handler)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    # --- sources ---
+    def instrument_sqlalchemy(self, target):
+        """Time statements of an Engine (or of every engine: pass ``Engine``)"""
+        from sqlalchemy import event
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('perf_started', []).append(time.perf_counter())
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info['perf_started'].pop()
+            self.record(statement, parameters, time.perf_counter() - started)
+
+        def error(context):
+            if context.connection is not None and context.connection.info.get('perf_started'):
+                context.connection.info['perf_started'].pop()
+
+        event.listen(target, 'before_cursor_execute', before)
+        event.listen(target, 'after_cursor_execute', after)
+        event.listen(target, 'handle_error', error)
+
+    def instrument_connection(self, conn):
+        """Wrap a DB-API connection so its cursors are timed"""
+        return InstrumentedConnection(conn, self)
+
+    # --- recording ---
+    def record(self, statement, params, duration):
+        stats = g.get('perf') if has_request_context() else None
+        if stats is not None:
+            stats.add(statement, duration, self.keep_slowest)
+        if duration >= self.threshold:
+            self._log_slow(statement, params, duration)
+
+    def _log_slow(self, statement, params, duration):
+        entry = {
+            'time': datetime.utcnow().isoformat(timespec='milliseconds'),
+            'duration_ms': round(duration * 1000, 2),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'statement': normalize_statement(statement),
+            'params': redact(params) if self.redact else params,
+        }
+        self.recent_slow.append(entry)
+        self.slow_log.warning(json.dumps(entry, default=str))
+
+    def _start_request(self):
+        g.perf = RequestStats()
+        g.perf_visible = self._timing_visible()
+
+    def _timing_visible(self):
+        if self.public_timing or current_app.debug:
+            return True
+        if request.endpoint is None or request.endpoint in self.skip_timing:
+            return False
+        return bool(session.get('is_admin'))
+
+    def _finish_request(self, response):
+        stats = g.pop('perf', None)
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats.started
+        if g.pop('perf_visible', False):
+            response.headers.add('Server-Timing', f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"')
+            response.headers.add('Server-Timing', f'app;dur={total * 1000:.1f}')
+        self._aggregate(request.endpoint or 'unknown', total, stats)
+        return response
+
+    def _aggregate(self, endpoint, total, stats):
+        with self._lock:
+            row = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'db_time': 0.0, 'total_time': 0.0,
+                'max_time': 0.0, 'max_queries': 0, 'slowest': [],
+            })
+            row['requests'] += 1
+            row['queries'] += stats.queries
+            row['db_time'] += stats.db_time
+            row['total_time'] += total
+            row['max_time'] = max(row['max_time'], total)
+            row['max_queries'] = max(row['max_queries'], stats.queries)
+            slowest = row['slowest'] + stats.slowest
+            slowest.sort(key=lambda item: item[0], reverse=True)
+            row['slowest'] = slowest[:self.keep_slowest]
+
+    # --- reporting ---
+    def report(self):
+        """Per-endpoint averages, most DB time first"""
+        with self._lock:
+            rows = [dict(row, endpoint=endpoint) for endpoint, row in self._endpoints.items()]
+        for row in rows:
+            requests = row['requests']
+            row['avg_queries'] = row['queries'] / requests
+            row['avg_db_ms'] = row['db_time'] * 1000 / requests
+            row['avg_ms'] = row['total_time'] * 1000 / requests
+            row['max_ms'] = row['max_time'] * 1000
+            row['slowest'] = [
+                {'duration_ms': round(duration * 1000, 2), 'statement': normalize_statement(statement)}
+                for duration, statement in row['slowest']
+            ]
+            del row['db_time'], row['total_time'], row['max_time']
+        rows.sort(key=lambda row: row['avg_db_ms'] * row['requests'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+        self.recent_slow.clear()
+
+
+class InstrumentedCursor:
+    """DB-API cursor whose execute()/executemany() calls are timed"""
+
+    def __init__(self, cursor, monitor):
+        self._cursor = cursor
+        self._monitor = monitor
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._monitor.record(operation, params, time.perf_counter() - started)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._monitor.record(operation, seq_params, time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+
+class InstrumentedConnection:
+    """DB-API connection that hands out ``InstrumentedCursor`` objects"""
+
+    def __init__(self, conn, monitor):
+        self._conn = conn
+        self._monitor = monitor
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._monitor)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,135 @@
+"""Read replicas and read/write routing for the SQLAlchemy session.
+
+``RoutingSession`` sends a statement to the engine stored in
+``session.info['replica_bind']`` when the caller has picked one for the
+current unit of work. Flushes and INSERT/UPDATE/DELETE statements always go
+to the primary, as does everything when no replica was picked.
+
+``ReplicaSet`` owns the replica engines and hands them out round-robin.
+
+``SQLiteReplicator`` stands in for real replication when testing locally
+with SQLite files: it snapshots the primary, waits ``lag`` seconds and then
+copies the snapshot over every replica, so replicas trail the primary by
+roughly ``lag`` to ``2 * lag`` seconds.
+"""
+import itertools
+import os
+import sqlite3
+import tempfile
+import threading
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that can read from a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica_bind')
+        if (bind is None and replica is not None and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaSet:
+    """Engines for the configured replica URIs, created on first use"""
+
+    def __init__(self, uris=(), engine_options=None):
+        self.uris = list(uris)
+        self.engine_options = engine_options or {}
+        self._engines = None
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.uris)
+
+    @property
+    def engines(self):
+        if self._engines is None:
+            with self._lock:
+                if self._engines is None:
+                    engines = [create_engine(uri, **self.engine_options) for uri in self.uris]
+                    self._cycle = itertools.cycle(engines)
+                    self._engines = engines
+        return self._engines
+
+    def choose(self):
+        """Next replica engine, or None when there are none"""
+        if not self.engines:
+            return None
+        with self._lock:
+            return next(self._cycle)
+
+    def dispose(self):
+        for engine in self._engines or ():
+            engine.dispose()
+
+
+def sqlite_path(uri):
+    """File path of a ``sqlite:///`` URI, or None for anything else"""
+    prefix = 'sqlite:///'
+    if not uri.startswith(prefix) or uri == prefix or ':memory:' in uri:
+        return None
+    return uri[len(prefix):].split('?')[0]
+
+
+class SQLiteReplicator:
+    """Copy a SQLite primary onto replica files with a simulated lag"""
+
+    def __init__(self, primary, replicas, lag=2.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.lag = lag
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot(self, path):
+        # A file rather than :memory:, so the copy keeps the primary's journal
+        # mode in its header; readers of a WAL replica miss changes otherwise
+        source = sqlite3.connect(self.primary)
+        snapshot = sqlite3.connect(path, check_same_thread=False)
+        try:
+            source.backup(snapshot)
+        finally:
+            source.close()
+        return snapshot
+
+    def apply(self, snapshot):
+        for path in self.replicas:
+            # Waits for readers of the replica instead of failing while they finish
+            target = sqlite3.connect(path, timeout=30)
+            try:
+                snapshot.backup(target)
+            finally:
+                target.close()
+
+    def sync(self, lag=None):
+        """Copy the primary as it is now onto the replicas after ``lag`` seconds"""
+        with tempfile.TemporaryDirectory(prefix='replica-') as directory:
+            snapshot = self.snapshot(os.path.join(directory, 'snapshot.db'))
+            try:
+                if self._stop.wait(self.lag if lag is None else lag):
+                    return False
+                self.apply(snapshot)
+                return True
+            finally:
+                snapshot.close()
+
+    def run(self):
+        while not self._stop.is_set():
+            self.sync()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='sqlite-replicator', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
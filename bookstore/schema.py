@@ -0,0 +1,186 @@
+"""Versioned schema migrations and query-plan checks for the SQLite database.
+
+``create_all()`` only creates missing tables, so changes to existing tables
+(new columns, indexes, data fixes) are written as numbered migrations. Each
+one runs once, in order, in the caller's transaction, and is recorded in
+``schema_migrations``. Migrations must also be safe on a database that
+``create_all()`` just built from the current models.
+
+``plan_problems()`` reads ``EXPLAIN QUERY PLAN`` output and reports full
+table scans and temporary sorts, the signs of a missing index.
+"""
+import re
+from datetime import datetime
+
+MIGRATIONS = []
+
+# Small, bounded tables that are fine to scan
+SCAN_ALLOWED = {'category', 'site_stats', 'schema_migrations'}
+
+_SCAN_RE = re.compile(r'\bSCAN (\w+)')
+
+
+def migration(version, name):
+    """Register a migration function taking an SQLAlchemy connection"""
+    def decorator(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return fn
+    return decorator
+
+
+def _ensure_table(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)'
+    )
+
+
+def applied_versions(conn):
+    _ensure_table(conn)
+    return {row[0] for row in conn.exec_driver_sql('SELECT version FROM schema_migrations')}
+
+
+def pending(conn):
+    done = applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+def migrate(conn):
+    """Apply pending migrations; returns the (version, name) pairs applied.
+
+    The caller commits (or rolls back) the surrounding transaction.
+    """
+    done = applied_versions(conn)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done:
+            continue
+        fn(conn)
+        conn.exec_driver_sql(
+            'INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+            (version, name, datetime.utcnow().isoformat(timespec='seconds'))
+        )
+        applied.append((version, name))
+    return applied
+
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.exec_driver_sql(f'PRAGMA table_info("{table}")'))
+
+
+def has_unique_index(conn, table):
+    return any(row[2] for row in conn.exec_driver_sql(f'PRAGMA index_list("{table}")'))
+
+
+# ===== QUERY PLANS =====
+def explain(conn, statement, params=()):
+    """``EXPLAIN QUERY PLAN`` detail lines for one statement"""
+    return [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params)]
+
+
+def plan_problems(plan, allowed=SCAN_ALLOWED):
+    """Lines of a query plan that point at a missing index"""
+    problems = []
+    # Full-text matches are ordered by rank, which no index can provide
+    ranked = any('VIRTUAL TABLE' in line for line in plan)
+    for line in plan:
+        if 'VIRTUAL TABLE' in line or 'COVERING INDEX' in line or 'USING INDEX' in line:
+            continue
+        match = _SCAN_RE.search(line)
+        if match and match.group(1) not in allowed:
+            problems.append(line)
+        elif 'USE TEMP B-TREE FOR ORDER BY' in line and not ranked:
+            problems.append(line)
+    return problems
+
+
+# ===== MIGRATIONS =====
+@migration(1, 'unique likes and like counters')
+def _like_counters(conn):
+    like_tables = [
+        ('discussion', 'discussion_like', 'discussion_id', 'uq_discussion_like_user_discussion'),
+        ('discussion_comment', 'comment_like', 'comment_id', 'uq_comment_like_user_comment'),
+    ]
+    for target, likes, fk, index_name in like_tables:
+        if not has_unique_index(conn, likes):
+            # Drop duplicate likes left by earlier racing requests
+            conn.exec_driver_sql(
+                f'DELETE FROM {likes} WHERE id NOT IN '
+                f'(SELECT MIN(id) FROM {likes} GROUP BY user_id, {fk})'
+            )
+            conn.exec_driver_sql(f'CREATE UNIQUE INDEX {index_name} ON {likes} (user_id, {fk})')
+
+        if not column_exists(conn, target, 'like_count'):
+            conn.exec_driver_sql(f'ALTER TABLE {target} ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0')
+            conn.exec_driver_sql(
+                f'UPDATE {target} SET like_count = '
+                f'(SELECT COUNT(*) FROM {likes} WHERE {likes}.{fk} = {target}.id)'
+            )
+
+
+# Matched to the filters and the (created_at, id) keyset ordering used by
+# the list pages. Fresh databases get them from this migration too.
+INDEXES = [
+    ('ix_user_created', 'user', ('created_at', 'id')),
+    ('ix_book_created', 'book', ('created_at', 'id')),
+    ('ix_book_user_created', 'book', ('user_id', 'created_at', 'id')),
+    ('ix_book_category_created', 'book', ('category_id', 'created_at', 'id')),
+    ('ix_cart_item_cart_book', 'cart_item', ('cart_id', 'book_id')),
+    ('ix_cart_item_book', 'cart_item', ('book_id',)),
+    ('ix_order_created', 'order', ('created_at', 'id')),
+    ('ix_order_user_created', 'order', ('user_id', 'created_at', 'id')),
+    ('ix_order_item_order', 'order_item', ('order_id',)),
+    ('ix_order_item_book', 'order_item', ('book_id',)),
+    ('ix_wishlist_user_book', 'wishlist', ('user_id', 'book_id')),
+    ('ix_wishlist_book', 'wishlist', ('book_id',)),
+    ('ix_discussion_created', 'discussion', ('created_at', 'id')),
+    ('ix_discussion_public_created', 'discussion', ('is_public', 'created_at', 'id')),
+    ('ix_discussion_user_created', 'discussion', ('user_id', 'created_at')),
+    ('ix_discussion_comment_discussion_created', 'discussion_comment', ('discussion_id', 'created_at')),
+    ('ix_discussion_like_discussion', 'discussion_like', ('discussion_id',)),
+    ('ix_comment_like_comment', 'comment_like', ('comment_id',)),
+]
+
+
+@migration(2, 'indexes for foreign keys and list ordering')
+def _indexes(conn):
+    for name, table, columns in INDEXES:
+        column_list = ', '.join(columns)
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({column_list})')
+    conn.exec_driver_sql('ANALYZE')
+
+
+@migration(3, 'cart totals and one line per book')
+def _cart_totals(conn):
+    if not has_unique_index(conn, 'cart_item'):
+        # Fold duplicate lines of the same book into the oldest one
+        conn.exec_driver_sql(
+            'UPDATE cart_item SET quantity = ('
+            'SELECT SUM(other.quantity) FROM cart_item AS other '
+            'WHERE other.cart_id = cart_item.cart_id AND other.book_id = cart_item.book_id) '
+            'WHERE id IN (SELECT MIN(id) FROM cart_item GROUP BY cart_id, book_id HAVING COUNT(*) > 1)'
+        )
+        conn.exec_driver_sql(
+            'DELETE FROM cart_item WHERE id NOT IN (SELECT MIN(id) FROM cart_item GROUP BY cart_id, book_id)'
+        )
+        conn.exec_driver_sql('CREATE UNIQUE INDEX uq_cart_item_cart_book ON cart_item (cart_id, book_id)')
+    # The unique index serves the same lookups
+    conn.exec_driver_sql('DROP INDEX IF EXISTS ix_cart_item_cart_book')
+
+    if not column_exists(conn, 'cart', 'item_count'):
+        conn.exec_driver_sql('ALTER TABLE cart ADD COLUMN item_count INTEGER NOT NULL DEFAULT 0')
+        conn.exec_driver_sql('ALTER TABLE cart ADD COLUMN subtotal FLOAT NOT NULL DEFAULT 0')
+        conn.exec_driver_sql(
+            'UPDATE cart SET '
+            'item_count = (SELECT COUNT(*) FROM cart_item WHERE cart_item.cart_id = cart.id), '
+            'subtotal = (SELECT COALESCE(SUM(cart_item.quantity * book.price), 0) '
+            'FROM cart_item JOIN book ON book.id = cart_item.book_id WHERE cart_item.cart_id = cart.id)'
+        )
+
+
+@migration(4, 'index books by cover file')
+def _cover_index(conn):
+    # Lets the cover release job find remaining references while it holds
+    # the write lock
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_book_image ON book (image)')
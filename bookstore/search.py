@@ -0,0 +1,161 @@
+"""Full-text search for the book catalog, backed by an SQLite FTS5 index.
+
+The index is an external-content FTS5 table over ``book`` that is kept in
+sync by triggers, so every insert, update and delete (including the admin
+routes and bulk operations) updates it inside the same transaction.
+"""
+import re
+
+from sqlalchemy import text
+
+FTS_TABLE = 'book_fts'
+
+# Column weights for bm25(): title, author, description
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Common Indonesian function words that only add noise to a catalog search
+STOPWORDS = {
+    'dan', 'yang', 'di', 'ke', 'dari', 'untuk', 'dengan', 'pada', 'dalam',
+    'atau', 'ini', 'itu', 'oleh', 'sebuah', 'para', 'si', 'sang', 'the', 'of',
+}
+
+# Particles and possessive clitics that attach to Indonesian words
+# ("bukunya", "bacalah", "siapakah"). Stripping them and prefix-matching the
+# rest lets "bukunya" find "buku" and vice versa.
+SUFFIXES = ('nya', 'lah', 'kah', 'tah', 'pun', 'ku', 'mu')
+
+MIN_STEM_LENGTH = 3
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author, description,
+        content='book', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON book BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON book BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, author, description ON book BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+]
+
+_index_ready = False
+
+
+def ensure_search_index(connection):
+    """Create the FTS table and its triggers, indexing existing books once.
+
+    Returns False when the SQLite build has no FTS5 support, in which case
+    callers should fall back to plain ``LIKE`` filtering.
+    """
+    global _index_ready
+    existed = _table_exists(connection)
+    try:
+        for statement in _SCHEMA:
+            connection.execute(text(statement))
+    except Exception:
+        return False
+    if not existed:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    _index_ready = True
+    return True
+
+
+def has_search_index(connection):
+    """Check (once per process) whether the FTS table is present."""
+    global _index_ready
+    if not _index_ready:
+        _index_ready = _table_exists(connection)
+    return _index_ready
+
+
+def normalize_term(token):
+    """Lowercase a token and strip a trailing Indonesian particle/clitic."""
+    token = token.lower()
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def build_match_query(search):
+    """Turn free text into an FTS5 MATCH expression of prefix terms.
+
+    Every remaining term must match (implicit AND). Returns None when the
+    input has no searchable terms.
+    """
+    tokens = _TOKEN_RE.findall(search or '')
+    terms = []
+    for token in tokens:
+        if token.lower() in STOPWORDS and len(tokens) > 1:
+            continue
+        term = normalize_term(token)
+        if term and term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def search_book_ids(connection, search, category_id=None, after=None, backwards=False, limit=20):
+    """Return ``(id, score)`` of books matching ``search``, best match first.
+
+    Results are ordered by ``(score, id)``; a lower bm25 score is a better
+    match. ``after`` is the ``(score, id)`` of a row to continue from, so
+    every page of a search is one bounded query. With ``backwards`` the
+    rows ranked before ``after`` are returned instead, nearest first.
+    """
+    match = build_match_query(search)
+    if match is None:
+        return []
+
+    # bm25() is only allowed next to the MATCH, so the keyset filter is
+    # applied to the scored rows of a subquery
+    sql = f"""
+        SELECT id, score FROM (
+            SELECT {FTS_TABLE}.rowid AS id, bm25({FTS_TABLE}, {{}}, {{}}, {{}}) AS score
+            FROM {FTS_TABLE}
+            JOIN book ON book.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH :match
+    """.format(*RANK_WEIGHTS)
+    params = {'match': match, 'limit': limit}
+    if category_id:
+        sql += " AND book.category_id = :category_id"
+        params['category_id'] = category_id
+    sql += ")"
+    if after is not None:
+        op = '<' if backwards else '>'
+        sql += f" WHERE score {op} :score OR (score = :score AND id {op} :id)"
+        params['score'], params['id'] = after
+    order = 'DESC' if backwards else 'ASC'
+    sql += f" ORDER BY score {order}, id {order} LIMIT :limit"
+
+    return [tuple(row) for row in connection.execute(text(sql), params)]
+
+
+def _table_exists(connection):
+    row = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first()
+    return row is not None
@@ -0,0 +1,325 @@
+"""Server-side sessions for Flask.
+
+The cookie only carries a signed, random session id; the session data
+lives in a store. ``SQLiteSessionStore`` keeps it in a local SQLite file
+behind an in-process LRU, so most requests read their session without
+touching the file. ``MemorySessionStore`` is a single-process stand-in.
+
+Sessions are written only when they change (or when half their lifetime
+has passed), so unchanged requests send no ``Set-Cookie``. Each row
+records the user it belongs to. ``revoke_user()`` logs that user out
+everywhere and ``update_user()`` patches all of their sessions, e.g. after
+an admin flag changes. Every row carries a version: a request that loaded
+a session before it was revoked or patched cannot write its old copy back.
+
+A new session id is issued whenever the logged-in user changes, so an id
+set before login is never reused after it.
+"""
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer, want_bytes
+
+try:
+    from .cache import MemoryCache
+    from . import sqlite_tuning
+except ImportError:
+    from cache import MemoryCache
+    import sqlite_tuning
+
+serializer = TaggedJSONSerializer()
+
+
+class Record:
+    # Stores keep ``data`` serialized; ``load()`` returns it as a dict
+    __slots__ = ('data', 'user', 'expires', 'version')
+
+    def __init__(self, data, user, expires, version):
+        self.data = data
+        self.user = user
+        self.expires = expires
+        self.version = version
+
+
+class MemorySessionStore:
+    """Sessions in a dict; for tests and single-process servers"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            record = self._records.get(sid)
+        if record is None or record.expires < time.time():
+            return None
+        return Record(serializer.loads(record.data), record.user, record.expires, record.version)
+
+    def save(self, sid, data, user, expires, version=None):
+        with self._lock:
+            current = self._records.get(sid)
+            if version is not None and (current is None or current.version != version):
+                return None
+            new_version = current.version + 1 if current else 1
+            self._records[sid] = Record(serializer.dumps(dict(data)), user, expires, new_version)
+            return new_version
+
+    def delete(self, sid):
+        with self._lock:
+            self._records.pop(sid, None)
+
+    def revoke_user(self, user):
+        with self._lock:
+            sids = [sid for sid, record in self._records.items() if record.user == str(user)]
+            for sid in sids:
+                del self._records[sid]
+        return len(sids)
+
+    def update_user(self, user, changes):
+        with self._lock:
+            records = [record for record in self._records.values() if record.user == str(user)]
+            for record in records:
+                data = serializer.loads(record.data)
+                data.update(changes)
+                record.data = serializer.dumps(data)
+                record.version += 1
+        return len(records)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, record in self._records.items() if record.expires < now]
+            for sid in expired:
+                del self._records[sid]
+        return len(expired)
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file with an in-process LRU in front.
+
+    All access goes through one connection per process. SQLite's
+    ``data_version`` only changes when another connection commits, so the
+    LRU is dropped exactly when another worker changed a session.
+    """
+
+    SWEEP_EVERY = 256
+
+    def __init__(self, path, max_entries=4096):
+        self.path = path
+        self.front = MemoryCache(max_entries)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        sqlite_tuning.apply_pragmas(self._conn, sqlite_tuning.pragmas_for('production'))
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS session ('
+            'sid TEXT PRIMARY KEY, user TEXT, data TEXT NOT NULL, '
+            'expires REAL NOT NULL, version INTEGER NOT NULL) WITHOUT ROWID'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_session_user ON session (user)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)')
+        self._data_version = self._current_data_version()
+        self._writes = 0
+
+    def _current_data_version(self):
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _sync_front(self):
+        version = self._current_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self.front.clear()
+
+    def _remember(self, sid, record):
+        ttl = record.expires - time.time()
+        if ttl > 0:
+            self.front.set(sid, record, ttl)
+
+    def load(self, sid):
+        with self._lock:
+            self._sync_front()
+            record = self.front.get(sid)
+            if record is None:
+                row = self._conn.execute(
+                    'SELECT data, user, expires, version FROM session WHERE sid = ? AND expires >= ?',
+                    (sid, time.time())
+                ).fetchone()
+                if row is None:
+                    return None
+                record = Record(*row)
+                self._remember(sid, record)
+        # Parsed per request: views mutate nested values such as the flash list
+        return Record(serializer.loads(record.data), record.user, record.expires, record.version)
+
+    def save(self, sid, data, user, expires, version=None):
+        """Write a session; returns its new version.
+
+        With ``version`` the write only happens if the stored row still has
+        that version, otherwise None is returned and nothing is written.
+        """
+        payload = serializer.dumps(dict(data))
+        with self._lock:
+            self._sync_front()
+            if version is None:
+                new_version = 1
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO session (sid, user, data, expires, version) VALUES (?, ?, ?, ?, 1)',
+                    (sid, user, payload, expires)
+                )
+            else:
+                new_version = version + 1
+                updated = self._conn.execute(
+                    'UPDATE session SET user = ?, data = ?, expires = ?, version = ? '
+                    'WHERE sid = ? AND version = ?',
+                    (user, payload, expires, new_version, sid, version)
+                ).rowcount
+                if not updated:
+                    self.front.delete(sid)
+                    return None
+            self._remember(sid, Record(payload, user, expires, new_version))
+            self._writes += 1
+            if self._writes % self.SWEEP_EVERY == 0:
+                self._sweep()
+        return new_version
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute('DELETE FROM session WHERE sid = ?', (sid,))
+            self.front.delete(sid)
+
+    def revoke_user(self, user):
+        """Delete every session of ``user``; returns how many there were"""
+        with self._lock:
+            sids = [row[0] for row in self._conn.execute(
+                'DELETE FROM session WHERE user = ? RETURNING sid', (str(user),))]
+            for sid in sids:
+                self.front.delete(sid)
+        return len(sids)
+
+    def update_user(self, user, changes):
+        """Apply ``changes`` to the data of every session of ``user``"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(
+                    'SELECT sid, data FROM session WHERE user = ?', (str(user),)).fetchall()
+                for sid, payload in rows:
+                    data = serializer.loads(payload)
+                    data.update(changes)
+                    self._conn.execute(
+                        'UPDATE session SET data = ?, version = version + 1 WHERE sid = ?',
+                        (serializer.dumps(data), sid)
+                    )
+                    self.front.delete(sid)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return len(rows)
+
+    def _sweep(self):
+        return self._conn.execute('DELETE FROM session WHERE expires < ?', (time.time(),)).rowcount
+
+    def sweep(self):
+        """Delete expired sessions; returns how many"""
+        with self._lock:
+            return self._sweep()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM session').fetchone()[0]
+
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, record=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.record = record
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps only a signed session id in the cookie.
+
+    ``user_key`` names the session key that identifies the logged-in user.
+    """
+
+    salt = 'server-session'
+
+    def __init__(self, store, user_key='user_id'):
+        self.store = store
+        self.user_key = user_key
+
+    def _signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt, key_derivation='hmac')
+
+    def open_session(self, app, request):
+        signer = self._signer(app)
+        if signer is None:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return ServerSession()
+        try:
+            sid = signer.unsign(cookie).decode()
+        except BadSignature:
+            return ServerSession()
+        record = self.store.load(sid)
+        if record is None:
+            return ServerSession()
+        return ServerSession(record.data, sid=sid, record=record)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        record = session.record
+        user = session.get(self.user_key)
+        user = None if user is None else str(user)
+        rotate = record is not None and user != record.user
+        refresh = record is not None and record.expires - now < lifetime / 2
+        if record is not None and not (session.modified or rotate or refresh):
+            return
+
+        expires = now + lifetime
+        if record is None or rotate:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            self.store.save(session.sid, session, user, expires)
+        elif self.store.save(session.sid, session, user, expires, record.version) is None:
+            # Revoked or patched while this request ran; keep the stored copy
+            return
+        elif not refresh:
+            return
+
+        cookie_expires = datetime.fromtimestamp(expires, timezone.utc) if session.permanent else None
+        response.set_cookie(
+            name,
+            self._signer(app).sign(want_bytes(session.sid)).decode(),
+            expires=cookie_expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
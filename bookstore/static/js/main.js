@@ -2,7 +2,40 @@
 class CartManager {
     constructor() {
         this.cartCount = document.getElementById('cart-count');
-        this.updateCartCount();
+        // Only logged-in pages have the badge
+        if (this.cartCount) {
+            this.listen();
+        }
+    }
+
+    // The server pushes the cart count and order status changes, so open
+    // pages do not have to poll
+    listen() {
+        if (!window.EventSource) {
+            this.updateCartCount();
+            return;
+        }
+        this.events = new EventSource('/api/events');
+        this.events.addEventListener('cart', (event) => {
+            this.setCartCount(JSON.parse(event.data).count);
+        });
+        this.events.addEventListener('order', (event) => {
+            const order = JSON.parse(event.data);
+            this.showNotification(`Status pesanan #${order.id}: ${order.status}`, 'info');
+        });
+        this.events.addEventListener('resync', () => this.updateCartCount());
+        this.events.onerror = () => {
+            // Closed for good (e.g. too many connections): read the count once
+            if (this.events.readyState === EventSource.CLOSED) {
+                this.updateCartCount();
+            }
+        };
+    }
+
+    setCartCount(count) {
+        if (this.cartCount && count !== undefined) {
+            this.cartCount.textContent = count;
+        }
     }
 
     async updateCartCount() {
@@ -12,9 +45,7 @@ class CartManager {
                 throw new Error('Network response was not ok');
             }
             const data = await response.json();
-            if (this.cartCount && data.count !== undefined) {
-                this.cartCount.textContent = data.count;
-            }
+            this.setCartCount(data.count);
         } catch (error) {
             console.error('Error updating cart count:', error);
             if (this.cartCount) {
@@ -43,7 +74,7 @@ class CartManager {
             const data = await response.json();
             
             if (data.success) {
-                this.updateCartCount();
+                this.setCartCount(data.cart_count);
                 this.showNotification('Buku berhasil ditambahkan ke keranjang!', 'success');
             } else {
                 this.showNotification(data.message || 'Gagal menambahkan ke keranjang', 'error');
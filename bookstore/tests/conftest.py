@@ -0,0 +1,62 @@
+"""Test setup: the app is imported once against a throwaway SQLite file.
+
+    python -m pytest bookstore/tests
+
+Run from the repository root (the app resolves its upload folder from
+there). Every test gets a freshly created database.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+TEST_DIR = tempfile.mkdtemp(prefix='tokobuku-test-')
+DB_PATH = os.path.join(TEST_DIR, 'test.db')
+
+# Must be set before the app is imported
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ['SESSION_STORE'] = 'memory'
+os.environ['JOB_DB'] = os.path.join(TEST_DIR, 'jobs.db')
+os.environ['JOB_WORKERS'] = '0'
+os.environ.pop('PAGE_CACHE_DIR', None)
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as bookstore_app  # noqa: E402
+
+bookstore_app.app.config['TESTING'] = True
+bookstore_app.app.config['LAZY_LOAD_GUARD'] = 'raise'
+bookstore_app.app.config['UPLOAD_FOLDER'] = os.path.join(TEST_DIR, 'uploads')
+
+
+@pytest.fixture
+def bookstore():
+    """The app module, on an empty database with the default categories"""
+    with bookstore_app.app.app_context():
+        bookstore_app.db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(DB_PATH + suffix)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(bookstore_app.app.config['UPLOAD_FOLDER'], ignore_errors=True)
+        bookstore_app.page_cache.clear()
+        bookstore_app.initialize_database()
+        yield bookstore_app
+        bookstore_app.db.session.remove()
+
+
+def make_user(bookstore, username, is_admin=False):
+    user = bookstore.User(username=username, email=f'{username}@test.local', password='-', is_admin=is_admin)
+    bookstore.db.session.add(user)
+    bookstore.db.session.commit()
+    return user
+
+
+def login(client, user):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['is_admin'] = user.is_admin
@@ -0,0 +1,48 @@
+"""Only whole content-addressed names count as blobs"""
+import io
+import os
+
+import blobstore
+import images
+
+DIGEST = 'ab' + 'c' * 62
+BLOB = f'ab/{DIGEST}.jpg'
+
+
+def test_is_blob_matches_whole_names_only():
+    assert blobstore.is_blob(BLOB)
+    for name in (f'../{BLOB}', f'lama/{BLOB}', f'{BLOB}.bak', f'{BLOB}/x', images.manifest_filename(BLOB),
+                 'sampul.jpg', '', None):
+        assert not blobstore.is_blob(name), name
+
+
+def test_variant_source():
+    assert images.variant_source(images.variant_filename(BLOB, 400, 'webp')) == BLOB
+    assert images.variant_source(images.manifest_filename(BLOB)) == BLOB
+    assert images.variant_source(BLOB) is None
+
+
+def test_catalog_cannot_attach_files_outside_the_store(bookstore):
+    folder = bookstore.app.config['UPLOAD_FOLDER']
+    name, _ = blobstore.store(folder, io.BytesIO(b'cover'), 'jpg')
+    attached, sources = {}, {}
+    report = bookstore.catalog_io.ImportReport()
+
+    assert bookstore.import_cover(None, f'{name[:2]}/../{name}', attached, sources, report) is None
+    assert bookstore.import_cover(None, name, attached, sources, report) == name
+    assert (report.covers, report.missing_covers) == (1, 1)
+
+
+def test_cover_variants_are_cached_as_immutable(bookstore):
+    folder = bookstore.app.config['UPLOAD_FOLDER']
+    name, _ = blobstore.store(folder, io.BytesIO(b'cover'), 'jpg')
+    manifest = images.manifest_filename(name)
+    # Normally written by the variants job
+    path = os.path.join(folder, manifest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('{}')
+
+    response = bookstore.app.test_client().get(f'/covers/{manifest}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
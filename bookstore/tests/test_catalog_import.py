@@ -0,0 +1,71 @@
+"""Catalog imports store covers without holding the database write lock"""
+import io
+import os
+import sqlite3
+import zipfile
+
+from conftest import DB_PATH, make_user
+
+
+def covers_zip(count):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for i in range(count):
+            archive.writestr(f'cover{i}.png', b'\x89PNG\r\n\x1a\n' + bytes([i]) * 64)
+    buffer.seek(0)
+    return buffer
+
+
+def stored_files(folder):
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+
+
+def catalog_lines(count, during=None):
+    yield 'title,author,price,stock,category,image\n'
+    for i in range(count):
+        if i == count - 1 and during is not None:
+            during()
+        yield f'Buku {i},Penulis,1000,1,Fiksi,cover{i}.png\n'
+
+
+def test_other_writers_are_not_blocked_while_covers_are_read(bookstore):
+    seller = make_user(bookstore, 'penjual')
+    writes = []
+
+    def write_from_another_connection():
+        # No busy wait: fails at once if the import holds the write lock
+        conn = sqlite3.connect(DB_PATH, timeout=0)
+        try:
+            conn.execute("UPDATE category SET name = name")
+            conn.commit()
+            writes.append('ok')
+        finally:
+            conn.close()
+
+    with bookstore.catalog_io.CoverArchive(covers_zip(5)) as archive:
+        report = bookstore.import_catalog(catalog_lines(5, write_from_another_connection), 'csv',
+                                          seller.id, archive=archive, batch_size=10)
+
+    assert writes == ['ok']
+    assert (report.imported, report.covers, report.failed) == (5, 5, 0)
+
+
+def test_cover_deleted_before_the_batch_commits_is_stored_again(bookstore):
+    seller = make_user(bookstore, 'penjual')
+    folder = bookstore.app.config['UPLOAD_FOLDER']
+    stored = {}
+
+    def release_first_cover():
+        # What the release job does to a reused file before the batch is locked
+        name = stored['name'] = next(stored_files(folder))
+        bookstore.blobstore.remove(folder, name)
+
+    with bookstore.catalog_io.CoverArchive(covers_zip(3)) as archive:
+        report = bookstore.import_catalog(catalog_lines(3, release_first_cover), 'csv',
+                                          seller.id, archive=archive, batch_size=10)
+
+    assert report.imported == 3 and report.covers == 3
+    book = bookstore.Book.query.filter_by(image=stored['name']).one()
+    assert os.path.exists(os.path.join(folder, book.image))
@@ -0,0 +1,65 @@
+"""Many buyers checking out the last copies of one book at the same time"""
+import threading
+
+from conftest import login, make_user
+
+STOCK = 5
+BUYERS = 16
+
+
+def test_parallel_checkouts_never_oversell(bookstore):
+    db = bookstore.db
+    seller = make_user(bookstore, 'penjual')
+    book = bookstore.Book(title='Buku Langka', author='Penulis', price=50000, stock=STOCK,
+                          user_id=seller.id, category_id=1)
+    db.session.add(book)
+    db.session.commit()
+    buyers = [make_user(bookstore, f'pembeli{i}') for i in range(BUYERS)]
+    for buyer in buyers:
+        bookstore.add_cart_line(buyer.id, book, 1)
+    carts_before = {
+        buyer.id: db.session.execute(
+            db.select(bookstore.Cart.id, bookstore.Cart.item_count, bookstore.Cart.subtotal)
+            .where(bookstore.Cart.user_id == buyer.id)
+        ).one()
+        for buyer in buyers
+    }
+
+    gate = threading.Barrier(BUYERS)
+    errors = []
+
+    def checkout(buyer):
+        client = bookstore.app.test_client()
+        login(client, buyer)
+        gate.wait()
+        try:
+            response = client.post('/process_checkout', data={
+                'shipping_address': 'Jl. Uji No. 1', 'payment_method': 'transfer'})
+            assert response.status_code == 302
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=checkout, args=(buyer,)) for buyer in buyers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    db.session.expire_all()
+    assert db.session.get(bookstore.Book, book.id).stock == 0
+    orders = bookstore.Order.query.all()
+    assert len(orders) == STOCK
+    assert sum(item.quantity for item in bookstore.OrderItem.query.filter_by(book_id=book.id)) == STOCK
+
+    winners = {order.user_id for order in orders}
+    for buyer in buyers:
+        cart_id, item_count, subtotal = carts_before[buyer.id]
+        cart = db.session.get(bookstore.Cart, cart_id)
+        lines = bookstore.CartItem.query.filter_by(cart_id=cart_id).all()
+        if buyer.id in winners:
+            assert lines == [] and cart.item_count == 0 and cart.subtotal == 0
+        else:
+            # The losing checkout was rolled back: the cart is exactly as before
+            assert [(line.book_id, line.quantity) for line in lines] == [(book.id, 1)]
+            assert (cart.item_count, cart.subtotal) == (item_count, subtotal)
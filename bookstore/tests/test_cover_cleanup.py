@@ -0,0 +1,42 @@
+"""A cover stored for a book that never commits leaves nothing behind"""
+import io
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import FileStorage
+
+from conftest import make_user
+
+
+def queued(bookstore, name, payload):
+    return bookstore.jobs._conn.execute(
+        'SELECT COUNT(*) FROM job WHERE name = ? AND payload LIKE ?', (name, f'%{payload}%')).fetchone()[0]
+
+
+def upload(content):
+    return FileStorage(io.BytesIO(b'\x89PNG\r\n\x1a\n' + content), filename='cover.png')
+
+
+def test_failed_commit_releases_cover_and_queues_no_variants(bookstore):
+    name = bookstore.save_cover(upload(b'gagal' * 20))
+    # No seller: the insert fails on commit
+    bookstore.db.session.add(bookstore.Book(title='Buku', author='Penulis', price=1, stock=1, image=name,
+                                            category_id=1))
+    with pytest.raises(IntegrityError):
+        bookstore.db.session.commit()
+    bookstore.db.session.remove()
+
+    assert queued(bookstore, 'cover-variants', name) == 0
+    assert queued(bookstore, 'release-cover', name) == 1
+
+
+def test_committed_cover_gets_its_variants(bookstore):
+    seller = make_user(bookstore, 'penjual')
+    name = bookstore.save_cover(upload(b'berhasil' * 20))
+    assert queued(bookstore, 'cover-variants', name) == 0
+    bookstore.db.session.add(bookstore.Book(title='Buku', author='Penulis', price=1, stock=1, image=name,
+                                            user_id=seller.id, category_id=1))
+    bookstore.db.session.commit()
+
+    assert queued(bookstore, 'cover-variants', name) == int(bookstore.covers.enabled)
+    assert queued(bookstore, 'release-cover', name) == 0
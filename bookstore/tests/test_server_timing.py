@@ -0,0 +1,27 @@
+"""Server-Timing reveals database timings, so only admins (or debug mode) get it"""
+import io
+
+from conftest import login, make_user
+
+
+def test_server_timing_only_for_admins(bookstore):
+    client = bookstore.app.test_client()
+    assert 'Server-Timing' not in client.get('/books').headers
+
+    login(client, make_user(bookstore, 'pembeli'))
+    assert 'Server-Timing' not in client.get('/books').headers
+
+    login(client, make_user(bookstore, 'admin', is_admin=True))
+    assert 'db;dur=' in client.get('/books').headers['Server-Timing']
+
+
+def test_cover_responses_do_not_vary_on_cookie(bookstore):
+    name, _ = bookstore.blobstore.store(bookstore.app.config['UPLOAD_FOLDER'], io.BytesIO(b'cover'), 'jpg')
+    client = bookstore.app.test_client()
+    login(client, make_user(bookstore, 'admin', is_admin=True))
+
+    response = client.get(f'/covers/{name}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Vary' not in response.headers
+    assert 'Server-Timing' not in response.headers
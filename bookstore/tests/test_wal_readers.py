@@ -0,0 +1,58 @@
+"""Readers keep going while a long write transaction is open (WAL profile)"""
+import threading
+
+from conftest import make_user
+
+BOOKS = 200
+READERS = 8
+READS = 10
+
+
+def test_readers_finish_during_a_long_write(bookstore):
+    db = bookstore.db
+    seller = make_user(bookstore, 'penjual')
+    book = {'author': 'Penulis', 'price': 1000, 'stock': 1, 'user_id': seller.id, 'category_id': 1}
+    db.session.execute(db.insert(bookstore.Book), [{'title': f'Buku {i}', **book} for i in range(BOOKS)])
+    db.session.commit()
+
+    writer = db.engine.raw_connection()
+    try:
+        cursor = writer.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        # A small page cache makes the writer spill to the database file,
+        # like a bulk import does; without WAL that locks out every reader
+        cursor.execute('PRAGMA cache_size = 50')
+        cursor.executemany(
+            'INSERT INTO book (title, author, description, price, stock, user_id, category_id) '
+            'VALUES (?, ?, ?, 1000, 1, ?, 1)',
+            ((f'Impor {i}', 'Penulis', 'x' * 500, seller.id) for i in range(5000)))
+
+        errors, counts, pages = [], [], []
+
+        def read():
+            client = bookstore.app.test_client()
+            try:
+                with bookstore.app.app_context():
+                    for _ in range(READS):
+                        counts.append(db.session.execute(db.text('SELECT COUNT(*) FROM book')).scalar())
+                        db.session.commit()
+                        pages.append(client.get('/books?format=json').status_code)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=read) for _ in range(READERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors, errors[0]
+        # Readers see the last committed snapshot, not the open write
+        assert counts == [BOOKS] * READERS * READS
+        assert pages == [200] * READERS * READS
+        writer.commit()
+    finally:
+        # Discard the connection rather than pool it with its tiny cache
+        writer.invalidate()
+
+    assert db.session.execute(db.text('SELECT COUNT(*) FROM book')).scalar() == BOOKS + 5000
@@ -0,0 +1,135 @@
+"""Streaming, size-bounded file uploads.
+
+``UploadRequest`` makes Werkzeug's multipart parser write each uploaded
+file straight to a temp file in the upload folder, hashing it on the way
+and aborting with 413 as soon as one file passes ``MAX_UPLOAD_FILE_SIZE``
+(the whole request is bounded by Flask's ``MAX_CONTENT_LENGTH``). Nothing
+is buffered in memory beyond the parser's chunk size.
+
+``save_upload()`` then checks the real file type from its magic bytes and
+moves the temp file into the content-addressed store with one rename.
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    from . import blobstore
+except ImportError:
+    import blobstore
+
+IMAGE_TYPES = {'jpg', 'png', 'webp', 'gif'}
+
+SNIFF_BYTES = 16
+
+
+class UploadError(ValueError):
+    """The uploaded file is not of an accepted type"""
+
+
+def sniff_image(head):
+    """Detect the image type from the first bytes of a file"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    return None
+
+
+class UploadTempFile:
+    """Write-through temp file that hashes and size-checks every chunk"""
+
+    def __init__(self, directory, max_bytes=None):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge()
+        if len(self.head) < SNIFF_BYTES:
+            self.head += bytes(data[:SNIFF_BYTES - len(self.head)])
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def close(self):
+        """Close and delete the temp file unless it was moved into place"""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """Request class that streams file parts to disk (see module docstring).
+
+    Endpoints listed in ``BULK_UPLOAD_ENDPOINTS`` (e.g. catalog imports)
+    accept requests and files up to ``BULK_UPLOAD_MAX_SIZE`` instead.
+    """
+
+    def _is_bulk(self):
+        return self.endpoint in current_app.config.get('BULK_UPLOAD_ENDPOINTS', ())
+
+    @property
+    def max_content_length(self):
+        if not current_app:
+            return None
+        config = current_app.config
+        return config['BULK_UPLOAD_MAX_SIZE'] if self._is_bulk() else config['MAX_CONTENT_LENGTH']
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        directory = config.get('UPLOAD_TMP_FOLDER') or config['UPLOAD_FOLDER']
+        os.makedirs(directory, exist_ok=True)
+        max_bytes = config['BULK_UPLOAD_MAX_SIZE'] if self._is_bulk() else config.get('MAX_UPLOAD_FILE_SIZE')
+        return UploadTempFile(directory, max_bytes)
+
+
+def save_upload(file, folder, allowed_types=IMAGE_TYPES):
+    """Validate an uploaded file and store it; returns ``(name, created)``.
+
+    The extension comes from the sniffed content, not the client's file
+    name. Raises ``UploadError`` for content that is not an allowed type.
+    """
+    stream = file.stream
+    if isinstance(stream, UploadTempFile):
+        kind = sniff_image(stream.head)
+        if kind not in allowed_types:
+            raise UploadError(kind)
+        stream.flush()
+        return blobstore.commit(folder, stream.path, stream.hexdigest(), kind)
+
+    # Streams not created by UploadRequest (e.g. a plain Request class)
+    return save_stream(stream, folder, allowed_types)
+
+
+def save_stream(stream, folder, allowed_types=IMAGE_TYPES):
+    """Like ``save_upload()`` for any seekable binary stream (e.g. a zip member)"""
+    head = stream.read(SNIFF_BYTES)
+    kind = sniff_image(head)
+    if kind not in allowed_types:
+        raise UploadError(kind)
+    stream.seek(0)
+    return blobstore.store(folder, stream, kind)
@@ -0,0 +1,168 @@
+"""Pool koneksi database yang dipakai ulang antar request.
+
+Pool ini tidak bergantung pada driver tertentu: cukup berikan ``factory``
+yang membuat koneksi baru (mysql.connector, sqlite3, dll).
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Tidak ada koneksi yang tersedia dalam batas waktu tunggu"""
+
+
+class PooledConnection:
+    """Pembungkus koneksi asli; ``close()`` mengembalikan koneksi ke pool.
+
+    Setiap checkout mendapat pembungkus baru, jadi ``close()`` kedua kali
+    (atau dari pembungkus lama) tidak berpengaruh pada pemakai berikutnya.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self.released = False
+        self._close_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self.released:
+            raise RuntimeError("Koneksi sudah dikembalikan ke pool")
+        return getattr(self._raw, name)
+
+    def close(self):
+        with self._close_lock:
+            if self.released:
+                return
+            self.released = True
+        self._pool._release(self._raw, self.created_at)
+
+
+def default_validate(raw):
+    """Cek koneksi masih hidup sebelum dipakai"""
+    if hasattr(raw, 'ping'):
+        raw.ping(reconnect=False)
+        return
+    cursor = raw.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class ConnectionPool:
+    def __init__(self, factory, size=5, timeout=10.0, recycle=3600, pre_ping=True, validate=default_validate):
+        """
+        factory  : fungsi tanpa argumen yang membuat koneksi baru
+        size     : jumlah maksimum koneksi (idle + dipakai)
+        timeout  : detik menunggu koneksi kosong sebelum PoolTimeout
+        recycle  : umur maksimum koneksi (detik), None = tidak dibatasi
+        pre_ping : validasi koneksi idle sebelum diberikan ke pemanggil
+        """
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.validate = validate
+
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('created', 'reused', 'recycled', 'invalidated', 'waits', 'timeouts'), 0)
+        self._in_use = 0
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise PoolTimeout(f"Tidak ada koneksi tersedia setelah {self.timeout} detik")
+
+        try:
+            conn = self._checkout_idle() or self._create()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """``with pool.connection() as db:`` mengembalikan koneksi otomatis"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(size=self.size, in_use=self._in_use, idle=len(self._idle))
+        return stats
+
+    def dispose(self):
+        """Tutup semua koneksi idle (misalnya saat shutdown atau setelah fork)"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for raw, _ in idle:
+            self._close_raw(raw)
+
+    def _checkout_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                raw, created_at = self._idle.pop()
+
+            if self.recycle is not None and time.monotonic() - created_at > self.recycle:
+                self._count('recycled')
+                self._close_raw(raw)
+                continue
+            if self.pre_ping:
+                try:
+                    self.validate(raw)
+                except Exception:
+                    self._count('invalidated')
+                    self._close_raw(raw)
+                    continue
+
+            self._count('reused')
+            return PooledConnection(self, raw, created_at)
+
+    def _create(self):
+        raw = self.factory()
+        self._count('created')
+        return PooledConnection(self, raw, time.monotonic())
+
+    def _release(self, raw, created_at):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            # Jangan bawa transaksi yang belum selesai ke pemakai berikutnya
+            raw.rollback()
+        except Exception:
+            self._count('invalidated')
+            self._close_raw(raw)
+        else:
+            with self._lock:
+                self._idle.append((raw, created_at))
+        finally:
+            self._slots.release()
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1